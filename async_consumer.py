@@ -0,0 +1,150 @@
+# asyncio consumer engine built on pika's AsyncioConnection.
+# Instead of one thread and one BlockingConnection per consumer, every queue
+# gets a single channel (spread over a few connections) and N logical
+# consumers run as coroutines on one event loop. Handlers may be coroutine
+# functions; plain functions are run in the loop's default executor.
+# A message whose handler raises is nacked with requeue=True and redelivered.
+import asyncio
+import inspect
+import logging
+import threading
+
+from transport import pika
+
+RABBITMQ_HOST = 'localhost'
+EXCHANGE_NAME = 'order_exchange'
+
+
+class AsyncConsumerEngine:
+    # routing_keys: queue name -> binding key
+    # consumers_per_queue: queue name -> number of logical consumers
+    # handler(queue_name, body, properties) -> result, passed on to on_processed(queue_name, result) after the ack
+    def __init__(self, routing_keys, consumers_per_queue, handler, on_processed=None, host=RABBITMQ_HOST,
+                 exchange_name=EXCHANGE_NAME, connections=2, prefetch_count=10):
+        self.routing_keys = routing_keys
+        self.consumers_per_queue = consumers_per_queue
+        self.handler = handler
+        self.on_processed = on_processed
+        self.parameters = pika.ConnectionParameters(host=host)
+        self.exchange_name = exchange_name
+        self.num_connections = connections
+        self.prefetch_count = prefetch_count  # per logical consumer, as with one OrderConsumer each
+
+        self.loop = None
+        self.thread = None
+        self.connections = []
+        self.channels = {}
+        self.workers = []
+        self.stopping = None
+
+    # Run the engine on a dedicated event loop thread
+    def start(self):
+        self.thread = threading.Thread(target=self._run_loop, name='async-consumer-engine', daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.run())
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread is not None:
+            self.thread.join()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for _ in range(self.num_connections):
+            self.connections.append(await self._open_connection())
+
+        for index, (queue_name, count) in enumerate(self.consumers_per_queue.items()):
+            connection = self.connections[index % len(self.connections)]
+            channel = await self._setup_channel(connection, queue_name, count)
+            deliveries = asyncio.Queue()
+            consumer_tag = channel.basic_consume(
+                queue=queue_name,
+                on_message_callback=lambda ch, method, props, body, q=deliveries: q.put_nowait((method, props, body)),
+            )
+            self.channels[queue_name] = (channel, consumer_tag)
+            for _ in range(count):
+                self.workers.append(asyncio.ensure_future(self._consume(queue_name, channel, deliveries)))
+            logging.info(f"Started {count} async consumers for {queue_name}")
+
+        await self.stopping.wait()
+        await self._shutdown()
+
+    def _callback_future(self):
+        future = self.loop.create_future()
+
+        def resolve(*args):
+            if not future.done():
+                future.set_result(args[-1] if args else None)
+        return future, resolve
+
+    async def _open_connection(self):
+        future, resolve = self._callback_future()
+
+        def on_error(connection, error):
+            if not future.done():
+                future.set_exception(pika.exceptions.AMQPConnectionError(error))
+
+        pika.adapters.asyncio_connection.AsyncioConnection(
+            self.parameters, on_open_callback=resolve, on_open_error_callback=on_error,
+            on_close_callback=self._on_connection_closed, custom_ioloop=self.loop)
+        return await future
+
+    def _on_connection_closed(self, connection, reason):
+        if not self.stopping.is_set():
+            logging.error(f"Async consumer connection closed: {reason}")
+            self.stopping.set()
+
+    async def _setup_channel(self, connection, queue_name, consumers):
+        future, resolve = self._callback_future()
+        connection.channel(on_open_callback=resolve)
+        channel = await future
+
+        steps = [
+            lambda cb: channel.exchange_declare(exchange=self.exchange_name, exchange_type='topic', callback=cb),
+            lambda cb: channel.queue_declare(queue=queue_name, durable=True, callback=cb),
+            lambda cb: channel.queue_bind(queue=queue_name, exchange=self.exchange_name,
+                                          routing_key=self.routing_keys[queue_name], callback=cb),
+            lambda cb: channel.basic_qos(prefetch_count=self.prefetch_count * consumers, callback=cb),
+        ]
+        for step in steps:
+            future, resolve = self._callback_future()
+            step(resolve)
+            await future
+        return channel
+
+    # One logical consumer: take the next delivery, handle it, ack it
+    async def _consume(self, queue_name, channel, deliveries):
+        while True:
+            method, properties, body = await deliveries.get()
+            try:
+                if inspect.iscoroutinefunction(self.handler):
+                    result = await self.handler(queue_name, body, properties)
+                else:
+                    result = await self.loop.run_in_executor(None, self.handler, queue_name, body, properties)
+            except Exception:
+                logging.exception(f"Handler failed for message from {queue_name}; requeueing it")
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                continue
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            if self.on_processed is not None:
+                self.on_processed(queue_name, result)
+
+    async def _shutdown(self):
+        for channel, consumer_tag in self.channels.values():
+            if channel.is_open:
+                channel.basic_cancel(consumer_tag)
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        for connection in self.connections:
+            if connection.is_open:
+                connection.close()
@@ -0,0 +1,103 @@
+# Micro-batch consumption with one acknowledgement per batch.
+# Deliveries are collected until batch_size are waiting or max_wait seconds
+# have passed since the first one, then handed to a batch handler together.
+# Successful messages are settled with a single basic_ack(multiple=True) on
+# the batch's highest successful tag; failures are nacked individually
+# with requeue=True, like WorkerPoolDispatcher, so the broker redelivers
+# them, and before that ack so it cannot cover them. multiple=True settles every outstanding tag up to the one
+# given, so a channel must carry exactly one BatchingConsumer.
+import logging
+
+
+# batch_handler(queue_name, messages) gets a list of (method, properties, body) and returns one result
+# per message, in order; an Exception instance as a result marks that message as failed.
+# Wraps a per-message handler(queue_name, body, properties) in that shape.
+def per_message(handler):
+    def batch_handler(queue_name, messages):
+        results = []
+        for method, properties, body in messages:
+            try:
+                results.append(handler(queue_name, body, properties))
+            except Exception as error:
+                logging.exception(f"Failed to process message from {queue_name}")
+                results.append(error)
+        return results
+    return batch_handler
+
+
+class BatchingConsumer:
+    # on_complete(queue_name, method, properties, result) runs for every successful message after the ack,
+    # the same hook WorkerPoolDispatcher uses
+    def __init__(self, channel, queue_name, batch_handler, batch_size=50, max_wait=0.05, on_complete=None):
+        self.channel = channel
+        self.queue_name = queue_name
+        self.batch_handler = batch_handler
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.on_complete = on_complete
+        self.batch = []
+        self.timer = None
+        self.consumer_tag = None
+
+    # Prefetch below batch_size would cap every batch at the prefetch count, so it is raised to batch_size
+    def consume(self, prefetch_count=None):
+        self.channel.basic_qos(prefetch_count=max(prefetch_count or 0, self.batch_size))
+        self.consumer_tag = self.channel.basic_consume(queue=self.queue_name, on_message_callback=self.on_message)
+        return self.consumer_tag
+
+    def on_message(self, ch, method, properties, body):
+        self.batch.append((method, properties, body))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.channel.connection.call_later(self.max_wait, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self.flush()
+
+    # Process and settle whatever is waiting; also call before closing the channel
+    def flush(self):
+        if self.timer is not None:
+            self.channel.connection.remove_timeout(self.timer)
+            self.timer = None
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        try:
+            results = self.batch_handler(self.queue_name, batch)
+            if len(results) != len(batch):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(batch)} messages")
+        except Exception as error:
+            logging.exception(f"Batch of {len(batch)} messages from {self.queue_name} failed")
+            results = [error] * len(batch)
+        self._settle(batch, results)
+
+    def _settle(self, batch, results):
+        if not self.channel.is_open:
+            # Unacked deliveries are requeued by the broker when the channel closes
+            return
+        last_success = None
+        failures = 0
+        for (method, properties, body), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                failures += 1
+            elif last_success is None or method.delivery_tag > last_success:
+                last_success = method.delivery_tag
+        if last_success is not None:
+            self.channel.basic_ack(delivery_tag=last_success, multiple=True)
+        if failures:
+            logging.warning(f"Requeued {failures} failed of {len(batch)} messages from {self.queue_name}")
+        if self.on_complete is None:
+            return
+        for (method, properties, body), result in zip(batch, results):
+            if not isinstance(result, Exception):
+                self.on_complete(self.queue_name, method, properties, result)
+
+    # Stop receiving, then process the partial batch before the caller closes the channel
+    def cancel(self):
+        if self.consumer_tag is not None and self.channel.is_open:
+            self.channel.basic_cancel(self.consumer_tag)
+            self.consumer_tag = None
+        self.flush()
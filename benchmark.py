@@ -0,0 +1,340 @@
+# Benchmark runner for the consumer and scheduler variants.
+# Every run starts one variant's consumers in a fresh child process (its
+# start function, with the module's own configuration), drives the same
+# named load profile at it from this process with load_generator, waits
+# for the backlog to drain and reads the variant's MetricsRegistry: every
+# variant records end-to-end 'latency' from the x-created-ns header and a
+# 'throughput' counter per processed message. CPU time and peak RSS come
+# from the child's resource usage, so the producer is not counted.
+#
+# --transport memory runs the variants on memory_broker instead of RabbitMQ.
+# The broker then lives in the child, so the child drives the load itself
+# (in one producer, on its main thread) and takes that thread's CPU time
+# back out; peak RSS still includes the producer and the queued messages.
+#
+# Each run is appended as one JSON line to the results file, and compared
+# with the same variant/profile pair in the baseline file; a metric worse
+# than its tolerance is reported as a regression (and the exit status is 1).
+# --save-baseline stores this run's results as the new baseline.
+import argparse
+import functools
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from codec import encode_order
+from latency_histogram import LatencyHistogram
+from load_generator import OrderSender, run_processes
+from stage_timing import stamp_published
+from transport import TRANSPORTS, pika
+
+RABBITMQ_HOST = 'localhost'
+RESULTS_FILE = 'benchmark_results.jsonl'
+BASELINE_FILE = 'benchmark_baseline.json'
+WARMUP = 3.0          # Seconds for a variant's consumers to connect before the load starts
+START_TIMEOUT = 60.0
+DRAIN_TIMEOUT = 120.0  # Seconds to wait after the last publish for the backlog to be processed
+
+ORDER_QUEUES = ['standard_orders', 'express_orders', 'priority_orders']
+# The stress tests' producer mix: three priority orders to one express and one standard
+ORDER_ROUTING_KEYS = ['order.priority'] * 3 + ['order.express', 'order.standard']
+
+# module: the script, start: its function that starts consuming (run on a daemon thread, so it may block),
+# queues: purged before every run, target: 'orders' publishes to order_exchange, 'direct' to the queues themselves
+VARIANTS = {
+    'consumer': {'module': 'consumer', 'start': 'start_consumers', 'queues': ORDER_QUEUES, 'target': 'orders'},
+    'scheduler': {'module': 'scheduler', 'start': 'start_consumers', 'queues': ORDER_QUEUES, 'target': 'orders'},
+    'nscheduler': {'module': 'nscheduler', 'start': 'start_consumers', 'queues': ORDER_QUEUES, 'target': 'orders'},
+    'stress_test_1': {'module': 'stress_test_1', 'start': 'start_consumers', 'queues': ORDER_QUEUES,
+                      'target': 'orders'},
+    'stree_test_2': {'module': 'stree_test_2', 'start': 'start_consumers', 'queues': ORDER_QUEUES,
+                     'target': 'orders'},
+    'new_final_s': {'module': 'new_final_s', 'start': 'start_consuming',
+                    'queues': ['example_queue_1', 'example_queue_2'], 'target': 'direct'},
+}
+
+# Named load_generator profiles; the handlers sleep 0.5-1 s per order, so rates are per few consumers
+PROFILES = {
+    'smoke': {'type': 'constant', 'rate': 2, 'duration': 10},
+    'steady': {'type': 'constant', 'rate': 10, 'duration': 60},
+    'poisson': {'type': 'poisson', 'rate': 10, 'duration': 60, 'seed': 7},
+    'ramp': {'type': 'ramp', 'start_rate': 1, 'end_rate': 30, 'duration': 60},
+    'spike': {'type': 'spike', 'base_rate': 2, 'spike_rate': 20, 'period': 30, 'spike_duration': 5, 'duration': 60},
+}
+
+# metric -> (which direction is better, relative change tolerated before it counts as a regression)
+REGRESSION_TOLERANCE = {
+    'throughput': ('higher', 0.10),
+    'latency_p50': ('lower', 0.10),
+    'latency_p99': ('lower', 0.15),
+    'cpu_seconds': ('lower', 0.20),
+    'max_rss_mb': ('lower', 0.20),
+}
+
+
+# Publishes orders straight to named queues through the default exchange, for scripts that consume those
+class DirectSender:
+    def __init__(self, queue_names, host=RABBITMQ_HOST):
+        self.queue_names = list(queue_names)
+        self.host = host
+        self.connection = None
+        self.channel = None
+
+    def __call__(self, index, intended_ns):
+        if self.channel is None:
+            self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+            self.channel = self.connection.channel()
+        order = {'order_id': f"load_{index}", 'customer_id': f"cust_{index % 100}", 'items': ['item_1']}
+        body, properties = encode_order(order, created_ns=intended_ns)
+        self.channel.basic_publish(exchange='', routing_key=self.queue_names[index % len(self.queue_names)],
+                                   body=body, properties=stamp_published(properties))
+
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+
+
+def sender_factory(spec, host=RABBITMQ_HOST):
+    if spec['target'] == 'direct':
+        return functools.partial(DirectSender, spec['queues'], host)
+    return functools.partial(OrderSender, ORDER_ROUTING_KEYS, host=host)
+
+
+def purge_queues(queue_names, host=RABBITMQ_HOST):
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
+    try:
+        for queue_name in queue_names:
+            # A missing queue closes the channel, so every purge gets a fresh one
+            channel = connection.channel()
+            try:
+                channel.queue_purge(queue_name)
+                channel.close()
+            except pika.exceptions.ChannelClosedByBroker:
+                pass  # Not declared yet; the variant declares it on start
+    finally:
+        connection.close()
+
+
+def _latency_totals(histograms):
+    merged = LatencyHistogram()
+    for (name, _), histogram in histograms.items():
+        if name == 'latency':
+            merged.merge(histogram)
+    return merged
+
+
+def _completed(counters):
+    return sum(value for (name, _), value in counters.items() if name == 'throughput')
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)  # Process-pool workers of 'process' execution mode
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+# Child process: start the variant, signal ready, then measure from 'go' until the published load is processed.
+# With a profile (in-memory transport) the child publishes it itself after 'go'.
+def _run_variant(variant, pipe, profile=None):
+    spec = VARIANTS[variant]
+    module = importlib.import_module(spec['module'])
+    threading.Thread(target=getattr(module, spec['start']), name=f"{variant}-start", daemon=True).start()
+    time.sleep(WARMUP)
+    pipe.send('ready')
+    pipe.recv()
+    counters, histograms = module.metrics.totals()
+    completed_before = _completed(counters)
+    latency_before = _latency_totals(histograms)
+    cpu_before = _cpu_seconds()
+    started = time.monotonic()
+
+    if profile is None:
+        sent = pipe.recv()
+        send_lag_p99 = producer_cpu = None
+    else:
+        producer_cpu = time.thread_time()
+        load = run_processes(profile, sender_factory(spec), 1)
+        producer_cpu = time.thread_time() - producer_cpu
+        sent, send_lag_p99 = load.sent, load.lag.percentile(99)
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while True:
+        counters, histograms = module.metrics.totals()
+        completed = _completed(counters) - completed_before
+        if completed >= sent or time.monotonic() >= deadline:
+            break
+        time.sleep(0.1)
+    duration = time.monotonic() - started
+    latency = _latency_totals(histograms).difference(latency_before)
+    pipe.send({
+        'sent': sent,
+        'send_lag_p99': send_lag_p99,
+        'completed': completed,
+        'duration': duration,
+        'latency': latency.summary(),
+        'cpu_seconds': _cpu_seconds() - cpu_before - (producer_cpu or 0.0),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+    })
+    pipe.close()
+    # Consumer threads of some variants are not daemons and never return
+    os._exit(0)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(variant, profile_name, processes=1, host=RABBITMQ_HOST, transport_name='rabbitmq'):
+    spec = VARIANTS[variant]
+    profile = PROFILES[profile_name]
+    in_memory = transport_name == 'memory'
+    if in_memory:
+        processes = 1
+    else:
+        purge_queues(spec['queues'], host)
+
+    # spawn: every run imports the variant into a clean interpreter, with no module state from earlier runs.
+    # The child inherits the environment, so its scripts pick the transport up when they are imported.
+    os.environ['ORDER_TRANSPORT'] = transport_name
+    context = multiprocessing.get_context('spawn')
+    pipe, child_pipe = context.Pipe()
+    child = context.Process(target=_run_variant, args=(variant, child_pipe, profile if in_memory else None),
+                            name=f"benchmark-{variant}")
+    child.start()
+    try:
+        if not pipe.poll(START_TIMEOUT + WARMUP):
+            raise RuntimeError(f"{variant} did not start within {START_TIMEOUT + WARMUP:.0f}s")
+        pipe.recv()
+        pipe.send('go')
+        load = None
+        if not in_memory:
+            load = run_processes(profile, sender_factory(spec, host), processes)
+            pipe.send(load.sent)
+        # In memory the child publishes the load too, so allow for the profile's own length
+        if not pipe.poll(DRAIN_TIMEOUT + 30 + (profile.get('duration', 0) if in_memory else 0)):
+            raise RuntimeError(f"{variant} did not report back after the {profile_name} load")
+        stats = pipe.recv()
+    finally:
+        child.join(5)
+        if child.is_alive():
+            child.kill()
+
+    latency = stats['latency']
+    sent = stats['sent']
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'transport': transport_name,
+        'variant': variant,
+        'profile': profile_name,
+        'processes': processes,
+        'sent': sent,
+        'completed': stats['completed'],
+        'drained': stats['completed'] >= sent,
+        'duration': round(stats['duration'], 3),
+        'throughput': round(stats['completed'] / stats['duration'], 3) if stats['duration'] else 0.0,
+        'latency_p50': latency['p50'],
+        'latency_p99': latency['p99'],
+        'latency_max': latency['max'],
+        'send_lag_p99': load.lag.percentile(99) if load is not None else stats['send_lag_p99'],
+        'cpu_seconds': round(stats['cpu_seconds'], 3),
+        'max_rss_mb': round(stats['max_rss_mb'], 1),
+    }
+
+
+# Baselines of RabbitMQ runs keep the plain variant/profile key; other transports are kept apart
+def baseline_key(result):
+    key = f"{result['variant']}/{result['profile']}"
+    transport_name = result.get('transport', 'rabbitmq')
+    return key if transport_name == 'rabbitmq' else f"{key}@{transport_name}"
+
+
+# Regression messages for result against the baseline record of the same variant and profile
+def regressions(result, baseline):
+    if baseline is None:
+        return []
+    found = []
+    if baseline.get('drained') and not result['drained']:
+        found.append(f"drained {result['completed']}/{result['sent']} (baseline drained)")
+    for metric, (better, tolerance) in REGRESSION_TOLERANCE.items():
+        before, after = baseline.get(metric), result.get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if (better == 'higher' and change < -tolerance) or (better == 'lower' and change > tolerance):
+            found.append(f"{metric} {before:g} -> {after:g} ({change:+.1%})")
+    return found
+
+
+def load_baseline(path=BASELINE_FILE):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    baseline = load_baseline(path)
+    for result in results:
+        baseline[baseline_key(result)] = result
+    with open(path, 'w') as target:
+        json.dump(baseline, target, indent=2, sort_keys=True)
+
+
+def append_results(results, path=RESULTS_FILE):
+    with open(path, 'a') as target:
+        for result in results:
+            target.write(json.dumps(result) + '\n')
+
+
+def describe_result(result):
+    return (f"{result['variant']:<14} {result['profile']:<8} sent {result['sent']:>6} "
+            f"done {result['completed']:>6} {result['throughput']:>8.2f} msg/s "
+            f"p50 {result['latency_p50']:.3f}s p99 {result['latency_p99']:.3f}s "
+            f"cpu {result['cpu_seconds']:.2f}s rss {result['max_rss_mb']:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark consumer variants under named load profiles.")
+    parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS), default=sorted(VARIANTS))
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['smoke'])
+    parser.add_argument('--processes', type=int, default=1, help="Producer processes for the load (RabbitMQ only)")
+    parser.add_argument('--transport', choices=TRANSPORTS, default='rabbitmq',
+                        help="memory runs each variant and its load on the in-process broker")
+    parser.add_argument('--host', default=RABBITMQ_HOST)
+    parser.add_argument('--results', default=RESULTS_FILE, help="JSONL file the runs are appended to")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store these runs as the new baseline")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results = []
+    failed = False
+    for profile_name in args.profiles:
+        for variant in args.variants:
+            result = run_benchmark(variant, profile_name, args.processes, args.host, args.transport)
+            result['regressions'] = regressions(result, baseline.get(baseline_key(result)))
+            results.append(result)
+            print(describe_result(result))
+            for regression in result['regressions']:
+                print(f"    REGRESSION {regression}")
+            failed = failed or bool(result['regressions'])
+    append_results(results, args.results)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
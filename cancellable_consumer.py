@@ -0,0 +1,110 @@
+# Consumer thread that can be stopped gracefully.
+# Each consumer owns its connection and channel. request_stop() asks the
+# consumer's own thread to cancel its subscription (via
+# add_callback_threadsafe, which only runs between deliveries, so the
+# message being handled finishes and is acked first); the thread then
+# waits for work still in a worker pool to settle and closes the channel
+# and connection by the deadline. wait_stopped() joins it, so several
+# consumers can be signalled at once and joined against one deadline;
+# stop() does both. Anything still unacked when the channel closes is
+# requeued by the broker.
+import logging
+import threading
+import time
+
+from transport import pika
+
+RABBITMQ_HOST = 'localhost'
+
+
+class CancellableConsumer(threading.Thread):
+    # on_message(ch, method, properties, body) handles deliveries inline;
+    # pass a WorkerPoolDispatcher as dispatcher to offload them instead.
+    # setup(channel) declares whatever the queue needs before consuming.
+    # prefetch_controller(channel) -> PrefetchController tunes basic_qos at runtime.
+    def __init__(self, queue_name, on_message=None, prefetch_count=1, setup=None, dispatcher=None,
+                 host=RABBITMQ_HOST, prefetch_controller=None):
+        threading.Thread.__init__(self, name=f"consumer-{queue_name}", daemon=True)
+        self.queue_name = queue_name
+        self.on_message = on_message
+        self.prefetch_count = prefetch_count
+        self.dispatcher = dispatcher
+        self.deadline = None
+        self.stopping = False
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
+        self.channel = self.connection.channel()
+        if setup is not None:
+            setup(self.channel)
+        self.controller = prefetch_controller(self.channel) if prefetch_controller is not None else None
+        if dispatcher is not None:
+            self.consumer_tag = dispatcher.consume(self.channel, queue_name, prefetch_count, controller=self.controller)
+        elif self.controller is not None:
+            self.controller.attach()
+            self.consumer_tag = self.channel.basic_consume(queue=queue_name,
+                                                           on_message_callback=self.controller.wrap(on_message))
+        else:
+            self.channel.basic_qos(prefetch_count=prefetch_count)
+            self.consumer_tag = self.channel.basic_consume(queue=queue_name, on_message_callback=on_message)
+
+    def run(self):
+        try:
+            self.channel.start_consuming()
+            self._drain()
+        except pika.exceptions.ConnectionClosedByBroker:
+            logging.error(f"Connection to {self.queue_name} closed by broker.")
+        except pika.exceptions.AMQPError:
+            if not self.stopping:
+                logging.exception(f"Consumer for {self.queue_name} failed")
+        finally:
+            self._close()
+
+    # Called from any thread; signals the consumer to finish within timeout seconds and returns at once
+    def request_stop(self, timeout=10):
+        self.stopping = True
+        self.deadline = time.monotonic() + timeout
+        try:
+            self.connection.add_callback_threadsafe(self._cancel)
+        except pika.exceptions.AMQPError:
+            pass  # Connection already gone; run() is on its way out
+
+    # Join until the deadline (request_stop()'s by default); returns True when the consumer exited
+    def wait_stopped(self, deadline=None):
+        deadline = self.deadline if deadline is None else deadline
+        self.join(max(0.0, deadline - time.monotonic()))
+        if self.is_alive():
+            logging.warning(f"Consumer for {self.queue_name} did not stop by its deadline")
+            return False
+        return True
+
+    # Called from any thread; returns True when the consumer exited within the timeout
+    def stop(self, timeout=10):
+        self.request_stop(timeout)
+        return self.wait_stopped()
+
+    # Runs on the consumer thread between deliveries
+    def _cancel(self):
+        if self.channel.is_open:
+            # Messages prefetched but not yet dispatched are rejected back to the queue
+            self.channel.basic_cancel(self.consumer_tag)
+            self.channel.stop_consuming()
+
+    # Let deliveries still in the worker pool finish and be acked before closing
+    def _drain(self):
+        if self.dispatcher is None:
+            return
+        deadline = self.deadline or time.monotonic()
+        while self.dispatcher.pending(self.channel) and time.monotonic() < deadline:
+            self.connection.process_data_events(time_limit=0.1)
+        left = self.dispatcher.pending(self.channel)
+        if left:
+            logging.warning(f"Closing {self.queue_name} consumer with {left} unfinished messages; broker will requeue them")
+
+    def _close(self):
+        if self.dispatcher is not None:
+            self.dispatcher.release(self.channel)
+        for resource in (self.channel, self.connection):
+            try:
+                if resource.is_open:
+                    resource.close()
+            except pika.exceptions.AMQPError:
+                pass
@@ -0,0 +1,241 @@
+# Publisher with asynchronous confirms and a bounded in-flight window.
+# BlockingChannel.confirm_delivery waits for every single confirm. Here the
+# connection runs on its own I/O thread (SelectConnection), publishes are
+# pipelined and only block once `window` messages are still unconfirmed.
+# Nacked messages are collected and re-published as one batch.
+import collections
+import functools
+import logging
+import threading
+import time
+
+from latency_histogram import LatencyHistogram
+from stage_timing import stamp_published
+from transport import pika
+
+RABBITMQ_HOST = 'localhost'
+EXCHANGE_NAME = 'order_exchange'
+
+
+class PendingPublish:
+    def __init__(self, exchange, routing_key, body, properties):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.body = body
+        self.properties = properties
+        self.attempts = 0
+        self.sent_at = None
+
+
+class ConfirmingPublisher:
+    def __init__(self, host=RABBITMQ_HOST, exchange_name=EXCHANGE_NAME, exchange_type='topic',
+                 window=256, max_retries=3, reconnect_delay=1.0):
+        self.parameters = pika.ConnectionParameters(host=host)
+        self.exchange_name = exchange_name
+        self.exchange_type = exchange_type
+        self.window = window
+        self.max_retries = max_retries
+        self.reconnect_delay = reconnect_delay
+
+        self.ioloop = pika.adapters.select_connection.IOLoop()
+        self.connection = None
+        self.channel = None
+        self.ready = threading.Event()
+        self.closing = False
+        self.thread = None
+
+        # Window accounting is shared between publishing threads and the I/O thread
+        self.cond = threading.Condition()
+        self.in_flight = 0
+
+        # Only touched on the I/O thread
+        self.pending = collections.OrderedDict()  # delivery tag -> PendingPublish
+        self.next_tag = 0
+        self.backlog = []  # publishes waiting for the channel to (re)open
+        self.retry_batch = []
+        self.retry_scheduled = False
+
+        # Confirm statistics; the latency histogram is swapped out by snapshot()
+        self.confirmed = 0
+        self.nacked = 0
+        self.retried = 0
+        self.failed = 0
+        self.confirm_latencies = LatencyHistogram()
+
+    def start(self, timeout=10):
+        self.thread = threading.Thread(target=self._run, name='confirming-publisher', daemon=True)
+        self.thread.start()
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"Publisher channel not ready after {timeout}s")
+
+    def _run(self):
+        self._connect()
+        self.ioloop.start()
+
+    def _connect(self):
+        self.connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self.ioloop,
+        )
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        logging.error(f"Confirming publisher failed to connect: {error}")
+        self.ioloop.call_later(self.reconnect_delay, self._connect)
+
+    def _on_connection_closed(self, connection, reason):
+        self.channel = None
+        self.ready.clear()
+        if self.closing:
+            self.ioloop.stop()
+            return
+        logging.warning(f"Confirming publisher connection closed: {reason}, reconnecting")
+        # Whatever was unconfirmed is treated as lost and goes out again
+        self.backlog = list(self.pending.values()) + self.backlog
+        self.pending.clear()
+        self.next_tag = 0
+        self.ioloop.call_later(self.reconnect_delay, self._connect)
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.exchange_declare(exchange=self.exchange_name, exchange_type=self.exchange_type,
+                                 callback=self._on_exchange_declared)
+
+    def _on_channel_closed(self, channel, reason):
+        if not self.closing and self.connection.is_open:
+            self.connection.close()
+
+    def _on_exchange_declared(self, frame):
+        self.channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=self._on_confirm_selected)
+
+    def _on_confirm_selected(self, frame):
+        backlog, self.backlog = self.backlog, []
+        for pending in backlog:
+            self._send(pending)
+        self.ready.set()
+
+    # Called from any thread; blocks only while the window is full
+    def publish(self, routing_key, body, properties=None, exchange=None):
+        exchange = self.exchange_name if exchange is None else exchange
+        with self.cond:
+            while self.in_flight >= self.window:
+                self.cond.wait()
+            self.in_flight += 1
+        pending = PendingPublish(exchange, routing_key, body, properties)
+        self.ioloop.add_callback_threadsafe(functools.partial(self._send, pending))
+
+    # Same call shape as channel.basic_publish so existing publish_order helpers can use it
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.publish(routing_key, body, properties, exchange=exchange)
+
+    def _send(self, pending):
+        if self.channel is None or not self.channel.is_open:
+            self.backlog.append(pending)
+            return
+        self.next_tag += 1
+        pending.sent_at = time.monotonic()
+        self.pending[self.next_tag] = pending
+        self.channel.basic_publish(exchange=pending.exchange, routing_key=pending.routing_key,
+                                   body=pending.body, properties=stamp_published(pending.properties))
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = []
+            for tag in self.pending:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self.pending else []
+
+        now = time.monotonic()
+        released = 0
+        for tag in tags:
+            pending = self.pending.pop(tag)
+            if isinstance(method, pika.spec.Basic.Ack):
+                self.confirmed += 1
+                self.confirm_latencies.record(now - pending.sent_at)
+                released += 1
+            else:
+                self.nacked += 1
+                self.retry_batch.append(pending)
+        if self.retry_batch and not self.retry_scheduled:
+            # Coalesce all nacks that arrive in this I/O loop pass into one retry batch
+            self.retry_scheduled = True
+            self.ioloop.call_later(0, self._flush_retries)
+        self._release(released)
+
+    def _flush_retries(self):
+        batch, self.retry_batch = self.retry_batch, []
+        self.retry_scheduled = False
+        dropped = 0
+        for pending in batch:
+            if pending.attempts < self.max_retries:
+                pending.attempts += 1
+                self.retried += 1
+                self._send(pending)
+            else:
+                self.failed += 1
+                dropped += 1
+                logging.error(f"Dropping message to {pending.routing_key} after {pending.attempts} retries")
+        if batch:
+            logging.warning(f"Re-published {len(batch) - dropped} nacked messages, dropped {dropped}")
+        self._release(dropped)
+
+    def _release(self, count):
+        if count:
+            with self.cond:
+                self.in_flight -= count
+                self.cond.notify_all()
+
+    # Wait until every publish so far has been confirmed or given up on
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        self.flush(timeout)
+        self.closing = True
+        self.ioloop.add_callback_threadsafe(self._close_connection)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _close_connection(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        else:
+            self.ioloop.stop()
+
+    # Counters plus confirm latency over the interval since the last snapshot
+    def snapshot(self):
+        latencies, self.confirm_latencies = self.confirm_latencies, LatencyHistogram()
+        return {
+            'confirmed': self.confirmed,
+            'nacked': self.nacked,
+            'retried': self.retried,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'avg_confirm_latency': latencies.mean(),
+            'p99_confirm_latency': latencies.percentile(99),
+            'max_confirm_latency': latencies.max,
+        }
+
+    def log_stats(self):
+        stats = self.snapshot()
+        logging.info(f"Publisher confirms - Confirmed: {stats['confirmed']}, Nacked: {stats['nacked']}, "
+                     f"Retried: {stats['retried']}, Failed: {stats['failed']}, In flight: {stats['in_flight']}, "
+                     f"Avg Confirm Latency: {stats['avg_confirm_latency'] * 1000:.2f}ms, "
+                     f"p99: {stats['p99_confirm_latency'] * 1000:.2f}ms, Max: {stats['max_confirm_latency'] * 1000:.2f}ms")
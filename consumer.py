@@ -1,19 +1,28 @@
 
 #this is just a baseline scheduler that handles spikey messages and makes file order_processing_baseline.log
-import pika
 import time
-import json
 import threading
 import logging
 from datetime import datetime
-from collections import defaultdict
+
+from batch_consumer import BatchingConsumer, per_message
+from codec import decode_order, encode_order, latency_seconds
+from log_writer import BatchedLogHandler
+from publisher_pool import get_publisher_pool
+from metrics_http import ConsumerGauges, serve_metrics
+from metrics_registry import MetricsRegistry
+from prefetch_controller import PrefetchController, log_prefetch
+from queue_sampler import QueueDepthSampler
+from stage_timing import StageTimer, log_stages
+from transport import pika
+from worker_pool import WorkerPoolDispatcher
 
 # Set up logging to save only critical performance metrics to a file
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("order_processing_baseline.log")  # Log to file only
+        BatchedLogHandler("order_processing_baseline.log")  # Log to file only
     ]
 )
 
@@ -29,12 +38,23 @@ ROUTING_KEYS = {
     'express': 'order.express',
     'priority': 'order.priority'
 }
+MESSAGE_CODEC = 'json'  # 'json' or the compact 'binary' codec; consumers pick it from content_type
 
-# Metrics storage for latency and throughput
-metrics = {
-    'latency': defaultdict(list),
-    'throughput': defaultdict(int)
-}
+# 'inline' handles messages on the connection thread; 'thread' or 'process' offloads them to a worker pool
+EXECUTION_MODE = 'inline'
+WORKER_POOL_SIZE = 4
+dispatcher = None
+# Queues consumed inline in micro-batches: up to N deliveries or BATCH_MAX_WAIT seconds, one ack per batch
+BATCH_SIZES = {'standard_orders': 10}
+BATCH_MAX_WAIT = 0.05
+# Tune each consumer's basic_qos at runtime, starting from the prefetch counts in adjust_workers
+ADAPTIVE_PREFETCH = True
+# Prometheus text endpoint on localhost (counters, latency histograms, queue and consumer gauges); None disables it
+METRICS_PORT = 9101
+gauges = None
+
+# Metrics storage for latency and throughput, sharded per consumer thread
+metrics = MetricsRegistry()
 
 # Connect to RabbitMQ, declare exchange, and bind queue
 def connect(queue_name, prefetch_count):
@@ -49,29 +69,60 @@ def connect(queue_name, prefetch_count):
     channel.basic_qos(prefetch_count=prefetch_count)  # Control the number of unacknowledged messages
     return channel, connection
 
-# Process each message and log processing times
-def process_message(ch, method, properties, body):
+# Handle one order and return its processing time; top-level so a process pool can run it
+def handle_order(queue_name, body, properties):
     start_time = datetime.now()
-    message = json.loads(body)
+    decode_order(body, properties)  # Decoded as a real handler would; the simulated work doesn't read it
     
     time.sleep(1)  # Simulate processing time
     
-    ch.basic_ack(delivery_tag=method.delivery_tag)
     end_time = datetime.now()
-    
-    # Calculate and log processing time (latency)
-    processing_time = (end_time - start_time).total_seconds()
-    queue_name = method.routing_key.split('.')[1]
-    
-    # Record latency and increment throughput
-    metrics['latency'][queue_name].append(processing_time)
-    metrics['throughput'][queue_name] += 1
+    return (end_time - start_time).total_seconds()
+
+# Record processing time, end-to-end latency and throughput, keyed by order type
+def record_metrics(queue_name, method, properties, processing_time):
+    order_type = method.routing_key.split('.')[1]
+    metrics.observe('service_time', order_type, processing_time)
+    # Latency from the x-created-ns header, so it includes the time spent queued
+    latency = latency_seconds(properties)
+    if latency is not None:
+        metrics.observe('latency', order_type, latency)
+    metrics.increment('throughput', order_type)
+
+# Process each message and log processing times
+def process_message(ch, method, properties, body):
+    queue_name = QUEUE_NAMES[method.routing_key.split('.')[1]]
+    timer = StageTimer(properties)
+    timer.start()
+    processing_time = handle_order(queue_name, body, properties)
+    timer.finish()
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    timer.ack()
+    timer.record(metrics, queue_name)  # Where the end-to-end latency went: producer, queue, wait, service, ack
+    record_metrics(queue_name, method, properties, processing_time)
 
 # Start consumers for each queue type, with configurable prefetch count
 def start_consumer(queue_name, prefetch_count=10, num_workers=1):
     for _ in range(num_workers):
         channel, connection = connect(queue_name, prefetch_count)
-        channel.basic_consume(queue=queue_name, on_message_callback=process_message)
+        controller = None
+        if ADAPTIVE_PREFETCH and (dispatcher is not None or queue_name not in BATCH_SIZES):
+            # With the worker pool, the dispatcher sets the controller's share of the workers
+            controller = PrefetchController(channel, queue_name, initial=prefetch_count, metrics=metrics)
+        if gauges is not None:
+            gauges.add(queue_name, channel, prefetch_count, controller)
+        if dispatcher is not None:
+            # Prefetch also bounds how many of this channel's messages sit in the worker pool
+            dispatcher.consume(channel, queue_name, prefetch_count, controller=controller)
+        elif queue_name in BATCH_SIZES:
+            batcher = BatchingConsumer(channel, queue_name, per_message(handle_order), batch_size=BATCH_SIZES[queue_name],
+                                       max_wait=BATCH_MAX_WAIT, on_complete=record_metrics)
+            batcher.consume(prefetch_count)
+        elif controller is not None:
+            controller.attach()
+            channel.basic_consume(queue=queue_name, on_message_callback=controller.wrap(process_message))
+        else:
+            channel.basic_consume(queue=queue_name, on_message_callback=process_message)
         threading.Thread(target=channel.start_consuming).start()
 
 # Function to dynamically allocate workers based on queue backlog
@@ -96,34 +147,51 @@ def load_test():
 # Log performance metrics periodically
 def log_metrics():
     while True:
-        for queue_name, latencies in metrics['latency'].items():
-            avg_latency = sum(latencies) / len(latencies) if latencies else 0
-            throughput = metrics['throughput'][queue_name] / 5  # messages per second, measured over 5 seconds
+        # Merge the consumer shards; every line reports one 5 second window
+        counters, histograms = metrics.collect()
+        for (name, queue_name), latencies in histograms.items():
+            if name != 'latency':
+                continue
+            throughput = counters.get(('throughput', queue_name), 0) / 5  # messages per second, measured over 5 seconds
             # Log only essential metrics to the file
-            logging.info(f"{queue_name} - Avg Latency: {avg_latency:.2f}s, Throughput: {throughput:.2f} orders/sec")
-            # Reset throughput for the next interval
-            metrics['throughput'][queue_name] = 0
+            logging.info(f"{queue_name} - Avg Latency: {latencies.mean():.2f}s, {latencies.describe()}, Throughput: {throughput:.2f} orders/sec")
+        for queue_name in QUEUE_NAMES.values():
+            log_prefetch(counters, histograms, queue_name)
+            log_stages(histograms, queue_name)
         time.sleep(5)
 
 # Function to simulate order creation for testing
 def publish_order(order_type, order_data):
-    channel, connection = connect(QUEUE_NAMES[order_type], prefetch_count=1)
     routing_key = ROUTING_KEYS[order_type]
     message = {
         'order_id': order_data['order_id'],
         'customer_id': order_data['customer_id'],
-        'items': order_data['items'],
-        'timestamp': datetime.now().isoformat()
+        'items': order_data['items']
     }
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=json.dumps(message))
-    connection.close()
+    # The creation time travels as epoch nanoseconds in the message headers
+    body, properties = encode_order(message, MESSAGE_CODEC)
+    get_publisher_pool(exchange_name=EXCHANGE_NAME).publish(routing_key, body, properties)
+
+# Create the worker pool (if any) and start the consumers; benchmark.py calls this too
+def start_consumers():
+    global dispatcher, gauges
+    if EXECUTION_MODE != 'inline':
+        dispatcher = WorkerPoolDispatcher(handle_order, on_complete=record_metrics,
+                                          mode=EXECUTION_MODE, max_workers=WORKER_POOL_SIZE, stage_metrics=metrics)
+    if METRICS_PORT is not None:
+        sampler = QueueDepthSampler(QUEUE_NAMES.values())
+        sampler.start()
+        gauges = ConsumerGauges(metrics, sampler, dispatcher)
+        serve_metrics(metrics, METRICS_PORT)
+
+    # Start consumers with fixed allocation (baseline test)
+    adjust_workers()
 
 if __name__ == '__main__':
     # Start logging metrics in a separate thread
     threading.Thread(target=log_metrics, daemon=True).start()
-    
-    # Start consumers with fixed allocation (baseline test)
-    adjust_workers()
+
+    start_consumers()
 
     # Simulate load testing by publishing sample messages
     load_test()
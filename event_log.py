@@ -0,0 +1,136 @@
+# Compact binary event log for consumer telemetry.
+# An alternative to the "[ts] [Consumer-N] Received: ..." text lines: each
+# event is a fixed 24-byte little-endian record packed into a preallocated
+# block that is appended to the file in one write when it fills up. The
+# reader memory-maps the file as a NumPy structured array, so loading a run
+# is zero-copy and analysis works on columns directly.
+#
+# File layout: 16-byte header (magic, version, record size), then records of
+#   event u1 | flags u1 | consumer u2 | queue u2 | reserved u2 | sequence u8 | timestamp_ns i8
+# An EVENT_CREATED record carries a message's creation time (x-created-ns)
+# for the received event with the same consumer and sequence, so end-to-end
+# latency can be computed from the log.
+import atexit
+import struct
+import time
+
+import numpy as np
+
+from log_ingest import ConsumerLog
+
+MAGIC = b"CEVLOG\x00\x01"
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+RECORD = struct.Struct('<BBHHHQq')
+RECORD_DTYPE = np.dtype([
+    ('event', '<u1'),
+    ('flags', '<u1'),
+    ('consumer', '<u2'),
+    ('queue', '<u2'),
+    ('reserved', '<u2'),
+    ('sequence', '<u8'),
+    ('timestamp_ns', '<i8'),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+EVENT_RECEIVED = 1
+EVENT_PROCESSED = 2
+EVENT_FAILED = 3
+EVENT_CREATED = 4
+
+SEQUENCE_BITS = 48  # Sequences (delivery tags) are matched within a consumer below this
+
+
+class EventLogWriter:
+    # Not thread-safe: give each consumer thread its own writer (and file), or
+    # only record from the connection thread as new_final_s does
+    def __init__(self, path, block_records=4096):
+        self.path = path
+        self.block = bytearray(RECORD.size * block_records)
+        self.offset = 0
+        self.closed = False
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+        atexit.register(self.close)
+
+    def record(self, event, consumer, queue, sequence, timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        RECORD.pack_into(self.block, self.offset, event, 0, consumer, queue, 0, sequence, timestamp_ns)
+        self.offset += RECORD.size
+        if self.offset == len(self.block):
+            self.flush()
+
+    def flush(self):
+        if self.offset:
+            self.file.write(memoryview(self.block)[:self.offset])
+            self.offset = 0
+        self.file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.file.close()
+
+
+# Memory-map path as a structured array with RECORD_DTYPE fields; a torn last record is ignored
+def read_events(path):
+    with open(path, 'rb') as source:
+        header = source.read(HEADER.size)
+        source.seek(0, 2)
+        size = source.tell()
+    if len(header) < HEADER.size:
+        raise ValueError(f"{path} is not an event log: file too short")
+    magic, version, record_size, _ = HEADER.unpack(header)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError(f"{path} is not an event log (magic {magic!r}, record size {record_size})")
+    if version != VERSION:
+        raise ValueError(f"{path} has unsupported event log version {version}")
+    count = (size - HEADER.size) // RECORD.size
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+
+
+# (consumer, queue, seconds) arrays: receive time minus creation time of every received event
+# that has an EVENT_CREATED record for the same consumer and sequence
+def latencies(events):
+    received = events[events['event'] == EVENT_RECEIVED]
+    created = events[events['event'] == EVENT_CREATED]
+    created_keys = _keys(created)
+    order = np.argsort(created_keys, kind='stable')
+    created_keys, created_ns = created_keys[order], created['timestamp_ns'][order]
+    received_keys = _keys(received)
+    index = np.minimum(np.searchsorted(created_keys, received_keys), max(len(created_keys) - 1, 0))
+    matched = created_keys[index] == received_keys if len(created_keys) else np.zeros(len(received), dtype=bool)
+    received = received[matched]
+    seconds = (received['timestamp_ns'] - created_ns[index[matched]]) / 1e9
+    return received['consumer'].astype(np.int64), received['queue'].astype(np.int64), seconds
+
+
+def _keys(events):
+    mask = np.uint64((1 << SEQUENCE_BITS) - 1)
+    return (events['consumer'].astype(np.uint64) << np.uint64(SEQUENCE_BITS)) | (events['sequence'] & mask)
+
+
+# Same {consumer_id: ConsumerLog} shape as log_ingest.ingest, for log_analytics.
+# Times become int epoch seconds; processed is the running count of received events.
+def to_consumer_logs(events):
+    received = events[events['event'] == EVENT_RECEIVED]
+    order = np.argsort(received['consumer'], kind='stable')
+    received = received[order]
+    consumers, starts = np.unique(received['consumer'], return_index=True)
+    logs = {}
+    for consumer, part in zip(consumers.tolist(), np.split(received, starts[1:])):
+        received_at = part['timestamp_ns'] // 1_000_000_000
+        logs[str(consumer)] = ConsumerLog(
+            received_at,
+            part['sequence'].astype(np.int64),
+            part['queue'].astype(np.int64),
+            received_at,
+            np.arange(1, len(part) + 1, dtype=np.int64),
+        )
+    return logs
@@ -0,0 +1,221 @@
+# Weighted-fair dispatch of several queues onto one shared worker pool.
+# A single I/O thread consumes every queue over one connection and parks
+# deliveries in per-queue local buffers; `workers` threads take the next
+# message across all buffers. Queues listed in `strict` are always served
+# first, in the order given; the rest share the workers by weight using
+# virtual finish times (weighted fair queueing), so a queue with weight 3
+# gets three times the turns of a weight-1 queue while both have work. A
+# worker never waits while any buffer holds a message, so idle capacity
+# flows to whichever class has a backlog. Acks go back to the I/O thread
+# with add_callback_threadsafe; a message whose handler raises is nacked
+# with requeue=True so the broker redelivers it.
+#
+# Each queue's prefetch defaults to PREFETCH_MULTIPLE times its share of
+# the workers, so the local buffers hold a little more than the workers
+# will take next instead of hiding a large part of the backlog from other
+# consumers. On stop() the subscriptions are cancelled and every buffered
+# message is nacked back to its queue before the connection closes.
+import functools
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from stage_timing import StageTimer
+from transport import pika
+
+RABBITMQ_HOST = 'localhost'
+PREFETCH_MULTIPLE = 1.5
+
+
+class FairDispatcher:
+    # handler(queue_name, body, properties) -> result runs on a worker thread;
+    # on_complete(queue_name, method, properties, result) runs on the I/O thread after the ack.
+    # setup(channel, queue_name) declares and binds a queue before it is consumed.
+    # prefetch bounds each queue's local buffer plus in-flight messages: one count for every queue,
+    # a dict per queue, or by default PREFETCH_MULTIPLE times the queue's share of the workers
+    # (strict queues count with the largest weight).
+    # stage_metrics (a MetricsRegistry) records every message's stage timings under its queue name.
+    def __init__(self, handler, weights, strict=(), workers=8, prefetch=None, on_complete=None, setup=None,
+                 host=RABBITMQ_HOST, stage_metrics=None):
+        self.handler = handler
+        self.weights = dict(weights)
+        self.strict = list(strict)
+        self.queue_names = self.strict + [name for name in self.weights if name not in self.strict]
+        self.workers = workers
+        self.prefetch = self._prefetch_counts(prefetch)
+        self.on_complete = on_complete
+        self.setup = setup
+        self.host = host
+        self.stage_metrics = stage_metrics
+
+        self.condition = threading.Condition()
+        self.buffers = {name: deque() for name in self.queue_names}
+        self.virtual_time = {name: 0.0 for name in self.weights if name not in self.strict}
+        self.dispatched = {name: 0 for name in self.queue_names}
+        self.in_flight = 0
+        self.stopping = False
+        self.deadline = None
+
+        self.connection = None
+        self.channel = None
+        self.consumer_tags = []
+        self.io_thread = None
+        self.worker_threads = []
+
+    # queue name -> prefetch count
+    def _prefetch_counts(self, prefetch):
+        if isinstance(prefetch, dict):
+            return {name: prefetch[name] for name in self.queue_names}
+        if prefetch:
+            return {name: prefetch for name in self.queue_names}
+        strict_weight = max(self.weights.values(), default=1)
+        weights = {name: strict_weight if name in self.strict else self.weights[name] for name in self.queue_names}
+        total = sum(weights.values())
+        return {name: max(1, math.ceil(PREFETCH_MULTIPLE * self.workers * weight / total))
+                for name, weight in weights.items()}
+
+    def start(self):
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        self.channel = self.connection.channel()
+        for queue_name in self.queue_names:
+            if self.setup is not None:
+                self.setup(self.channel, queue_name)
+            # Per-consumer prefetch: set before each basic_consume
+            self.channel.basic_qos(prefetch_count=self.prefetch[queue_name])
+            self.consumer_tags.append(self.channel.basic_consume(
+                queue=queue_name, on_message_callback=functools.partial(self._on_message, queue_name)))
+        self.io_thread = threading.Thread(target=self._run_io, name='fair-dispatcher-io', daemon=True)
+        self.io_thread.start()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run_worker, name=f"fair-worker-{index}", daemon=True)
+            thread.start()
+            self.worker_threads.append(thread)
+
+    # Stop taking new work and requeue the buffered messages, let running handlers finish and be acked, then close
+    def stop(self, timeout=10):
+        self.deadline = time.monotonic() + timeout
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        try:
+            self.connection.add_callback_threadsafe(self._cancel)
+        except pika.exceptions.AMQPError:
+            pass
+        for thread in self.worker_threads:
+            thread.join(max(0.0, self.deadline - time.monotonic()))
+        self.io_thread.join(max(0.0, self.deadline - time.monotonic()))
+
+    # Messages handed to workers per queue since start
+    def snapshot(self):
+        with self.condition:
+            return {name: {'dispatched': self.dispatched[name], 'buffered': len(self.buffers[name])}
+                    for name in self.queue_names}
+
+    def _run_io(self):
+        try:
+            self.channel.start_consuming()
+            # Deliver the acks of handlers that were still running when consuming stopped
+            while self.in_flight and time.monotonic() < (self.deadline or 0):
+                self.connection.process_data_events(time_limit=0.1)
+        except pika.exceptions.AMQPError:
+            if not self.stopping:
+                logging.exception("Fair dispatcher connection failed")
+        finally:
+            try:
+                if self.connection.is_open:
+                    self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+    # I/O thread: cancel the subscriptions, nack every buffered message back to its queue and stop consuming
+    def _cancel(self):
+        if self.channel.is_open:
+            for consumer_tag in self.consumer_tags:
+                self.channel.basic_cancel(consumer_tag)
+            with self.condition:
+                buffered = [entry for buffer in self.buffers.values() for entry in buffer]
+                for buffer in self.buffers.values():
+                    buffer.clear()
+            for method, _, _, _ in buffered:
+                self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            if buffered:
+                logging.info(f"Fair dispatcher requeued {len(buffered)} buffered messages")
+        self.channel.stop_consuming()
+
+    # I/O thread
+    def _on_message(self, queue_name, ch, method, properties, body):
+        if self.stopping:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        with self.condition:
+            buffer = self.buffers[queue_name]
+            if not buffer and queue_name in self.virtual_time:
+                # A queue coming back from idle starts level with the busiest one instead of cashing in saved turns
+                active = [self.virtual_time[name] for name in self.virtual_time if self.buffers[name]]
+                if active:
+                    self.virtual_time[queue_name] = max(self.virtual_time[queue_name], min(active))
+            timer = StageTimer(properties) if self.stage_metrics is not None else None
+            buffer.append((method, properties, body, timer))
+            self.condition.notify()
+
+    # Called with the condition held
+    def _pick(self):
+        for queue_name in self.strict:
+            if self.buffers[queue_name]:
+                return queue_name
+        best = None
+        for queue_name, finish in self.virtual_time.items():
+            if self.buffers[queue_name] and (best is None or finish < self.virtual_time[best]):
+                best = queue_name
+        if best is not None:
+            self.virtual_time[best] += 1.0 / self.weights[best]
+        return best
+
+    def _run_worker(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopping:
+                        return
+                    queue_name = self._pick()
+                    if queue_name is not None:
+                        break
+                    self.condition.wait()
+                method, properties, body, timer = self.buffers[queue_name].popleft()
+                self.dispatched[queue_name] += 1
+                self.in_flight += 1
+            if timer is not None:
+                timer.start()
+            try:
+                result = self.handler(queue_name, body, properties)
+                error = None
+            except Exception as exception:
+                logging.exception(f"Worker failed to process message from {queue_name}")
+                result, error = None, exception
+            if timer is not None:
+                timer.finish()
+            settle = functools.partial(self._settle, queue_name, method, properties, result, error, timer)
+            try:
+                self.connection.add_callback_threadsafe(settle)
+            except Exception:
+                logging.exception("Connection closed before a processed message could be acked")
+                with self.condition:
+                    self.in_flight -= 1
+
+    # I/O thread
+    def _settle(self, queue_name, method, properties, result, error, timer=None):
+        with self.condition:
+            self.in_flight -= 1
+        if not self.channel.is_open:
+            return
+        if error is not None:
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        self.channel.basic_ack(delivery_tag=method.delivery_tag)
+        if timer is not None:
+            timer.ack()
+            timer.record(self.stage_metrics, queue_name)
+        if self.on_complete is not None:
+            self.on_complete(queue_name, method, properties, result)
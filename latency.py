@@ -1,26 +1,39 @@
-from datetime import datetime
+import os
 
-# Data
-timestamps = [
-    "2024-11-30 01:25:04",
-    "2024-11-30 01:26:02"
-]
-messages_processed = [1, 2692]
+from event_log import read_events
+from log_analytics import PERCENTILES, latency_summary, load_logs
 
-# Convert string timestamps to datetime objects
-start_time = datetime.strptime(timestamps[0], "%Y-%m-%d %H:%M:%S")
-end_time = datetime.strptime(timestamps[1], "%Y-%m-%d %H:%M:%S")
+# Log of the consumer to measure
+log_file = "consumer_4_logs.txt"
+consumer_id = "4"
+# Binary event log of the same run (new_final_s.py with LOG_FORMAT 'binary' or 'both'); the text log has no
+# creation times, so end-to-end latency is only reported when this file exists
+event_log_file = "consumer_events.bin"
 
-# Calculate total messages processed
-total_messages_processed = messages_processed[1] - messages_processed[0]
+if __name__ == "__main__":
+    log = load_logs(log_file)[consumer_id]
+    if not len(log.processed):
+        raise SystemExit(f"No 'Total Messages Processed' lines for consumer {consumer_id} in {log_file}")
 
-# Calculate elapsed time in seconds
-elapsed_time = (end_time - start_time).total_seconds()
+    # The running totals the consumer reported, from its first report to its last
+    start_time, end_time = log.processed_at[0], log.processed_at[-1]
+    total_messages_processed = int(log.processed[-1])
 
-# Calculate throughput
-throughput = total_messages_processed / elapsed_time
+    # Calculate elapsed time in seconds
+    elapsed_time = float(end_time - start_time)
 
-# Display results
-print(f"Total Messages Processed: {total_messages_processed}")
-print(f"Elapsed Time (seconds): {elapsed_time}")
-print(f"Throughput (messages/second): {throughput:.2f}")
\ No newline at end of file
+    # Calculate throughput over the reports' span
+    processed_in_span = int(log.processed[-1] - log.processed[0])
+    throughput = processed_in_span / elapsed_time if elapsed_time else float(processed_in_span)
+
+    # Display results
+    print(f"Total Messages Processed: {total_messages_processed}")
+    print(f"Elapsed Time (seconds): {elapsed_time}")
+    print(f"Throughput (messages/second): {throughput:.2f}")
+
+    if os.path.exists(event_log_file):
+        summary = latency_summary(read_events(event_log_file))
+        rows = [row for row, consumer in enumerate(summary['consumer']) if consumer == consumer_id]
+        for row in rows:
+            for q in PERCENTILES:
+                print(f"Latency p{q} (seconds): {summary[f'latency_p{q}'][row]:.3f}")
@@ -0,0 +1,150 @@
+# Fixed-memory latency histogram (HDR-style log-linear buckets).
+# Replaces the per-queue latency lists that grew with every processed
+# message. Recording is O(1), memory is fixed by max_value and precision,
+# and histograms from several consumers can be merged before reporting.
+#
+# Values are seconds. They are counted in integer `unit`s (microseconds by
+# default); below 2**sub_bucket_bits units every value has its own bucket,
+# above that each power of two is split into 2**(sub_bucket_bits - 1)
+# buckets, which keeps the relative error under 1 / 2**(sub_bucket_bits - 1).
+# Values above max_value are counted as overflow rather than in a bucket;
+# percentiles that land among them report the largest value recorded.
+
+
+class LatencyHistogram:
+    def __init__(self, max_value=3600.0, unit=1e-6, sub_bucket_bits=7):
+        self.unit = unit
+        self.sub_bucket_bits = sub_bucket_bits
+        self.half_count = 1 << (sub_bucket_bits - 1)
+        self.max_units = int(max_value / unit)
+        self.counts = [0] * (self._index(self.max_units) + 1)
+        self.overflow = 0  # Values above max_value; included in count, total and max but in no bucket
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def _index(self, units):
+        shift = units.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return units
+        return shift * self.half_count + (units >> shift)
+
+    def _bucket_bounds(self, index):
+        if index < 2 * self.half_count:
+            return index, index + 1
+        shift = index // self.half_count - 1
+        sub = index - shift * self.half_count
+        return sub << shift, (sub + 1) << shift
+
+    def record(self, value):
+        units = int(value / self.unit)
+        if units > self.max_units:
+            self.overflow += 1
+        else:
+            self.counts[self._index(max(units, 0))] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if len(other.counts) != len(self.counts) or other.unit != self.unit:
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        self.overflow += other.overflow
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self):
+        clone = LatencyHistogram.__new__(LatencyHistogram)
+        clone.__dict__.update(self.__dict__)
+        clone.counts = list(self.counts)
+        return clone
+
+    # Histogram of the values recorded since `previous`, an earlier copy() of this histogram
+    def difference(self, previous):
+        window = self.copy()
+        window.counts = [now - before for now, before in zip(self.counts, previous.counts)]
+        window.overflow = self.overflow - previous.overflow
+        window.count = sum(window.counts) + window.overflow
+        window.total = self.total - previous.total
+        # Exact extremes are not recoverable from cumulative state; use the edges of the occupied buckets
+        occupied = [index for index, bucket_count in enumerate(window.counts) if bucket_count]
+        if occupied:
+            window.min = self._bucket_bounds(occupied[0])[0] * self.unit
+            window.max = self.max if window.overflow else min(self._bucket_bounds(occupied[-1])[1] * self.unit,
+                                                                self.max)
+        elif window.overflow:
+            window.min = self.max_units * self.unit
+            window.max = self.max
+        else:
+            window.min = None
+            window.max = 0.0
+        return window
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.overflow = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Value at or below which q percent of recorded values fall (upper edge of the bucket,
+    # or the largest value recorded when the rank falls among the overflow)
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        target = max(1, int(round(self.count * q / 100.0)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                upper = self._bucket_bounds(index)[1] * self.unit
+                return min(upper, self.max)
+        return self.max
+
+    # Cumulative counts at each of the ascending upper bounds (seconds), e.g. for Prometheus `le` buckets.
+    # `le` is inclusive, so the bucket holding the bound counts towards it: a value exactly on the
+    # bound always does, and the rest of that bucket is within the histogram's precision of it.
+    # Buckets before it end at or below the bound, so each step is one slice sum.
+    def cumulative(self, bounds):
+        counts = []
+        seen = 0
+        start = 0
+        for bound in bounds:
+            units = round(bound / self.unit)
+            end = len(self.counts) if units >= self.max_units else self._index(max(units, 0)) + 1
+            if end > start:
+                seen += sum(self.counts[start:end])
+                start = end
+            # Overflow values are only known to lie between max_value and max
+            counts.append(seen + self.overflow if self.overflow and bound >= self.max else seen)
+        return counts
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def describe(self):
+        stats = self.summary()
+        return (f"p50: {stats['p50']:.3f}s, p95: {stats['p95']:.3f}s, p99: {stats['p99']:.3f}s, "
+                f"max: {stats['max']:.3f}s")
@@ -1,48 +1,24 @@
-from datetime import datetime
-import pandas as pd
 import matplotlib.pyplot as plt
 
-# Data as a dictionary
-data = {
-    "Start Time": [
-        "2024-11-30 01:25:44", "2024-11-30 01:25:44", "2024-11-30 01:25:44", 
-        "2024-11-30 01:25:44", "2024-11-30 01:25:44", "2024-11-30 01:25:44", 
-        "2024-11-30 01:25:44", "2024-11-30 01:25:44", "2024-11-30 01:25:44", 
-        "2024-11-30 01:25:44"
-    ],
-    "End Time": [
-        "2024-11-30 01:26:02", "2024-11-30 01:26:03", "2024-11-30 01:26:02",
-        "2024-11-30 01:26:03", "2024-11-30 01:26:02", "2024-11-30 01:26:03",
-        "2024-11-30 01:26:03", "2024-11-30 01:26:02", "2024-11-30 01:26:03",
-        "2024-11-30 01:26:02"
-    ],
-    "Total Messages Processed": [4876, 3500, 3876, 2700, 2700, 3912, 3462, 3311, 2595, 1920],
-    "Consumer Number": ["con-1", "con-2", "con-3", "con-4", "con-5", "con-6", "con-7", "con-8", "con-9", "con-10"]
-}
+from log_analytics import consumer_ids, load_logs, rolling_throughput
 
-# Convert the data into a DataFrame
-df = pd.DataFrame(data)
+# Per-consumer logs produced by separate.py (or pass consumer_logs.txt)
+log_files = "consumer_*_logs.txt"
+window_seconds = 5  # Trailing window for the rolling throughput
 
-# Function to calculate latencies for each consumer
-def calculate_latencies(row):
-    start_time = datetime.strptime(row["Start Time"], "%Y-%m-%d %H:%M:%S")
-    end_time = datetime.strptime(row["End Time"], "%Y-%m-%d %H:%M:%S")
-    elapsed_time = (end_time - start_time).total_seconds()
-    return elapsed_time
+if __name__ == "__main__":
+    logs = load_logs(log_files)
 
-# Add latencies column
-df["Latency (seconds)"] = df.apply(calculate_latencies, axis=1)
+    # Rolling throughput over time for each consumer
+    plt.figure(figsize=(12, 8))
+    for consumer_id in consumer_ids(logs):
+        seconds, rate = rolling_throughput(logs[consumer_id].received_at, window_seconds)
+        plt.plot(seconds.astype('datetime64[s]'), rate, label=f"con-{consumer_id}")
 
-# Plot latencies over time for each consumer
-plt.figure(figsize=(12, 8))
-for consumer in df["Consumer Number"]:
-    consumer_data = df[df["Consumer Number"] == consumer]
-    plt.plot(consumer_data["Consumer Number"], consumer_data["Latency (seconds)"], marker='o', label=consumer)
-
-plt.title("Latencies Over Time for Each Consumer")
-plt.xlabel("Consumer")
-plt.ylabel("Latency (seconds)")
-plt.legend(title="Consumer")
-plt.grid(True)
-plt.tight_layout()
-plt.show()
+    plt.title(f"Throughput Over Time for Each Consumer ({window_seconds}s window)")
+    plt.xlabel("Time")
+    plt.ylabel("Throughput (messages/second)")
+    plt.legend(title="Consumer")
+    plt.grid(True)
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,295 @@
+# Open-loop load generation from rate profiles.
+# A profile is a plain dict (so it can live in a script's config or come in
+# as JSON) that expands into the intended send time of every message, as an
+# offset in seconds from the start of the run:
+#   {'type': 'constant', 'rate': 1000, 'duration': 60}
+#   {'type': 'ramp', 'start_rate': 10, 'end_rate': 5000, 'duration': 120}
+#   {'type': 'poisson', 'rate': 200, 'count': 10000, 'seed': 1}
+#   {'type': 'spike', 'base_rate': 1, 'spike_rate': 10, 'period': 30, 'spike_duration': 5}
+#   {'type': 'replay', 'path': 'consumer_logs.txt', 'speed': 2.0}
+#   {'type': 'sequence', 'steps': [profile, ...]}
+# Every profile accepts 'count' and/or 'duration' to stop it (a sequence step
+# ends at its duration, or one inter-arrival gap after its last message);
+# constant, ramp and spike take 'arrivals': 'poisson' for exponential gaps.
+#
+# run() sends each message at its deadline measured from one absolute start
+# on time.perf_counter_ns, so a slow send or a late wake-up never pushes
+# later messages back: when it falls behind it sends immediately until it has
+# caught up. The intended and actual send time of every message are
+# recorded, and send() gets the intended time to stamp as the creation time,
+# so consumer latency includes any time the generator spent behind rather
+# than hiding it (coordinated omission). run_processes() runs the same
+# profile in several processes, each taking every N-th message from a shared
+# start time.
+import argparse
+import functools
+import itertools
+import json
+import math
+import random
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from codec import encode_order
+from event_log import EVENT_RECEIVED, read_events
+from latency_histogram import LatencyHistogram
+from log_analytics import EVENT_LOG_SUFFIX, load_logs
+from publisher_pool import get_publisher_pool
+
+SPIN_SECONDS = 0.0002  # Busy-wait the last stretch before a deadline; sleep() overshoots by ~50-100us
+START_DELAY = 0.5      # Head start for worker processes to connect before the shared start time
+
+# intended_ns / actual_ns are epoch nanoseconds per message sent (array('q'), in send order);
+# lag is a LatencyHistogram of actual - intended in seconds
+LoadResult = namedtuple('LoadResult', 'worker sent intended_ns actual_ns lag duration')
+
+
+# Profile -> generator of offsets in seconds; the generator returns the offset at which the profile ends
+def schedule(profile, rng=None):
+    kind = profile['type']
+    rng = rng or random.Random(profile.get('seed'))
+    if kind == 'sequence':
+        return _sequence(profile['steps'], rng)
+    if kind == 'constant':
+        offsets = _piecewise(_constant_segments(profile['rate']), profile.get('arrivals'), rng)
+    elif kind == 'poisson':
+        offsets = _piecewise(_constant_segments(profile['rate']), 'poisson', rng)
+    elif kind == 'ramp':
+        offsets = _ramp(profile['start_rate'], profile['end_rate'], profile['duration'], profile.get('arrivals'), rng)
+    elif kind == 'spike':
+        segments = _spike_segments(profile['base_rate'], profile['spike_rate'], profile['period'],
+                                   profile['spike_duration'], profile.get('spike_at', 0.0))
+        offsets = _piecewise(segments, profile.get('arrivals'), rng)
+    elif kind == 'replay':
+        offsets = _replay(profile['path'], profile.get('speed', 1.0))
+    else:
+        raise ValueError(f"Unknown load profile type {kind!r}")
+    return _bounded(offsets, profile.get('count'), profile.get('duration'))
+
+
+def _bounded(offsets, count=None, duration=None):
+    sent = 0
+    last = 0.0
+    for offset in offsets:
+        if (duration is not None and offset >= duration) or (count is not None and sent >= count):
+            # The first offset past the limit is where the next message would have gone
+            return duration if duration is not None else offset
+        yield offset
+        last = offset
+        sent += 1
+    return duration if duration is not None else last
+
+
+def _sequence(steps, rng):
+    start = 0.0
+    for step in steps:
+        offsets = schedule(step, rng)
+        while True:
+            try:
+                offset = next(offsets)
+            except StopIteration as stop:
+                start += stop.value
+                break
+            yield start + offset
+    return start
+
+
+def _constant_segments(rate):
+    yield 0.0, math.inf, rate
+
+
+# (start, end, rate) segments -> offsets, evenly spaced or with exponential gaps within each segment
+def _piecewise(segments, arrivals, rng):
+    poisson = arrivals == 'poisson'
+    for start, end, rate in segments:
+        if rate <= 0:
+            continue
+        offset = start + (rng.expovariate(rate) if poisson else 0.0)
+        sent = 0
+        while offset < end:
+            yield offset
+            sent += 1
+            offset = offset + rng.expovariate(rate) if poisson else start + sent / rate
+
+
+def _spike_segments(base_rate, spike_rate, period, spike_duration, spike_at):
+    for cycle in itertools.count():
+        cycle_start = cycle * period
+        spike_start = cycle_start + spike_at
+        yield cycle_start, spike_start, base_rate
+        yield spike_start, spike_start + spike_duration, spike_rate
+        yield spike_start + spike_duration, cycle_start + period, base_rate
+
+
+# Linear ramp: the n-th message goes where the integrated rate r0*t + (r1 - r0)*t^2 / (2T) reaches n
+def _ramp(start_rate, end_rate, duration, arrivals, rng):
+    slope = (end_rate - start_rate) / duration
+    for n in itertools.count() if arrivals != 'poisson' else _poisson_counts(rng):
+        discriminant = start_rate * start_rate + 2 * slope * n
+        if discriminant < 0:
+            return  # The rate reaches zero before the n-th message
+        denominator = start_rate + math.sqrt(discriminant)
+        if denominator == 0:
+            offset = 0.0 if n == 0 else math.inf
+        else:
+            offset = 2 * n / denominator
+        if offset >= duration:
+            return
+        yield offset
+
+
+# Unit-rate Poisson arrival "counts"; mapping them through the ramp's integrated rate gives a Poisson ramp
+def _poisson_counts(rng):
+    total = 0.0
+    while True:
+        total += rng.expovariate(1.0)
+        yield total
+
+
+# Received times from a consumer log (text or binary event log), shifted to start at 0 and scaled by speed.
+# Text logs only have whole seconds, so the messages of each second are spread evenly across it.
+def _replay(path, speed):
+    if path.endswith(EVENT_LOG_SUFFIX):
+        events = read_events(path)
+        times = np.sort(events['timestamp_ns'][events['event'] == EVENT_RECEIVED]) / 1e9
+    else:
+        logs = load_logs(path)
+        times = np.sort(np.concatenate([log.received_at for log in logs.values()]) if logs else np.empty(0))
+        if len(times):
+            _, starts, counts = np.unique(times, return_index=True, return_counts=True)
+            rank = np.arange(len(times)) - np.repeat(starts, counts)
+            times = times + (rank + 0.5) / np.repeat(counts, counts)
+    if not len(times):
+        return
+    yield from ((times - times[0]) / speed).tolist()
+
+
+# This worker's share of a schedule: (global index, offset) for every workers-th message
+def partition(offsets, worker=0, workers=1):
+    return itertools.islice(enumerate(offsets), worker, None, workers)
+
+
+def _wait_until(deadline_ns, spin_ns):
+    while True:
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining <= 0:
+            return
+        if remaining > spin_ns:
+            time.sleep((remaining - spin_ns) / 1e9)
+
+
+# Send every message of the profile (or this worker's stride of it) at its intended time.
+# send(index, intended_ns) publishes one message; start_ns is the epoch time of offset 0 (default: now).
+def run(profile, send, worker=0, workers=1, start_ns=None, spin_seconds=SPIN_SECONDS):
+    start_ns = time.time_ns() if start_ns is None else start_ns
+    # Deadlines run on the monotonic perf counter; epoch times are derived from it so they share one origin
+    origin = time.perf_counter_ns() - (time.time_ns() - start_ns)
+    spin_ns = int(spin_seconds * 1e9)
+    intended = array('q')
+    actual = array('q')
+    lag = LatencyHistogram()
+    for index, offset in partition(schedule(profile), worker, workers):
+        offset_ns = int(offset * 1e9)
+        _wait_until(origin + offset_ns, spin_ns)
+        sent_ns = time.perf_counter_ns() - origin
+        send(index, start_ns + offset_ns)
+        intended.append(start_ns + offset_ns)
+        actual.append(start_ns + sent_ns)
+        lag.record((sent_ns - offset_ns) / 1e9)
+    duration = (time.perf_counter_ns() - origin) / 1e9
+    return LoadResult(worker, len(intended), intended, actual, lag, duration)
+
+
+def _run_worker(profile, sender_factory, worker, workers, start_ns):
+    send = sender_factory()
+    try:
+        return run(profile, send, worker, workers, start_ns)
+    finally:
+        close = getattr(send, 'close', None)
+        if close is not None:
+            close()
+
+
+# Run the profile split across `processes` processes that share one start time.
+# sender_factory() is called in each process to build its send(index, intended_ns), so every
+# process opens its own connections; it must be picklable (a module-level function or class).
+def run_processes(profile, sender_factory, processes=2, start_delay=START_DELAY):
+    if processes <= 1:
+        return _run_worker(profile, sender_factory, 0, 1, None)
+    start_ns = time.time_ns() + int(start_delay * 1e9)
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(_run_worker, profile, sender_factory, worker, processes, start_ns)
+                   for worker in range(processes)]
+        return merge_results([future.result() for future in futures])
+
+
+def merge_results(results):
+    intended = array('q')
+    actual = array('q')
+    lag = LatencyHistogram()
+    for result in results:
+        intended.extend(result.intended_ns)
+        actual.extend(result.actual_ns)
+        lag.merge(result.lag)
+    return LoadResult(None, len(intended), intended, actual, lag, max(result.duration for result in results))
+
+
+def describe(result):
+    rate = result.sent / result.duration if result.duration else 0.0
+    return (f"Sent {result.sent} messages in {result.duration:.2f}s ({rate:.0f} msg/s), "
+            f"send lag p50: {result.lag.percentile(50) * 1000:.2f}ms, p99: {result.lag.percentile(99) * 1000:.2f}ms, "
+            f"max: {result.lag.max * 1000:.2f}ms")
+
+
+# Publishes a small order per message through the shared publisher pool, stamped with the intended time.
+# routing_key may be a list, which is cycled through by message index to mix order types.
+class OrderSender:
+    def __init__(self, routing_key='order.standard', codec='json', host='localhost', exchange_name='order_exchange'):
+        self.routing_keys = [routing_key] if isinstance(routing_key, str) else list(routing_key)
+        self.codec = codec
+        self.host = host
+        self.exchange_name = exchange_name
+        self.publisher = None
+
+    def __call__(self, index, intended_ns):
+        if self.publisher is None:
+            self.publisher = get_publisher_pool(self.host, self.exchange_name)
+        order = {'order_id': f"load_{index}", 'customer_id': f"cust_{index % 1000}", 'items': ['item_1']}
+        body, properties = encode_order(order, self.codec, created_ns=intended_ns)
+        self.publisher.publish(self.routing_keys[index % len(self.routing_keys)], body, properties)
+
+
+# Times the schedule alone, without publishing anything
+def _discard(index, intended_ns):
+    pass
+
+
+def _discard_factory():
+    return _discard
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish orders following a rate profile.")
+    parser.add_argument('profile', help="Profile as JSON, or the path of a JSON file")
+    parser.add_argument('--processes', type=int, default=1, help="Producer processes sharing the profile")
+    parser.add_argument('--routing-key', default='order.standard')
+    parser.add_argument('--codec', default='json')
+    parser.add_argument('--dry-run', action='store_true', help="Run the schedule without publishing")
+    args = parser.parse_args()
+
+    if args.profile.lstrip().startswith('{'):
+        profile = json.loads(args.profile)
+    else:
+        with open(args.profile) as source:
+            profile = json.load(source)
+    # Each process builds its own OrderSender, which connects lazily on its first publish
+    sender_factory = _discard_factory if args.dry_run else functools.partial(OrderSender, args.routing_key, args.codec)
+    print(describe(run_processes(profile, sender_factory, args.processes)))
+
+
+if __name__ == '__main__':
+    main()
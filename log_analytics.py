@@ -0,0 +1,166 @@
+# Vectorized throughput and latency analytics over parsed consumer logs.
+# Everything takes the NumPy arrays produced by log_ingest (times are int
+# seconds as logged) and works on whole columns at once, so re-analysing a
+# run is a handful of array operations per consumer or queue rather than
+# per-row Python. Summaries are column-oriented dicts of arrays that can go
+# straight into pandas.DataFrame or matplotlib.
+#
+# The text logs only say when a message was received, so their summaries
+# report inter-arrival gaps (gap_p*), not latency. End-to-end latency
+# (receive time minus the producer's x-created-ns) needs a binary event log
+# with EVENT_CREATED records; latency_summary() reports its percentiles.
+import glob
+
+import numpy as np
+
+from event_log import latencies, read_events, to_consumer_logs
+from log_ingest import ConsumerLog, consumer_ids, ingest
+
+PERCENTILES = (50, 95, 99)
+SPLIT_LOGS = "consumer_*_logs.txt"
+EVENT_LOG_SUFFIX = ".bin"
+
+
+# Ingest one or more log files (a glob pattern, a path or a list of paths) into one {consumer_id: ConsumerLog}.
+# Files ending in EVENT_LOG_SUFFIX are read as binary event logs, anything else as text.
+def load_logs(paths=SPLIT_LOGS, workers=None):
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(paths)) or [paths]
+    logs = {}
+    for path in paths:
+        parsed = to_consumer_logs(read_events(path)) if path.endswith(EVENT_LOG_SUFFIX) else ingest(path, workers)
+        for consumer_id, log in parsed.items():
+            logs.setdefault(consumer_id, []).append(log)
+    return {consumer_id: _concat(parts) for consumer_id, parts in logs.items()}
+
+
+def _concat(parts):
+    if len(parts) == 1:
+        return parts[0]
+    received = [np.concatenate([getattr(part, field) for part in parts]) for field in ('received_at', 'message', 'queue')]
+    processed = [np.concatenate([getattr(part, field) for part in parts]) for field in ('processed_at', 'processed')]
+    received_order = np.argsort(received[0], kind='stable')
+    processed_order = np.argsort(processed[0], kind='stable')
+    return ConsumerLog(*(column[received_order] for column in received),
+                       *(column[processed_order] for column in processed))
+
+
+# int seconds -> datetime64[s] showing the logged wall-clock time
+def as_datetime64(times):
+    return np.asarray(times).astype('datetime64[s]')
+
+
+# Messages per second over a trailing window, one point per second from the first to the last event.
+# Returns (second, rate) arrays.
+def rolling_throughput(times, window=1, start=None, end=None):
+    times = np.asarray(times)
+    if not len(times):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    start = times.min() if start is None else start
+    end = times.max() if end is None else end
+    per_second = np.bincount(times - start, minlength=end - start + 1)[:end - start + 1]
+    cumulative = np.concatenate(([0], np.cumsum(per_second)))
+    lagged = np.maximum(np.arange(1, len(per_second) + 1) - window, 0)
+    rate = (cumulative[1:] - cumulative[lagged]) / window
+    return np.arange(start, end + 1), rate
+
+
+# Gaps between consecutive events, in seconds
+def inter_arrival_gaps(times):
+    return np.diff(np.sort(times, kind='stable'))
+
+
+# Cumulative messages processed at each distinct second: (second, processed) arrays
+def processed_curve(times):
+    seconds, counts = np.unique(times, return_counts=True)
+    return seconds, np.cumsum(counts)
+
+
+def percentiles(values, qs=PERCENTILES):
+    if not len(values):
+        return np.full(len(qs), np.nan)
+    return np.percentile(values, qs)
+
+
+def _summarize(groups, times_of):
+    keys = list(groups)
+    times = [np.asarray(times_of(groups[key])) for key in keys]
+    counts = np.array([len(t) for t in times])
+    first = np.array([t.min() if len(t) else 0 for t in times])
+    last = np.array([t.max() if len(t) else 0 for t in times])
+    elapsed = last - first
+    throughput = np.where(elapsed > 0, counts / np.maximum(elapsed, 1), counts.astype(float))
+    gap_percentiles = np.array([percentiles(inter_arrival_gaps(t)) for t in times]).reshape(len(keys), len(PERCENTILES))
+    summary = {
+        'messages': counts,
+        'first': as_datetime64(first),
+        'last': as_datetime64(last),
+        'elapsed': elapsed,
+        'throughput': throughput,
+    }
+    for index, q in enumerate(PERCENTILES):
+        summary[f'gap_p{q}'] = gap_percentiles[:, index]
+    return keys, summary
+
+
+# Column-oriented per-consumer summary: consumer, messages, first, last, elapsed (s),
+# throughput (msg/s over the consumer's active span) and inter-arrival gap percentiles
+def consumer_summary(logs):
+    keys, summary = _summarize({consumer_id: logs[consumer_id] for consumer_id in consumer_ids(logs)},
+                               lambda log: log.received_at)
+    return {'consumer': np.array(keys), **summary}
+
+
+# Same summary grouped by the queue each message was addressed to, across all consumers
+def queue_summary(logs):
+    received_at = np.concatenate([log.received_at for log in logs.values()]) if logs else np.empty(0, np.int64)
+    queue = np.concatenate([log.queue for log in logs.values()]) if logs else np.empty(0, np.int64)
+    known = queue >= 0
+    received_at, queue = received_at[known], queue[known]
+    order = np.lexsort((received_at, queue))
+    received_at, queue = received_at[order], queue[order]
+    names, starts = np.unique(queue, return_index=True)
+    groups = dict(zip(names.tolist(), np.split(received_at, starts[1:])))
+    keys, summary = _summarize(groups, lambda times: times)
+    return {'queue': np.array(keys), **summary}
+
+
+# Column-oriented end-to-end latency summary of a binary event log, grouped by 'consumer' or 'queue':
+# key, messages (received with a creation time) and latency percentiles in seconds
+def latency_summary(events, by='consumer'):
+    consumer, queue, seconds = latencies(events)
+    groups = consumer if by == 'consumer' else queue
+    names, inverse = np.unique(groups, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    counts = np.bincount(inverse, minlength=len(names))
+    parts = np.split(seconds[order], np.cumsum(counts)[:-1]) if len(names) else []
+    latency_percentiles = np.array([percentiles(part) for part in parts]).reshape(len(names), len(PERCENTILES))
+    summary = {by: names.astype(str), 'messages': counts}
+    for index, q in enumerate(PERCENTILES):
+        summary[f'latency_p{q}'] = latency_percentiles[:, index]
+    return summary
+
+
+def print_summary(summary, key, columns=None):
+    columns = columns or [key, 'messages', 'elapsed', 'throughput'] + [f'gap_p{q}' for q in PERCENTILES]
+    print(' '.join(f"{column:>12}" for column in columns))
+    for row in range(len(summary[key])):
+        values = [summary[column][row] for column in columns]
+        print(' '.join(f"{value:>12.2f}" if isinstance(value, (float, np.floating)) else f"{value!s:>12}"
+                       for value in values))
+
+
+if __name__ == "__main__":
+    import sys
+
+    paths = sys.argv[1:] or SPLIT_LOGS
+    logs = load_logs(paths)
+    print_summary(consumer_summary(logs), 'consumer')
+    print()
+    print_summary(queue_summary(logs), 'queue')
+    for path in [paths] if isinstance(paths, str) else paths:
+        if path.endswith(EVENT_LOG_SUFFIX):
+            for by in ('consumer', 'queue'):
+                summary = latency_summary(read_events(path), by)
+                print()
+                print_summary(summary, by, [by, 'messages'] + [f'latency_p{q}' for q in PERCENTILES])
@@ -0,0 +1,173 @@
+# Parallel ingest of consumer logs (consumer_logs.txt and the per-consumer splits).
+# The file is cut into byte ranges whose boundaries are moved forward to
+# the next newline, each range is parsed in a process pool, and the
+# per-consumer results are concatenated in file order into NumPy arrays.
+# Timestamps have the fixed "[YYYY-MM-DD HH:MM:SS]" layout, so they are
+# decoded with integer slicing and cached per date and per second instead
+# of going through datetime.strptime for every line.
+import os
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CHUNK_SIZE = 32 * 1024 * 1024  # Bytes per task; every worker gets at least one range
+
+TAG = b"[Consumer-"
+RECEIVED = b"] Received: "
+TOTAL = b"] Total Messages Processed: "
+
+# Per consumer, in log order. Times are seconds since the epoch of the logged
+# (local, naive) wall-clock time. message / queue come from "Message N to Queue Q"
+# bodies and are -1 for other payloads; processed is the running total the consumer reported.
+ConsumerLog = namedtuple('ConsumerLog', 'received_at message queue processed_at processed')
+
+
+def _days_from_civil(year, month, day):
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+class TimestampParser:
+    # "YYYY-MM-DD HH:MM:SS" bytes -> int seconds since the epoch
+    def __init__(self):
+        self.dates = {}
+        self.last_stamp = None
+        self.last_value = None
+
+    def __call__(self, stamp):
+        if stamp == self.last_stamp:
+            return self.last_value
+        date = stamp[:10]
+        day_start = self.dates.get(date)
+        if day_start is None:
+            day_start = self.dates[date] = 86400 * _days_from_civil(int(date[:4]), int(date[5:7]), int(date[8:10]))
+        value = day_start + int(stamp[11:13]) * 3600 + int(stamp[14:16]) * 60 + int(stamp[17:19])
+        self.last_stamp, self.last_value = stamp, value
+        return value
+
+
+class _ChunkColumns:
+    __slots__ = ('received_at', 'message', 'queue', 'processed_at', 'processed')
+
+    def __init__(self):
+        self.received_at = array('q')
+        self.message = array('q')
+        self.queue = array('q')
+        self.processed_at = array('q')
+        self.processed = array('q')
+
+
+# "Message 12 to Queue 2" -> (12, 2); anything else -> (-1, -1)
+def _message_fields(body):
+    parts = body.split()
+    if len(parts) == 5 and parts[0] == b"Message" and parts[2] == b"to" and parts[3] == b"Queue":
+        try:
+            return int(parts[1]), int(parts[4])
+        except ValueError:
+            pass
+    return -1, -1
+
+
+# Runs in the pool: parse lines in [start, end) of path into {consumer_id: column arrays}
+def parse_range(path, start, end):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        data = source.read(end - start)
+
+    parse_timestamp = TimestampParser()
+    consumers = {}
+    for line in data.split(b"\n"):
+        if len(line) < 21 or line[0] != 0x5B or line[20] != 0x5D:  # "[" ... "]"
+            continue
+        tag = line.find(TAG, 21)
+        if tag < 0:
+            continue
+        id_start = tag + len(TAG)
+        id_end = line.find(b"]", id_start)
+        consumer_id = line[id_start:id_end].decode()
+        columns = consumers.get(consumer_id)
+        if columns is None:
+            columns = consumers[consumer_id] = _ChunkColumns()
+
+        if line.startswith(RECEIVED, id_end):
+            message, queue = _message_fields(line[id_end + len(RECEIVED):])
+            columns.received_at.append(parse_timestamp(line[1:20]))
+            columns.message.append(message)
+            columns.queue.append(queue)
+        elif line.startswith(TOTAL, id_end):
+            columns.processed_at.append(parse_timestamp(line[1:20]))
+            columns.processed.append(int(line[id_end + len(TOTAL):]))
+    return consumers
+
+
+# Split path into about `chunks` byte ranges, each ending just after a newline
+def chunk_ranges(path, chunks):
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    chunks = max(1, min(chunks, size))
+    boundaries = [0]
+    with open(path, 'rb') as source:
+        for index in range(1, chunks):
+            source.seek(size * index // chunks)
+            source.readline()  # Finish the line the cut landed in
+            position = min(source.tell(), size)
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _merge(results):
+    merged = {}
+    for consumers in results:
+        for consumer_id, columns in consumers.items():
+            merged.setdefault(consumer_id, []).append(columns)
+    logs = {}
+    for consumer_id, parts in merged.items():
+        logs[consumer_id] = ConsumerLog(*(
+            np.concatenate([np.frombuffer(getattr(part, field), dtype=np.int64) for part in parts])
+            for field in ConsumerLog._fields
+        ))
+    return logs
+
+
+# Parse path into {consumer_id: ConsumerLog}; workers=1 parses in this process
+def ingest(path, workers=None, chunk_size=CHUNK_SIZE):
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(path)
+    ranges = chunk_ranges(path, max(workers, -(-size // chunk_size)))
+    if workers == 1 or len(ranges) <= 1:
+        return _merge(parse_range(path, start, end) for start, end in ranges)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps results in range order, so per-consumer arrays stay in log order
+        results = executor.map(parse_range, [path] * len(ranges),
+                               [start for start, _ in ranges], [end for _, end in ranges])
+        return _merge(results)
+
+
+def consumer_ids(logs):
+    return sorted(logs, key=lambda consumer_id: (0, int(consumer_id)) if consumer_id.isdigit() else (1, consumer_id))
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "consumer_logs.txt"
+    started = time.perf_counter()
+    logs = ingest(path)
+    elapsed = time.perf_counter() - started
+    lines = sum(len(log.received_at) + len(log.processed_at) for log in logs.values())
+    print(f"Parsed {lines} lines from {path} in {elapsed:.2f}s ({lines / elapsed:,.0f} lines/s)")
+    for consumer_id in consumer_ids(logs):
+        log = logs[consumer_id]
+        print(f"Consumer-{consumer_id}: {len(log.received_at)} received, "
+              f"last reported total {log.processed[-1] if len(log.processed) else '-'}")
@@ -0,0 +1,140 @@
+# Batched asynchronous log writer for high-rate consumer logging.
+# Consumers hand finished lines to write(), which only enqueues; a
+# background thread drains the queue in batches, writes each batch with a
+# single call and rotates the file by size. The queue is bounded: with the
+# 'drop' policy a full queue drops (and counts) lines instead of stalling
+# the consumer, with 'block' the consumer waits for the writer. Callers can
+# also block for single lines: BatchedLogHandler does so for WARNING and
+# above, so only routine lines are ever dropped. Drops are reported in the
+# log file itself every report_interval seconds while they happen.
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+_CLOSE = object()
+
+
+class AsyncLogWriter:
+    def __init__(self, path, max_queue=100000, batch_size=2000, flush_interval=0.2,
+                 max_bytes=100 * 1024 * 1024, backup_count=5, full_policy='drop', report_interval=10.0):
+        if full_policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown full_policy {full_policy!r}, expected 'drop' or 'block'")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.full_policy = full_policy
+        self.report_interval = report_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.drop_lock = threading.Lock()  # Only taken on the (rare) drop path
+        self.reported_dropped = 0
+        self.last_report = time.monotonic()
+        self.closed = False
+
+        self.file = open(path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        self.thread = threading.Thread(target=self._run, name=f"log-writer-{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Enqueue text ending in a newline (one or more lines); never touches the file.
+    # block=True waits for room even under the 'drop' policy.
+    def write(self, text, block=False):
+        if block or self.full_policy == 'block':
+            self.queue.put(text)
+            return
+        try:
+            self.queue.put_nowait(text)
+        except queue.Full:
+            with self.drop_lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            self._report_drops()
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = _CLOSE in batch
+            if closing:
+                batch = batch[:batch.index(_CLOSE)]
+            if batch:
+                self._write_batch(''.join(batch))
+            if closing:
+                self.file.close()
+                return
+
+    # Runs on the writer thread: note in the file how many lines were dropped since the last note
+    def _report_drops(self):
+        now = time.monotonic()
+        if now - self.last_report < self.report_interval:
+            return
+        dropped = self.dropped
+        if dropped > self.reported_dropped:
+            self._write_batch(f"Log writer dropped {dropped - self.reported_dropped} lines in the last "
+                              f"{now - self.last_report:.0f}s ({dropped} in total); the queue was full\n")
+            self.reported_dropped = dropped
+        self.last_report = now
+
+    def _write_batch(self, data):
+        if self.max_bytes and self.size and self.size + len(data) > self.max_bytes:
+            self._rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    # consumer_logs.txt -> consumer_logs.txt.1 -> ... -> consumer_logs.txt.<backup_count>
+    def _rotate(self):
+        self.file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = 0
+
+    # Flush everything queued so far and stop the writer thread
+    def close(self, timeout=10):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_CLOSE)
+        self.thread.join(timeout)
+        if self.dropped:
+            # Not through logging: this writer may be the handler behind it
+            sys.stderr.write(f"Log writer for {self.path} dropped {self.dropped} records\n")
+
+
+# logging handler that formats on the caller's thread and leaves the file I/O to an AsyncLogWriter.
+# Records at block_level and above wait for room in the queue rather than being dropped.
+class BatchedLogHandler(logging.Handler):
+    def __init__(self, path, level=logging.NOTSET, block_level=logging.WARNING, **writer_options):
+        super().__init__(level)
+        self.block_level = block_level
+        self.writer = AsyncLogWriter(path, **writer_options)
+
+    def emit(self, record):
+        try:
+            self.writer.write(self.format(record) + '\n', block=record.levelno >= self.block_level)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.writer.close()
+        super().close()
@@ -0,0 +1,188 @@
+# Local HTTP metrics endpoint in the Prometheus text format.
+# serve_metrics() starts a ThreadingHTTPServer on a daemon thread that
+# answers GET /metrics from a MetricsRegistry: every counter as
+# <prefix>_<name>_total, every histogram with cumulative `le` buckets,
+# _sum and _count, and every registered gauge, each labelled by queue.
+# A scrape reads the registry with totals() (never collect(), which the
+# log_metrics loops own), so it only copies the shards' dicts and never
+# takes a lock the consumers hold; recording stays the registry's O(1)
+# per-thread update. Requests are not logged, to keep the scrapes out of
+# the processing logs.
+#
+# ConsumerGauges registers the queue_depth, consumers, prefetch and
+# in_flight gauges for a process from state it already keeps: the latest
+# QueueDepthSampler round, the consumers it started, their
+# PrefetchControllers and the worker pool's outstanding messages.
+import logging
+import re
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = '127.0.0.1'
+PREFIX = 'orders'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# `le` bounds in seconds for the duration histograms; the registry keeps much finer buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Histograms of something other than seconds
+HISTOGRAM_BUCKETS = {'prefetch_count': (1, 2, 5, 10, 20, 50, 100)}
+
+
+def _metric_name(prefix, name):
+    return re.sub(r'[^a-zA-Z0-9_:]', '_', f"{prefix}_{name}")
+
+
+def _labels(label, label_name, extra=''):
+    parts = []
+    if label is not None:
+        value = str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{label_name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _by_name(values):
+    grouped = defaultdict(list)
+    for (name, label), value in values.items():
+        grouped[name].append((label, value))
+    for name in sorted(grouped):
+        yield name, sorted(grouped[name], key=lambda item: str(item[0]))
+
+
+# The registry's counters, histograms and gauges as Prometheus text
+def render(metrics, prefix=PREFIX, label_name='queue'):
+    counters, histograms = metrics.totals()
+    gauges = metrics.read_gauges()
+    lines = []
+    for name, series in _by_name(counters):
+        metric = _metric_name(prefix, name) + '_total'
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(f"{metric}{_labels(label, label_name)} {value}" for label, value in series)
+    for name, series in _by_name(histograms):
+        metric = _metric_name(prefix, name)
+        bounds = HISTOGRAM_BUCKETS.get(name, LATENCY_BUCKETS)
+        lines.append(f"# TYPE {metric} histogram")
+        for label, histogram in series:
+            for bound, count in zip(bounds, histogram.cumulative(bounds)):
+                le = f'le="{bound:g}"'
+                lines.append(f"{metric}_bucket{_labels(label, label_name, le)} {count}")
+            inf = 'le="+Inf"'
+            lines.append(f"{metric}_bucket{_labels(label, label_name, inf)} {histogram.count}")
+            lines.append(f"{metric}_sum{_labels(label, label_name)} {histogram.total:.6f}")
+            lines.append(f"{metric}_count{_labels(label, label_name)} {histogram.count}")
+    for name, series in _by_name(gauges):
+        metric = _metric_name(prefix, name)
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f"{metric}{_labels(label, label_name)} {value:g}" for label, value in series)
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        try:
+            body = render(self.server.metrics, self.server.prefix).encode()
+        except Exception:
+            logging.exception("Failed to render metrics")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    # port 0 picks a free port; the bound one is in .port after start()
+    def __init__(self, metrics, port, host=METRICS_HOST, prefix=PREFIX):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = self.metrics
+        self.httpd.prefix = self.prefix
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+# Start a MetricsServer, or nothing when port is None. A port that is taken is logged, not fatal.
+def serve_metrics(metrics, port, host=METRICS_HOST, prefix=PREFIX):
+    if port is None:
+        return None
+    try:
+        server = MetricsServer(metrics, port, host, prefix).start()
+    except OSError as error:
+        logging.warning(f"Metrics endpoint not started on {host}:{port}: {error}")
+        return None
+    logging.info(f"Serving metrics on http://{host}:{server.port}/metrics")
+    return server
+
+
+# Per-queue gauges for the consumers one process runs. Consumers are added as they start
+# (and removed when they stop) with their channel, initial prefetch and PrefetchController.
+class ConsumerGauges:
+    def __init__(self, metrics, sampler=None, dispatcher=None):
+        self.sampler = sampler
+        self.dispatcher = dispatcher
+        self.consumers = defaultdict(dict)  # queue name -> channel -> (prefetch_count, controller)
+        metrics.gauge('queue_depth', self.queue_depth)
+        metrics.gauge('consumers', self.consumer_counts)
+        metrics.gauge('prefetch', self.prefetch)
+        metrics.gauge('in_flight', self.in_flight)
+
+    def add(self, queue_name, channel, prefetch_count, controller=None):
+        self.consumers[queue_name][channel] = (prefetch_count, controller)
+
+    def remove(self, queue_name, channel):
+        self.consumers[queue_name].pop(channel, None)
+
+    def _entries(self):
+        return [(queue_name, list(entries.items())) for queue_name, entries in list(self.consumers.items())]
+
+    # Ready messages per queue from the sampler's latest round
+    def queue_depth(self):
+        sample = self.sampler.latest if self.sampler is not None else None
+        return dict(sample.depths) if sample is not None else {}
+
+    def consumer_counts(self):
+        return {queue_name: len(entries) for queue_name, entries in self._entries()}
+
+    # Current prefetch summed over the queue's consumers (the controller's when it tunes basic_qos)
+    def prefetch(self):
+        return {queue_name: sum(controller.prefetch if controller is not None else prefetch_count
+                                for _, (prefetch_count, controller) in entries)
+                for queue_name, entries in self._entries()}
+
+    # Messages delivered to a handler and not yet acked: the worker pool's count per channel, else the controller's
+    def in_flight(self):
+        in_flight = {}
+        for queue_name, entries in self._entries():
+            total = 0
+            for channel, (_, controller) in entries:
+                if self.dispatcher is not None:
+                    total += self.dispatcher.pending(channel)
+                elif controller is not None:
+                    total += controller.in_handler
+            in_flight[queue_name] = total
+        return in_flight
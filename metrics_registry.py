@@ -0,0 +1,135 @@
+# Sharded metrics registry.
+# Every thread records into its own shard, so the hot path takes no lock:
+# a consumer only ever writes to counters and histograms nobody else
+# writes to. The reporter reads all shards on each interval, merges them
+# and diffs against the previous interval, so shards never need resetting
+# from another thread. Gauges are callbacks that read state the consumers
+# already keep, evaluated only when the metrics are exported.
+# When a thread exits its thread-local is released, which retires its shard:
+# the shard is folded into one `retired` shard and dropped from the list,
+# so short-lived worker threads don't grow the registry without bound.
+import logging
+import threading
+import weakref
+from collections import defaultdict
+
+from latency_histogram import LatencyHistogram
+
+
+class MetricsShard:
+    def __init__(self, histogram_factory):
+        self.histogram_factory = histogram_factory
+        self.counters = defaultdict(int)
+        self.histograms = {}
+
+    def increment(self, key, amount=1):
+        self.counters[key] += amount
+
+    def observe(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = self.histogram_factory()
+        histogram.record(value)
+
+    # Add another shard's counts into this one; the other shard must no longer be written to
+    def absorb(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] += value
+        for key, histogram in other.histograms.items():
+            if key in self.histograms:
+                self.histograms[key].merge(histogram)
+            else:
+                self.histograms[key] = histogram.copy()
+
+
+class _ThreadToken:
+    pass
+
+
+class MetricsRegistry:
+    def __init__(self, histogram_factory=LatencyHistogram):
+        self.histogram_factory = histogram_factory
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()  # Only taken the first time a thread records and when it exits
+        self.retired = MetricsShard(histogram_factory)  # Everything recorded by threads that have exited
+        self.previous_counters = {}
+        self.previous_histograms = {}
+        self.gauges = {}  # name -> callback() returning {label: value}
+
+    # The calling thread's shard, created on first use
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = MetricsShard(self.histogram_factory)
+            # The token lives only in this thread's local storage, so it is collected when the thread exits
+            token = self.local.token = _ThreadToken()
+            weakref.finalize(token, self._retire, shard)
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self.shards_lock:
+            self.retired.absorb(shard)
+            self.shards.remove(shard)
+
+    # Keys are (metric name, label) pairs, e.g. ('latency', 'priority_orders')
+    def increment(self, name, label=None, amount=1):
+        self.shard().increment((name, label), amount)
+
+    def observe(self, name, label, value):
+        self.shard().observe((name, label), value)
+
+    def gauge(self, name, callback):
+        self.gauges[name] = callback
+
+    # Current gauge values keyed like the counters; a failing callback is logged and skipped
+    def read_gauges(self):
+        values = {}
+        for name, callback in list(self.gauges.items()):
+            try:
+                readings = callback()
+            except Exception:
+                logging.exception(f"Gauge {name} failed")
+                continue
+            for label, value in (readings or {}).items():
+                values[(name, label)] = value
+        return values
+
+    # Cumulative counters and histograms merged across all shards
+    def totals(self):
+        counters = defaultdict(int)
+        histograms = {}
+        # The retired shard is read under the lock together with the list, so a shard retired
+        # while we read is counted exactly once: from the list snapshot, not from `retired`
+        with self.shards_lock:
+            shards = list(self.shards)
+            for key, value in self.retired.counters.items():
+                counters[key] += value
+            for key, histogram in self.retired.histograms.items():
+                histograms[key] = histogram.copy()
+        for shard in shards:
+            # dict.copy() and copy() of the bucket list are single operations under the GIL,
+            # so the owning thread can keep recording while we read
+            for key, value in shard.counters.copy().items():
+                counters[key] += value
+            for key, histogram in shard.histograms.copy().items():
+                if key in histograms:
+                    histograms[key].merge(histogram.copy())
+                else:
+                    histograms[key] = histogram.copy()
+        return dict(counters), histograms
+
+    # Counters and histograms for everything recorded since the previous call.
+    # Meant to be called from a single reporter thread.
+    def collect(self):
+        counters, histograms = self.totals()
+        window_counters = {key: value - self.previous_counters.get(key, 0) for key, value in counters.items()}
+        window_histograms = {}
+        for key, histogram in histograms.items():
+            previous = self.previous_histograms.get(key)
+            window_histograms[key] = histogram.difference(previous) if previous is not None else histogram.copy()
+        self.previous_counters = counters
+        self.previous_histograms = histograms
+        return window_counters, window_histograms
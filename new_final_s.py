@@ -1,12 +1,30 @@
-import pika
 import time
-import threading
 from datetime import datetime
 from collections import defaultdict
-lock = threading.Lock()
+
+from codec import CREATED_HEADER, latency_seconds
+from event_log import EVENT_CREATED, EVENT_RECEIVED, EventLogWriter
+from load_generator import describe, run
+from metrics_http import serve_metrics
+from metrics_registry import MetricsRegistry
+from log_writer import AsyncLogWriter
+from queue_sharding import ShardedQueue
+from stage_timing import stamp_published
+from transport import pika
+
 # Global dictionary to track the message count for each consumer
 message_counts = defaultdict(int)
+# End-to-end latency and throughput per queue (1 or 2), read by benchmark.py
+metrics = MetricsRegistry()
+METRICS_PORT = 9106  # Prometheus text endpoint on localhost for the metrics above; None disables it
 log_file = "consumer_logs.txt"
+event_log_file = "consumer_events.bin"
+# 'text' writes the readable log lines, 'binary' fixed-size records to event_log_file, 'both' does both
+LOG_FORMAT = 'text'
+# Consumer log lines are batched and written by a background thread
+log_writer = AsyncLogWriter(log_file) if LOG_FORMAT in ('text', 'both') else None
+event_writer = EventLogWriter(event_log_file) if LOG_FORMAT in ('binary', 'both') else None
+ECHO_TO_CONSOLE = False  # Printing every message dominates the callback at high rates
 # Connection parameters
 rabbitmq_host = 'localhost'  # Replace with your RabbitMQ server address
 queue_1 = 'example_queue_1'
@@ -22,81 +40,105 @@ channel.queue_declare(queue=queue_1)
 # Declare the second queue
 channel.queue_declare(queue=queue_2)
 
-# Message counters
-message_count_queue_1 = 0
-message_threshold = 1000  # Threshold for creating a new dynamic queue
-new_queue_created = False  # Flag to check if a new queue has been created
-
-# Function to publish a message to a specific queue
-def publish_message(queue, message):
-    channel.basic_publish(exchange='', routing_key=queue, body=message)
+# queue_1 is split into hash-partitioned shards (queue_1, queue_1.shard-1, ...) when it runs hot
+# and merged back when it cools down; messages are routed by customer so each customer stays in order
+num_consumers_per_queue = 5
+num_customers = 100
+message_threshold = 1000  # Backlog per shard that triggers a split
+queue_1_shards = ShardedQueue(channel, queue_1, on_message=None, max_shards=4,
+                              consumers_per_shard=num_consumers_per_queue, split_depth=message_threshold)
+
+# Function to publish a message to a specific queue; created_ns is the intended send time from the load generator
+def publish_message(queue, message, customer_id=None, created_ns=None):
+    properties = stamp_published(pika.BasicProperties(headers={CREATED_HEADER: created_ns or time.time_ns()}))
+    if queue == queue_1:
+        queue_1_shards.publish(customer_id or queue, message, properties)
+    else:
+        channel.basic_publish(exchange='', routing_key=queue, body=message, properties=properties)
+
+# Shard 0 keeps consumers 1-5; shard k gets the next block after queue_2's 6-10 (11-15, 16-20, ...)
+def shard_consumer_id(shard, slot):
+    if shard == 0:
+        return slot + 1
+    return 2 * num_consumers_per_queue + (shard - 1) * num_consumers_per_queue + slot + 1
 
 # Callback function for the first queue
 def callback_queue_1(ch, method, properties, body):
-    global message_count_queue_1, new_queue_created
-    message_count_queue_1 += 1
     print(f" [x] Received from {queue_1}: '{body.decode()}'")
 
-    # Check if the threshold is exceeded
-    if message_count_queue_1 > message_threshold and not new_queue_created:
-        create_new_queue()
-
 # Callback function for the second queue
 def callback_queue_2(ch, method, properties, body):
     print(f" [x] Received from {queue_2}: '{body.decode()}'")
 
-# Function to create a new queue dynamically
-def create_new_queue():
-    global new_queue_created
-    new_queue_name = f"dynamic_queue_{message_count_queue_1}"
-    channel.queue_declare(queue=new_queue_name)
-    print(f" [x] New queue created: '{new_queue_name}'")
-
-    # Start consuming from the new queue
-    def callback_new_queue(ch, method, properties, body):
-        print(f" [x] Received from {new_queue_name}: '{body.decode()}'")
-
-    channel.basic_consume(queue=new_queue_name, on_message_callback=callback_new_queue, auto_ack=True)
-    new_queue_created = True
+# Increasing rates, run back to back on one deadline schedule (see load_generator for other profile types)
+LOAD_PROFILE = {'type': 'sequence', 'steps': [
+    {'type': 'constant', 'rate': 5, 'count': 100},
+    {'type': 'constant', 'rate': 10, 'count': 100},
+    {'type': 'constant', 'rate': 50, 'count': 500},
+    {'type': 'constant', 'rate': 100, 'count': 1000},
+    {'type': 'constant', 'rate': 1000, 'count': 5000},
+    {'type': 'constant', 'rate': 10000, 'count': 10000},
+]}
+
+# Message i goes to both queues at its intended time; falling behind sends immediately instead of sleeping
+def send_pair(i, intended_ns):
+    publish_message(queue_1, f"Message {i + 1} to Queue 1", customer_id=f"cust_{i % num_customers}",
+                    created_ns=intended_ns)
+    publish_message(queue_2, f"Message {i + 1} to Queue 2", created_ns=intended_ns)
+
+# Function to publish messages following a load profile
+def publish_messages(profile):
+    result = run(profile, send_pair)
+    print(describe(result))
+    return result
 
 # Function to publish messages at different rates
 def publish_messages_at_rate(rate, total_messages):
-    interval = 1 / rate  # Interval between messages in seconds
     print(f"Publishing {total_messages} messages at {rate} messages per second...")
-    for i in range(total_messages):
-        publish_message(queue_1, f"Message {i + 1} to Queue 1")
-        publish_message(queue_2, f"Message {i + 1} to Queue 2")
-        time.sleep(interval)
+    return publish_messages({'type': 'constant', 'rate': rate, 'count': total_messages})
 
 # Function to start consuming from the queues
 def start_consuming():
-    num_consumers_per_queue = 5
+    serve_metrics(metrics, METRICS_PORT)
 
     # Function to handle a message and update message count
-    def handle_message(ch, method, properties, body, consumer_id):
-        with lock:
-            message_counts[consumer_id] += 1
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Current timestamp
-            # Write the log to a file
-            with open(log_file, "a") as file:
-                file.write(f"[{timestamp}] [Consumer-{consumer_id}] Received: {body.decode()}\n")
-                file.write(f"[{timestamp}] [Consumer-{consumer_id}] Total Messages Processed: {message_counts[consumer_id]}\n")
-        print(f"[{timestamp}] [Consumer-{consumer_id}] Received: {body.decode()}")
-        print(f"[{timestamp}] [Consumer-{consumer_id}] Total Messages Processed: {message_counts[consumer_id]}")
-
-    # Assign consumers to queue_1
-    for i in range(num_consumers_per_queue):
-        channel.basic_consume(
-            queue=queue_1,
-            on_message_callback=lambda ch, method, properties, body, cid=i + 1: handle_message(ch, method, properties, body, cid),
-            auto_ack=True,
-        )
+    def handle_message(ch, method, properties, body, consumer_id, queue_id):
+        # All callbacks run on the connection thread, so the counter and writers need no lock
+        message_counts[consumer_id] += 1
+        metrics.increment('throughput', queue_id)
+        latency = latency_seconds(properties)
+        if latency is not None:
+            metrics.observe('latency', queue_id, latency)
+        if event_writer is not None:
+            created = (properties.headers or {}).get(CREATED_HEADER)
+            if created is not None:
+                event_writer.record(EVENT_CREATED, consumer_id, queue_id, method.delivery_tag, created)
+            event_writer.record(EVENT_RECEIVED, consumer_id, queue_id, method.delivery_tag)
+        if log_writer is None and not ECHO_TO_CONSOLE:
+            return
+        count = message_counts[consumer_id]
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Current timestamp
+        received = f"[{timestamp}] [Consumer-{consumer_id}] Received: {body.decode()}"
+        processed = f"[{timestamp}] [Consumer-{consumer_id}] Total Messages Processed: {count}"
+        # Hand both lines to the log writer in one call so they stay together
+        if log_writer is not None:
+            log_writer.write(f"{received}\n{processed}\n")
+        if ECHO_TO_CONSOLE:
+            print(received)
+            print(processed)
+
+    # Assign consumers to every queue_1 shard; the shards ack each message after handle_message
+    def handle_shard_message(shard, slot, ch, method, properties, body):
+        handle_message(ch, method, properties, body, shard_consumer_id(shard, slot), 1)
+
+    queue_1_shards.on_message = handle_shard_message
+    queue_1_shards.start(connection)
 
     # Assign consumers to queue_2
     for i in range(num_consumers_per_queue):
         channel.basic_consume(
             queue=queue_2,
-            on_message_callback=lambda ch, method, properties, body, cid=i + 6: handle_message(ch, method, properties, body, cid),
+            on_message_callback=lambda ch, method, properties, body, cid=i + 6: handle_message(ch, method, properties, body, cid, 2),
             auto_ack=True,
         )
 
@@ -108,16 +150,15 @@ def handle_message(body, consumer_id):
 
 if __name__ == "__main__":
     try:
-        # Publish messages at increasing rates
-        publish_messages_at_rate(5, 100)  # 5 messages per second
-        publish_messages_at_rate(10, 100)  # 10 messages per second
-        publish_messages_at_rate(50, 500)  # 50 messages per second
-        publish_messages_at_rate(100, 1000)  # 100 messages per second
-        publish_messages_at_rate(1000, 5000)  # 1000 messages per second
-        publish_messages_at_rate(10000, 10000)  # 10000 messages per second
+        # Publish messages at increasing rates (5, 10, 50, 100, 1000 and 10000 messages per second)
+        publish_messages(LOAD_PROFILE)
 
         # Start consuming messages from both queues
         start_consuming()
     except KeyboardInterrupt:
         print("Interrupted")
         connection.close()
+    finally:
+        for writer in (log_writer, event_writer):
+            if writer is not None:
+                writer.close()
@@ -1,17 +1,26 @@
-import pika
-import json
 import time
 import threading
 import logging
-from datetime import datetime
 from collections import defaultdict
 import random
 
+from cancellable_consumer import CancellableConsumer
+from codec import decode_order, encode_order, latency_seconds
+from log_writer import BatchedLogHandler
+from metrics_http import ConsumerGauges, serve_metrics
+from metrics_registry import MetricsRegistry
+from prefetch_controller import PrefetchController, log_prefetch
+from queue_sampler import QueueDepthSampler
+from scaling_policy import ModelScalingPolicy, QueueSnapshot
+from stage_timing import StageTimer, log_stages, stamp_published
+from transport import pika
+from worker_pool import WorkerPoolDispatcher
+
 # Configure logging to save to a file
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("order_processing.log"), logging.StreamHandler()]
+    handlers=[BatchedLogHandler("order_processing.log"), logging.StreamHandler()]
 )
 
 # RabbitMQ configuration
@@ -19,113 +28,233 @@ RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'order_exchange'
 ROUTING_KEYS = {'standard': 'order.standard', 'express': 'order.express', 'priority': 'order.priority'}
 QUEUE_NAMES = {'standard': 'standard_orders', 'express': 'express_orders', 'priority': 'priority_orders'}
+MESSAGE_CODEC = 'json'  # 'json' or the compact 'binary' codec; consumers pick it from content_type
+# Prometheus text endpoint on localhost (counters, latency histograms, queue and consumer gauges); None disables it
+METRICS_PORT = 9103
 
-# Store metrics
-metrics = {'latency': defaultdict(list), 'throughput': defaultdict(int)}
-queue_status = {name: {'length': 0, 'processing_time': []} for name in QUEUE_NAMES.values()}
+# Store metrics; consumer threads record into their own shards, so the hot path takes no lock
+metrics = MetricsRegistry()
+queue_status = {name: {'length': 0, 'consumers': 0} for name in QUEUE_NAMES.values()}
 consumer_threads = defaultdict(list)
 
 
+# Declare the exchange and queue and bind them so every channel sees the same topology
+def declare_queue(channel, queue_name):
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
+    channel.queue_declare(queue=queue_name, durable=True)
+    # Bind the queue to the exchange with the appropriate routing key
+    routing_key = ROUTING_KEYS[queue_name.split('_')[0]]
+    channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
+
+
+# Handle one order and return how long handling took; top-level so a process pool can run it
+def handle_order(queue_name, body, properties):
+    start = time.perf_counter()
+    message = decode_order(body, properties)
+    logging.info(f"Processing message from {queue_name}: {message}")
+    time.sleep(1)  # Simulate processing time
+    return time.perf_counter() - start
+
+
 class CentralizedScheduler:
-    def __init__(self):
+    # execution_mode 'inline' handles messages on the consuming thread,
+    # 'thread' or 'process' offloads them to a shared worker pool.
+    # policy sizes each queue's consumer pool every monitor_interval seconds;
+    # removed consumers get stop_timeout seconds to finish their in-flight messages;
+    # queue depths are sampled every sample_interval seconds (sub-second is fine);
+    # adaptive_prefetch lets each consumer tune its basic_qos from the prefetch_count it starts with;
+    # metrics_port serves the metrics and the queue gauges over HTTP (None: not served).
+    def __init__(self, execution_mode='inline', worker_pool_size=4, policy=None, monitor_interval=5,
+                 stop_timeout=10, sample_interval=1.0, adaptive_prefetch=True, metrics_port=METRICS_PORT):
         self.lock = threading.Lock()
+        self.adaptive_prefetch = adaptive_prefetch
+        self.sampler = QueueDepthSampler(QUEUE_NAMES.values(), host=RABBITMQ_HOST, interval=sample_interval)
+        self.policy = policy or ModelScalingPolicy()
+        self.monitor_interval = monitor_interval
+        self.stop_timeout = stop_timeout
         self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
         self.channels = {}  # To store channels for each queue
+        self.dispatcher = None
+        if execution_mode != 'inline':
+            self.dispatcher = WorkerPoolDispatcher(handle_order, on_complete=self.record_processing,
+                                                   mode=execution_mode, max_workers=worker_pool_size,
+                                                   stage_metrics=metrics)
+        self.gauges = ConsumerGauges(metrics, self.sampler, self.dispatcher)
+        self.metrics_port = metrics_port
+        self.metrics_server = None  # Started with the monitoring loop, not here
 
     def setup_channel(self, queue_name, prefetch_count=1):
         if queue_name not in self.channels:
             channel = self.connection.channel()
             # Ensure exchange and queue declarations are consistent
-            channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
-            channel.queue_declare(queue=queue_name, durable=True)
-            # Bind the queue to the exchange with the appropriate routing key
-            routing_key = ROUTING_KEYS[queue_name.split('_')[0]]
-            channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
+            declare_queue(channel, queue_name)
             channel.basic_qos(prefetch_count=prefetch_count)
             self.channels[queue_name] = channel
         return self.channels[queue_name]
 
     def process_message(self, ch, method, properties, body, queue_name):
-        message = json.loads(body)
-        start_time = datetime.fromisoformat(message['timestamp'])
-        logging.info(f"Processing message from {queue_name}: {message}")
-        
-        time.sleep(1)  # Simulate processing time
+        timer = StageTimer(properties)
+        timer.start()
+        service_time = handle_order(queue_name, body, properties)
+        timer.finish()
         ch.basic_ack(delivery_tag=method.delivery_tag)
-        
-        latency = (datetime.now() - start_time).total_seconds()
-        with self.lock:
-            metrics['latency'][queue_name].append(latency)
-            metrics['throughput'][queue_name] += 1
-            queue_status[queue_name]['processing_time'].append(latency)
+        timer.ack()
+        timer.record(metrics, queue_name)
+        self.record_processing(queue_name, method, properties, service_time)
+
+    def record_processing(self, queue_name, method, properties, service_time):
+        metrics.observe('service_time', queue_name, service_time)
+        metrics.increment('throughput', queue_name)
+        # End-to-end latency from the x-created-ns header, without touching the body
+        latency = latency_seconds(properties)
+        if latency is None:
+            return
+        metrics.observe('latency', queue_name, latency)
         logging.info(f"Processed message from {queue_name} in {latency:.2f} seconds")
 
+    # Each consumer gets its own connection and channel so it can be cancelled and closed on its own.
+    # With a worker pool, acks come back through add_callback_threadsafe and prefetch bounds the pool backlog.
     def start_consumer(self, queue_name, prefetch_count=10):
-        channel = self.setup_channel(queue_name, prefetch_count)
-        channel.basic_consume(queue=queue_name, on_message_callback=lambda ch, method, props, body: self.process_message(ch, method, props, body, queue_name))
+        prefetch_controller = None
+        if self.adaptive_prefetch:
+            # With the worker pool, the dispatcher sets the controller's share of the workers
+            prefetch_controller = lambda channel: PrefetchController(channel, queue_name, initial=prefetch_count,
+                                                                     metrics=metrics)
+        consumer = CancellableConsumer(
+            queue_name,
+            on_message=lambda ch, method, props, body: self.process_message(ch, method, props, body, queue_name),
+            prefetch_count=prefetch_count,
+            setup=lambda channel: declare_queue(channel, queue_name),
+            dispatcher=self.dispatcher,
+            host=RABBITMQ_HOST,
+            prefetch_controller=prefetch_controller,
+        )
         logging.info(f"Starting consumer for {queue_name} with prefetch_count={prefetch_count}")
-        try:
-            channel.start_consuming()
-        except pika.exceptions.ConnectionClosedByBroker:
-            logging.error(f"Connection to {queue_name} closed by broker.")
+        consumer.start()
+        return consumer
 
     def add_consumer(self, queue_name, prefetch_count):
-        thread = threading.Thread(target=self.start_consumer, args=(queue_name, prefetch_count), daemon=True)
-        thread.start()
-        consumer_threads[queue_name].append(thread)
+        consumer = self.start_consumer(queue_name, prefetch_count)
+        consumer_threads[queue_name].append(consumer)
+        self.gauges.add(queue_name, consumer.channel, prefetch_count, consumer.controller)
         logging.info(f"Added consumer to {queue_name}")
 
+    # Take a consumer out of the pool and signal it to stop; the caller joins it outside the lock
     def remove_consumer(self, queue_name):
         if consumer_threads[queue_name]:
-            thread = consumer_threads[queue_name].pop()
-            # Note: Implement logic to stop threads gracefully
-            logging.info(f"Removed consumer from {queue_name}")
+            consumer = consumer_threads[queue_name].pop()
+            self.gauges.remove(queue_name, consumer.channel)
+            # Cancel the subscription; in-flight messages finish before the channel closes
+            consumer.request_stop(timeout=self.stop_timeout)
+            return consumer
+        return None
+
+    # Join stopping consumers against one shared deadline
+    def reap(self, consumers):
+        deadline = time.monotonic() + self.stop_timeout
+        for consumer in consumers:
+            stopped = consumer.wait_stopped(deadline)
+            logging.info(f"Removed consumer from {consumer.queue_name}" + ("" if stopped else " (still shutting down)"))
+
+    def reap_in_background(self, consumers):
+        if consumers:
+            threading.Thread(target=self.reap, args=(consumers,), name='consumer-reaper', daemon=True).start()
+
+    def shutdown(self):
+        stopping = []
+        with self.lock:
+            for queue_name in list(consumer_threads):
+                stopping.extend(self.scale_to(queue_name, 0))
+        self.reap(stopping)
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown()
+        self.sampler.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.connection.close()
+
+    # Returns the consumers removed, already signalled to stop but not joined
+    def scale_to(self, queue_name, target, prefetch_count=1):
+        while len(consumer_threads[queue_name]) < target:
+            self.add_consumer(queue_name, prefetch_count)
+        stopping = []
+        while len(consumer_threads[queue_name]) > target:
+            stopping.append(self.remove_consumer(queue_name))
+        return stopping
 
     def monitor_and_adjust(self):
+        self.metrics_server = serve_metrics(metrics, self.metrics_port)
+        self.sampler.start()
+        last_collect = time.monotonic()
         while True:
-            with self.lock:
+            # Merge all consumer shards for the last monitoring window
+            counters, histograms = metrics.collect()
+            now = time.monotonic()
+            interval, last_collect = now - last_collect, now
+            # Latest depths from the sampler thread; reading them needs neither a connection nor the lock
+            sample = self.sampler.latest
+            if sample is not None:
                 for queue_name in QUEUE_NAMES.values():
-                    queue = self.channels[queue_name].queue_declare(queue=queue_name, passive=True)
-                    queue_length = queue.method.message_count
-                    queue_status[queue_name]['length'] = queue_length
+                    queue_status[queue_name]['length'] = sample.depths.get(queue_name, 0)
+                    queue_status[queue_name]['consumers'] = sample.consumers.get(queue_name, 0)
 
-                # Decision-making logic based on queue lengths
+            stopping = []
+            with self.lock:
+                # Let the scaling policy size each queue from its backlog, arrivals and service time
                 for queue_name, queue_data in queue_status.items():
-                    if queue_data['length'] > 10 and len(consumer_threads[queue_name]) < 3:
-                        self.add_consumer(queue_name, prefetch_count=1)
-                    elif queue_data['length'] == 0 and len(consumer_threads[queue_name]) > 1:
-                        self.remove_consumer(queue_name)
+                    service_times = histograms.get(('service_time', queue_name))
+                    snapshot = QueueSnapshot(
+                        queue_name, queue_data['length'], len(consumer_threads[queue_name]),
+                        counters.get(('throughput', queue_name), 0),
+                        service_times.mean() if service_times is not None and service_times.count else None,
+                        interval,
+                    )
+                    decision = self.policy.decide(snapshot, now)
+                    stopping.extend(self.scale_to(queue_name, decision.target))
+            # Removed consumers finish their in-flight messages without holding up the lock or this loop
+            self.reap_in_background(stopping)
 
-            self.log_metrics()
-            time.sleep(5)
+            self.log_metrics(counters, histograms, interval)
+            time.sleep(self.monitor_interval)
 
-    def log_metrics(self):
-        for queue_name, latencies in metrics['latency'].items():
-            avg_latency = sum(latencies) / len(latencies) if latencies else 0
-            throughput = metrics['throughput'][queue_name]
-            logging.info(f"{queue_name} - Avg Latency: {avg_latency:.2f}s, Throughput: {throughput} orders/sec")
+    def log_metrics(self, counters, histograms, interval=5):
+        for queue_name in QUEUE_NAMES.values():
+            log_prefetch(counters, histograms, queue_name)
+            log_stages(histograms, queue_name)
+            latencies = histograms.get(('latency', queue_name))
+            if latencies is None:
+                continue
+            throughput = counters.get(('throughput', queue_name), 0) / interval
+            logging.info(f"{queue_name} - Avg Latency: {latencies.mean():.2f}s, {latencies.describe()}, Throughput: {throughput:.2f} orders/sec")
 
 
 def generate_random_order(order_type):
     return {
         'order_id': f"{order_type}_{random.randint(1000, 9999)}",
         'customer_id': f"cust_{random.randint(100, 999)}",
-        'items': [f"item_{random.randint(1, 5)}" for _ in range(random.randint(1, 3))],
-        'timestamp': datetime.now().isoformat()
+        'items': [f"item_{random.randint(1, 5)}" for _ in range(random.randint(1, 3))]
     }
 
 
 def publish_order(order_type, order_data):
     channel = scheduler.setup_channel(QUEUE_NAMES[order_type])
     routing_key = ROUTING_KEYS[order_type]
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=json.dumps(order_data))
+    body, properties = encode_order(order_data, MESSAGE_CODEC)  # Creation time goes in the headers
+    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=body,
+                          properties=stamp_published(properties))
     logging.info(f"Sent {order_type} order: {order_data}")
 
 
-if __name__ == '__main__':
+# Start the scheduler and its monitoring thread; benchmark.py calls this too
+def start_consumers():
+    global scheduler
     scheduler = CentralizedScheduler()
     monitoring_thread = threading.Thread(target=scheduler.monitor_and_adjust, daemon=True)
     monitoring_thread.start()
+    return scheduler
+
+if __name__ == '__main__':
+    start_consumers()
 
     try:
         while True:
@@ -135,4 +264,4 @@ if __name__ == '__main__':
             time.sleep(random.uniform(0.5, 2))
     except KeyboardInterrupt:
         logging.info("Stopped sending orders.")
-        scheduler.connection.close()
+        scheduler.shutdown()
@@ -1,51 +1,38 @@
-import re
-from collections import defaultdict
+import numpy as np
 import matplotlib.pyplot as plt
-from datetime import datetime
-# File name containing the logs
-logs = "consumer_2_log.txt"
-
-
-
-pattern = re.compile(r'\[(.*?)\] \[Consumer-(\d+)\] Received: Message')
 
-# Dictionary to store timestamps for each consumer
-consumer_timestamps = {}
+from log_ingest import consumer_ids, ingest
 
-# Parse the logs
-for line in logs.splitlines():
-    match = pattern.search(line)
-    if match:
-        timestamp = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
-        consumer_id = match.group(2)
-        if consumer_id not in consumer_timestamps:
-            consumer_timestamps[consumer_id] = []
-        consumer_timestamps[consumer_id].append(timestamp)
-
-print(f"Consumers found in logs: {list(consumer_timestamps.keys())}")
+# File name containing the logs
+logs = "consumer_2_logs.txt"
 
 # Choose the consumer to analyze
 consumer_id_to_analyze = "2"  # Adjust the ID to analyze another consumer
 
-if consumer_id_to_analyze in consumer_timestamps:
-    timestamps = consumer_timestamps[consumer_id_to_analyze]
-    if len(timestamps) > 1:
-        # Calculate latencies between consecutive messages
-        latencies = [(timestamps[i] - timestamps[i - 1]).total_seconds() for i in range(1, len(timestamps))]
-
-        # Print latencies
-        print(f"Consumer-{consumer_id_to_analyze} Latencies: {latencies}")
-
-        # Plot the latencies
-        plt.figure(figsize=(10, 6))
-        plt.plot(range(len(latencies)), latencies, marker='o', linestyle='-', color='blue')
-        plt.title(f"Message Latency Over Time for Consumer-{consumer_id_to_analyze}")
-        plt.xlabel("Message Index")
-        plt.ylabel("Latency (seconds)")
-        plt.grid(True)
-        plt.tight_layout()
-        plt.show()
+if __name__ == "__main__":
+    # Parse the logs
+    consumer_logs = ingest(logs)
+    print(f"Consumers found in logs: {consumer_ids(consumer_logs)}")
+
+    if consumer_id_to_analyze in consumer_logs:
+        timestamps = consumer_logs[consumer_id_to_analyze].received_at
+        if len(timestamps) > 1:
+            # Calculate latencies between consecutive messages
+            latencies = np.diff(timestamps)
+
+            # Print latencies
+            print(f"Consumer-{consumer_id_to_analyze} Latencies: {latencies.tolist()}")
+
+            # Plot the latencies
+            plt.figure(figsize=(10, 6))
+            plt.plot(np.arange(len(latencies)), latencies, marker='o', linestyle='-', color='blue')
+            plt.title(f"Message Latency Over Time for Consumer-{consumer_id_to_analyze}")
+            plt.xlabel("Message Index")
+            plt.ylabel("Latency (seconds)")
+            plt.grid(True)
+            plt.tight_layout()
+            plt.show()
+        else:
+            print(f"Consumer-{consumer_id_to_analyze} has only one timestamp, no latency to calculate.")
     else:
-        print(f"Consumer-{consumer_id_to_analyze} has only one timestamp, no latency to calculate.")
-else:
-    print(f"No data found for Consumer-{consumer_id_to_analyze}.")
\ No newline at end of file
+        print(f"No data found for Consumer-{consumer_id_to_analyze}.")
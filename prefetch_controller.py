@@ -0,0 +1,151 @@
+# Adaptive prefetch (basic_qos) for one consumer channel.
+# The controller times each handler call (service time) and the idle gap
+# between finishing a message and the next delivery reaching the handler;
+# when the local prefetch buffer ran dry, that gap is the delivery round
+# trip. It keeps enough messages in flight to cover the round trip
+# (concurrency * (1 + round_trip / service_time)) but never more than
+# max_buffered_seconds of work, so a slow consumer does not hoard the
+# backlog. Gaps longer than max_round_trip mean the queue was empty and
+# are ignored.
+#
+# Gaps are only sampled when the buffer provably ran dry: fewer of the
+# channel's messages than its concurrency were left in flight, and nothing
+# delivered was still waiting. A worker pool sees deliveries as they arrive
+# (on_delivery(on_arrival=True)), so it knows; an inline handler only sees
+# the next message once it is free, so a buffered one can't be told apart
+# from one that just arrived unless the window is at most one message per
+# worker. With a bigger window inline the last estimate is kept.
+#
+# concurrency is how many messages of this channel can be handled at once:
+# 1 inline, the channel's share of the pool's workers with a shared pool
+# (WorkerPoolDispatcher keeps it up to date as channels come and go).
+#
+# RabbitMQ applies a per-consumer prefetch only when basic_consume is
+# called, so attach() sets max_prefetch as the per-consumer ceiling and
+# steers the channel-wide (global_qos) limit, which takes effect at once.
+# All calls must come from the channel's connection thread (message
+# callbacks and WorkerPoolDispatcher's on_complete both do).
+import logging
+import math
+import time
+from collections import deque, namedtuple
+
+PrefetchDecision = namedtuple('PrefetchDecision', 'time name current target service_time round_trip utilisation reason')
+
+
+class PrefetchController:
+    def __init__(self, channel, name, initial=1, min_prefetch=1, max_prefetch=100, concurrency=1,
+                 max_buffered_seconds=2.0, max_round_trip=0.5, smoothing=0.2, adjust_every=1.0,
+                 metrics=None, history=200, clock=time.monotonic):
+        self.channel = channel
+        self.name = name
+        self.prefetch = initial
+        self.min_prefetch = min_prefetch
+        self.max_prefetch = max_prefetch
+        self.concurrency = concurrency
+        self.max_buffered_seconds = max_buffered_seconds
+        self.max_round_trip = max_round_trip
+        self.smoothing = smoothing  # EWMA weight of the newest observation
+        self.adjust_every = adjust_every
+        self.metrics = metrics
+        self.decisions = deque(maxlen=history)
+        self.clock = clock
+
+        self.service_time = None
+        self.round_trip = None
+        self.in_handler = 0
+        self.dry_since = None  # When the buffer last ran dry, until the next delivery
+        self.busy = 0.0
+        self.idle = 0.0
+        self.last_adjust = clock()
+
+    # Call once before basic_consume
+    def attach(self):
+        self.channel.basic_qos(prefetch_count=self.max_prefetch)
+        self.channel.basic_qos(prefetch_count=self.prefetch, global_qos=True)
+        return self.prefetch
+
+    def _smooth(self, previous, value):
+        return value if previous is None else self.smoothing * value + (1 - self.smoothing) * previous
+
+    # A delivery is about to be handled. on_arrival: the caller sees deliveries as they arrive
+    # (a worker pool) rather than when the handler is free (inline).
+    def on_delivery(self, on_arrival=False):
+        now = self.clock()
+        if self.dry_since is not None and (on_arrival or self.prefetch <= self.concurrency):
+            gap = now - self.dry_since
+            if gap <= self.max_round_trip:
+                self.idle += gap
+                self.round_trip = self._smooth(self.round_trip, gap)
+        self.dry_since = None
+        self.in_handler += 1
+        return now
+
+    # The delivery handed to on_delivery at `started` has been processed and acked
+    def on_done(self, started):
+        now = self.clock()
+        service_time = now - started
+        self.busy += service_time
+        self.service_time = self._smooth(self.service_time, service_time)
+        self.in_handler = max(0, self.in_handler - 1)
+        if self.in_handler < self.concurrency:
+            self.dry_since = now
+        if now - self.last_adjust >= self.adjust_every:
+            self.adjust(now)
+
+    # Messages in flight that keep every worker busy across a round trip, bounded by the buffered-work budget
+    def target(self):
+        if not self.service_time:
+            return self.prefetch, 'no service time yet'
+        round_trip = self.round_trip or 0.0
+        needed = math.ceil(self.concurrency * (1 + math.ceil(round_trip / self.service_time)))
+        budget = math.ceil(self.concurrency * max(1, math.floor(self.max_buffered_seconds / self.service_time)))
+        if needed > budget:
+            return budget, f"capped at {self.max_buffered_seconds:.1f}s of buffered work"
+        return needed, 'cover delivery round trip'
+
+    def adjust(self, now=None):
+        now = self.clock() if now is None else now
+        self.last_adjust = now
+        wanted, reason = self.target()
+        wanted = min(self.max_prefetch, max(self.min_prefetch, wanted))
+        total = self.busy + self.idle
+        utilisation = self.busy / total if total else 0.0
+        self.busy = self.idle = 0.0
+        decision = PrefetchDecision(now, self.name, self.prefetch, wanted, self.service_time or 0.0,
+                                    self.round_trip or 0.0, utilisation, reason)
+        self.decisions.append(decision)
+        if self.metrics is not None:
+            self.metrics.observe('prefetch_count', self.name, wanted)
+            self.metrics.observe('delivery_round_trip', self.name, decision.round_trip)
+        if wanted == self.prefetch or not self.channel.is_open:
+            return decision
+        self.channel.basic_qos(prefetch_count=wanted, global_qos=True)
+        if self.metrics is not None:
+            self.metrics.increment('prefetch_adjustments', self.name)
+        logging.info(f"Prefetch for {self.name}: {self.prefetch} -> {wanted} ({reason}; "
+                     f"service={decision.service_time:.3f}s, round trip={decision.round_trip * 1000:.1f}ms, "
+                     f"utilisation={utilisation:.0%})")
+        self.prefetch = wanted
+        return decision
+
+    # Wrap on_message_callback(ch, method, properties, body) so every call is timed
+    def wrap(self, callback):
+        def timed(ch, method, properties, body):
+            started = self.on_delivery()
+            try:
+                return callback(ch, method, properties, body)
+            finally:
+                self.on_done(started)
+        return timed
+
+
+# One log line per queue from a MetricsRegistry.collect() window, for the scripts' log_metrics loops
+def log_prefetch(counters, histograms, queue_name):
+    prefetch = histograms.get(('prefetch_count', queue_name))
+    if prefetch is None or not prefetch.count:
+        return
+    round_trip = histograms.get(('delivery_round_trip', queue_name))
+    adjustments = counters.get(('prefetch_adjustments', queue_name), 0)
+    logging.info(f"{queue_name} - Prefetch p50: {prefetch.percentile(50):.0f}, max: {prefetch.percentile(100):.0f}, "
+                 f"round trip p50: {round_trip.percentile(50) * 1000:.1f}ms, adjustments: {adjustments}")
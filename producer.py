@@ -1,9 +1,9 @@
-import pika
-import json
 import time
-from datetime import datetime
 import random
 
+from codec import encode_order
+from publisher_pool import get_publisher_pool
+
 # RabbitMQ configuration
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'order_exchange'
@@ -12,27 +12,23 @@ ROUTING_KEYS = {
     'express': 'order.express',
     'priority': 'order.priority'
 }
+MESSAGE_CODEC = 'json'  # 'json' or the compact 'binary' codec; consumers pick it from content_type
 
-# Connect to RabbitMQ and declare the exchange
-def connect():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
-    return channel, connection
+# Long-lived connections shared by every publish_order call
+publisher = get_publisher_pool(RABBITMQ_HOST, EXCHANGE_NAME)
 
 # Publish a message to RabbitMQ
 def publish_order(order_type, order_data):
-    channel, connection = connect()
     routing_key = ROUTING_KEYS[order_type]
     message = {
         'order_id': order_data['order_id'],
         'customer_id': order_data['customer_id'],
-        'items': order_data['items'],
-        'timestamp': datetime.now().isoformat()
+        'items': order_data['items']
     }
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=json.dumps(message))
+    # The creation time travels as epoch nanoseconds in the message headers
+    body, properties = encode_order(message, MESSAGE_CODEC)
+    publisher.publish(routing_key, body, properties)
     print(f"Sent {order_type} order: {message}")
-    connection.close()
 
 # Generate random orders and send them to RabbitMQ
 def generate_random_order(order_type):
@@ -0,0 +1,137 @@
+# Shared pool of long-lived RabbitMQ publisher connections.
+# publish_order used to open a BlockingConnection, declare the exchange, publish
+# one message and close again. The pool keeps a bounded number of open
+# connections, checks a channel out to the calling thread for each publish and
+# rebuilds it transparently when the broker drops it.
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from stage_timing import stamp_published
+from transport import pika
+
+RABBITMQ_HOST = 'localhost'
+EXCHANGE_NAME = 'order_exchange'
+
+# Errors that leave a connection or channel unusable, so the slot is rebuilt
+RECONNECT_ERRORS = (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError)
+
+
+# One pooled connection with its publishing channel.
+# BlockingConnection is not thread-safe, so a slot is only ever used by the
+# thread that has it checked out and carries exactly one channel.
+class PooledChannel:
+    def __init__(self, parameters, exchange_name, exchange_type):
+        self.parameters = parameters
+        self.exchange_name = exchange_name
+        self.exchange_type = exchange_type
+        self.connection = None
+        self.channel = None
+
+    def is_open(self):
+        return (self.connection is not None and self.connection.is_open
+                and self.channel is not None and self.channel.is_open)
+
+    def open(self):
+        self.close()
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(exchange=self.exchange_name, exchange_type=self.exchange_type)
+
+    def ensure_open(self):
+        if self.is_open():
+            try:
+                # Service heartbeats that were missed while the slot sat idle
+                self.connection.process_data_events(time_limit=0)
+                return
+            except RECONNECT_ERRORS:
+                logging.warning("Pooled publisher connection lost, reconnecting")
+        self.open()
+
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except RECONNECT_ERRORS:
+                pass
+        self.connection = None
+        self.channel = None
+
+
+class PublisherPool:
+    def __init__(self, host=RABBITMQ_HOST, exchange_name=EXCHANGE_NAME, exchange_type='topic',
+                 max_connections=8, checkout_timeout=30, retries=1):
+        self.parameters = pika.ConnectionParameters(host=host)
+        self.exchange_name = exchange_name
+        self.exchange_type = exchange_type
+        self.max_connections = max_connections
+        self.checkout_timeout = checkout_timeout
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.idle = queue.LifoQueue()  # LIFO keeps the hottest connections in use
+        self.created = 0
+
+    def _checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.max_connections:
+                self.created += 1
+                return PooledChannel(self.parameters, self.exchange_name, self.exchange_type)
+        try:
+            return self.idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No publisher channel free after {self.checkout_timeout}s "
+                               f"(max_connections={self.max_connections})")
+
+    # Check a channel out to the current thread for the duration of the block
+    @contextmanager
+    def channel(self):
+        slot = self._checkout()
+        try:
+            slot.ensure_open()
+            yield slot.channel
+        except RECONNECT_ERRORS:
+            slot.close()
+            raise
+        finally:
+            self.idle.put(slot)
+
+    def publish(self, routing_key, body, properties=None, exchange=None):
+        exchange = self.exchange_name if exchange is None else exchange
+        for attempt in range(self.retries + 1):
+            try:
+                with self.channel() as channel:
+                    channel.basic_publish(exchange=exchange, routing_key=routing_key,
+                                          body=body, properties=stamp_published(properties))
+                return
+            except RECONNECT_ERRORS:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Publish to {routing_key} failed, retrying on a fresh connection")
+
+    def close(self):
+        while True:
+            try:
+                slot = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            slot.close()
+            with self.lock:
+                self.created -= 1
+
+
+# Process-wide pools so every publish_order entry point shares connections
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_publisher_pool(host=RABBITMQ_HOST, exchange_name=EXCHANGE_NAME, **kwargs):
+    with _pools_lock:
+        key = (host, exchange_name)
+        if key not in _pools:
+            _pools[key] = PublisherPool(host=host, exchange_name=exchange_name, **kwargs)
+        return _pools[key]
@@ -0,0 +1,164 @@
+# Queue depth sampler for the schedulers.
+# Keeps one monitoring connection and channel open on its own I/O thread
+# and every `interval` seconds pipelines a passive queue_declare for all
+# queues at once, so one round covers every queue instead of one
+# connection per queue. Each round becomes a timestamped DepthSample in a
+# bounded series; readers take `latest` or `series` without locking.
+# A passive declare of a queue that does not exist closes the channel with
+# a 404. Replies come back in order, so the first queue still pending is the
+# missing one: it is left out of the round, and a fresh channel picks up
+# from the queue after it, so one missing queue never hides the others.
+import functools
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from transport import pika
+
+RABBITMQ_HOST = 'localhost'
+NOT_FOUND = 404
+
+# time: time.monotonic() when the round completed, wall_time: time.time() for logs and plots,
+# depths / consumers: queue name -> ready message count / consumer count
+DepthSample = namedtuple('DepthSample', 'time wall_time depths consumers')
+
+
+class QueueDepthSampler:
+    def __init__(self, queue_names, host=RABBITMQ_HOST, interval=1.0, history=600, reconnect_delay=1.0):
+        self.queue_names = list(queue_names)
+        self.parameters = pika.ConnectionParameters(host=host)
+        self.interval = interval
+        self.reconnect_delay = reconnect_delay
+        self.series = deque(maxlen=history)
+        self.latest = None
+
+        self.ioloop = pika.adapters.select_connection.IOLoop()
+        self.connection = None
+        self.channel = None
+        self.thread = None
+        self.closing = False
+        self.round = None
+        self.round_started = None
+        self.pending = deque()  # Queues declared in this round and not yet answered, in order
+        self.missing = set()    # Queues the broker reported missing, logged once until they appear
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='queue-depth-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.closing = True
+        self.ioloop.add_callback_threadsafe(self._close)
+        if self.thread is not None:
+            self.thread.join()
+
+    # Depth of queue_name in the most recent sample, or default before the first sample
+    def depth(self, queue_name, default=0):
+        sample = self.latest
+        return sample.depths.get(queue_name, default) if sample is not None else default
+
+    def _run(self):
+        self._connect()
+        self.ioloop.start()
+
+    def _connect(self):
+        self.connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=lambda connection: self._open_channel(),
+            on_open_error_callback=self._on_connection_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self.ioloop,
+        )
+
+    def _on_connection_error(self, connection, error):
+        logging.error(f"Queue depth sampler failed to connect: {error}")
+        self.ioloop.call_later(self.reconnect_delay, self._connect)
+
+    def _on_connection_closed(self, connection, reason):
+        self.channel = None
+        if self.closing:
+            self.ioloop.stop()
+            return
+        logging.warning(f"Queue depth sampler connection closed: {reason}, reconnecting")
+        self.ioloop.call_later(self.reconnect_delay, self._connect)
+
+    # resume: queues still to declare in the current round, or None to start a new round
+    def _open_channel(self, resume=None):
+        self.connection.channel(on_open_callback=functools.partial(self._on_channel_open, resume))
+
+    def _on_channel_open(self, resume, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        if resume is None:
+            self._sample()
+        else:
+            self._declare(resume)
+
+    def _on_channel_closed(self, channel, reason):
+        self.channel = None
+        if self.closing or not self.connection.is_open:
+            return
+        if getattr(reason, 'reply_code', None) == NOT_FOUND and self.round is not None and self.pending:
+            queue_name = self.pending.popleft()
+            if queue_name not in self.missing:
+                self.missing.add(queue_name)
+                logging.warning(f"Queue depth sampler: queue {queue_name} does not exist, leaving it out")
+            if self.pending:
+                self._open_channel(list(self.pending))
+            else:
+                self.ioloop.call_later(self._end_round(), self._open_channel)
+            return
+        logging.warning(f"Queue depth sampler channel closed: {reason}")
+        if self.round:
+            self._finish_round()
+        else:
+            self.round = None
+        self.ioloop.call_later(self.interval, self._open_channel)
+
+    def _sample(self):
+        if self.channel is None or not self.channel.is_open:
+            return
+        self.round = {}
+        self.round_started = time.monotonic()
+        self._declare(self.queue_names)
+
+    # All declares go out back to back; replies are collected as they arrive
+    def _declare(self, queue_names):
+        self.pending = deque(queue_names)
+        for queue_name in queue_names:
+            self.channel.queue_declare(queue=queue_name, passive=True,
+                                       callback=functools.partial(self._on_declare_ok, queue_name))
+
+    def _on_declare_ok(self, queue_name, frame):
+        if self.round is None:
+            return
+        self.round[queue_name] = (frame.method.message_count, frame.method.consumer_count)
+        self.missing.discard(queue_name)
+        if queue_name in self.pending:
+            self.pending.remove(queue_name)
+        if not self.pending:
+            self.ioloop.call_later(self._end_round(), self._sample)
+
+    # Publish the round; returns the delay until the next one, an interval after this one started
+    def _end_round(self):
+        if self.round:
+            self._finish_round()
+        self.round = None
+        return max(0.0, self.interval - (time.monotonic() - self.round_started))
+
+    def _finish_round(self):
+        sample = DepthSample(
+            time.monotonic(), time.time(),
+            {queue_name: counts[0] for queue_name, counts in self.round.items()},
+            {queue_name: counts[1] for queue_name, counts in self.round.items()},
+        )
+        self.round = None
+        self.series.append(sample)
+        self.latest = sample
+
+    def _close(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        else:
+            self.ioloop.stop()
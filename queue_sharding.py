@@ -0,0 +1,224 @@
+# Hash-partitioned sharding of one logical queue.
+# A ShardedQueue spreads a hot queue over K physical queues: shard 0 is the
+# logical queue itself, shard k > 0 is "<name>.shard-<k>". Producers call
+# publish(key, body), which routes by a consistent hash of the key (the
+# customer_id), so all of a customer's messages land on one shard and stay
+# in order while different customers are consumed in parallel. check()
+# samples the shard depths and the publish rate and splits (adds a shard)
+# when the backlog or rate per shard crosses a threshold, or merges (drops
+# the highest shard) when load falls away.
+#
+# Resharding moves some keys between shards. To keep per-customer order, a
+# barrier message is published to every shard that can lose keys right
+# after the ring changes; a shard that can gain keys is not consumed until
+# all of those barriers have been consumed, i.e. until every message routed
+# under the old ring has been handled. A shard being merged away is deleted
+# once its barrier comes through.
+#
+# Everything runs on the thread driving the channel's BlockingConnection
+# (message callbacks and connection.call_later), so there are no locks.
+import bisect
+import functools
+import hashlib
+import itertools
+import logging
+import time
+
+from transport import pika
+
+BARRIER_HEADER = 'x-shard-barrier'
+
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.points = []  # sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            bisect.insort(self.points, (self._hash(f"{node}#{replica}"), node))
+
+    def remove(self, node):
+        self.points = [point for point in self.points if point[1] != node]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.points, (self._hash(key),))
+        return self.points[index % len(self.points)][1]
+
+
+class ShardedQueue:
+    # on_message(shard, slot, ch, method, properties, body) handles one message; the shard acks it afterwards
+    # (or requeues it in order when on_message raises). declare(channel, queue_name) creates a physical queue.
+    def __init__(self, channel, name, on_message, shards=1, min_shards=1, max_shards=8, consumers_per_shard=1,
+                 prefetch_count=10, split_depth=1000, split_rate=None, merge_depth=50, cooldown=10.0,
+                 check_interval=1.0, declare=None, clock=time.monotonic):
+        self.channel = channel
+        self.name = name
+        self.on_message = on_message
+        self.min_shards = max(1, min_shards)
+        self.max_shards = max_shards
+        self.consumers_per_shard = consumers_per_shard
+        self.prefetch_count = prefetch_count
+        self.split_depth = split_depth  # ready messages per shard that trigger a split
+        self.split_rate = split_rate    # publishes per second per shard that trigger a split (None: depth only)
+        self.merge_depth = merge_depth  # total backlog below which a shard is merged away
+        self.cooldown = cooldown
+        self.check_interval = check_interval
+        self.declare = declare or (lambda ch, queue_name: ch.queue_declare(queue=queue_name))
+        self.clock = clock
+
+        self.shards = []
+        self.ring = HashRing()
+        self.consumer_tags = {}
+        self.blocked = {}     # shard -> barrier ids it waits for
+        self.barriers = {}    # barrier id -> donor shard
+        self.retiring = {}    # barrier id -> shard to delete once it arrives
+        self.barrier_ids = itertools.count(1)
+        self.consuming = False
+        self.published = 0
+        self.last_check = clock()
+        self.last_change = -float('inf')
+        self.connection = None
+
+        for shard in range(max(self.min_shards, shards)):
+            self._add_shard(shard)
+
+    def queue_for_shard(self, shard):
+        return self.name if shard == 0 else f"{self.name}.shard-{shard}"
+
+    def route(self, key):
+        return self.queue_for_shard(self.ring.node_for(key))
+
+    def publish(self, key, body, properties=None):
+        self.channel.basic_publish(exchange='', routing_key=self.route(key), body=body, properties=properties)
+        self.published += 1
+        self.maybe_check()
+
+    # Start consuming every unblocked shard and schedule check() on the connection's timer
+    def start(self, connection):
+        self.connection = connection
+        self.consuming = True
+        for shard in self.shards:
+            if not self.blocked.get(shard):
+                self._start_consumers(shard)
+        connection.call_later(self.check_interval, self._tick)
+
+    def _tick(self):
+        self.maybe_check()
+        self.connection.call_later(self.check_interval, self._tick)
+
+    def maybe_check(self):
+        if self.clock() - self.last_check >= self.check_interval:
+            self.check()
+
+    # Sample depth and publish rate and split or merge once per cooldown
+    def check(self):
+        now = self.clock()
+        elapsed = max(now - self.last_check, 1e-9)
+        rate = self.published / elapsed
+        self.published = 0
+        self.last_check = now
+        depths = {shard: self.channel.queue_declare(queue=self.queue_for_shard(shard), passive=True).method.message_count
+                  for shard in self.shards}
+        total = sum(depths.values())
+        count = len(self.shards)
+        if self.barriers or now - self.last_change < self.cooldown:
+            return depths  # Still settling the previous change
+        hot = total / count > self.split_depth or (self.split_rate is not None and rate / count > self.split_rate)
+        if hot and count < self.max_shards:
+            self.split(f"backlog {total} / rate {rate:.0f}/s over {count} shards")
+        elif not hot and count > self.min_shards and total < self.merge_depth and (
+                self.split_rate is None or rate < self.split_rate * (count - 1) / 2):
+            self.merge(f"backlog {total} / rate {rate:.0f}/s over {count} shards")
+        return depths
+
+    def split(self, reason='manual'):
+        shard = max(self.shards) + 1
+        donors = list(self.shards)
+        self._add_shard(shard)
+        # Keys moving to the new shard may still have messages queued on any donor
+        self.blocked[shard] = {self._send_barrier(donor) for donor in donors}
+        self.last_change = self.clock()
+        logging.info(f"Split {self.name} into {len(self.shards)} shards ({reason})")
+
+    def merge(self, reason='manual'):
+        shard = max(self.shards)
+        self.shards.remove(shard)
+        self.ring.remove(shard)
+        barrier = self._send_barrier(shard)
+        self.retiring[barrier] = shard
+        # Every remaining shard may inherit keys, so pause them until the retiring shard has drained
+        for recipient in self.shards:
+            self.blocked.setdefault(recipient, set()).add(barrier)
+            self._stop_consumers(recipient)
+        self.last_change = self.clock()
+        logging.info(f"Merging {self.name} down to {len(self.shards)} shards ({reason})")
+
+    def _add_shard(self, shard):
+        self.declare(self.channel, self.queue_for_shard(shard))
+        self.shards.append(shard)
+        self.ring.add(shard)
+
+    def _send_barrier(self, shard):
+        barrier = next(self.barrier_ids)
+        self.barriers[barrier] = shard
+        self.channel.basic_publish(exchange='', routing_key=self.queue_for_shard(shard), body=b'',
+                                   properties=pika.BasicProperties(headers={BARRIER_HEADER: barrier}))
+        return barrier
+
+    def _start_consumers(self, shard):
+        if not self.consuming or shard in self.consumer_tags:
+            return
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.consumer_tags[shard] = [
+            self.channel.basic_consume(queue=self.queue_for_shard(shard),
+                                       on_message_callback=functools.partial(self._on_message, shard, slot))
+            for slot in range(self.consumers_per_shard)
+        ]
+
+    # Undispatched deliveries are nacked back to the queue by basic_cancel, so nothing is lost
+    def _stop_consumers(self, shard):
+        for tag in self.consumer_tags.pop(shard, ()):
+            self.channel.basic_cancel(tag)
+
+    def _on_message(self, shard, slot, ch, method, properties, body):
+        headers = properties.headers or {}
+        if BARRIER_HEADER in headers:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self._release(headers[BARRIER_HEADER])
+            return
+        try:
+            self.on_message(shard, slot, ch, method, properties, body)
+        except Exception:
+            logging.exception(f"Failed to process message from {self.queue_for_shard(shard)}; requeueing it")
+            # Later messages of the same keys may be prefetched behind it. Cancelling hands them back too,
+            # and resubscribing after the requeue delivers the failed message again before any of them.
+            self._stop_consumers(shard)
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            if not self.blocked.get(shard):
+                self._start_consumers(shard)
+        else:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _release(self, barrier):
+        if self.barriers.pop(barrier, None) is None:
+            return
+        retired = self.retiring.pop(barrier, None)
+        if retired is not None:
+            self._stop_consumers(retired)
+            self.channel.queue_delete(queue=self.queue_for_shard(retired))
+            self.blocked.pop(retired, None)
+            logging.info(f"Removed {self.queue_for_shard(retired)} after draining it")
+        for shard in self.shards:
+            waiting = self.blocked.get(shard)
+            if waiting and barrier in waiting:
+                waiting.discard(barrier)
+                if not waiting:
+                    del self.blocked[shard]
+                    self._start_consumers(shard)
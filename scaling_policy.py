@@ -0,0 +1,173 @@
+# Pluggable consumer scaling policies for CentralizedScheduler.monitor_and_adjust.
+# A policy sees one QueueSnapshot per queue per tick and returns a
+# ScalingDecision with the consumer count it wants. ThresholdPolicy is the
+# original fixed-threshold logic; ModelScalingPolicy estimates arrival rate
+# and service time and sizes the pool with an M/M/c model so the expected
+# latency (plus draining the current backlog) stays within a per-queue
+# target. Time is passed in explicitly so the same code can run on a
+# simulated clock. allow_scale_down=False is for callers that cannot stop
+# consumers: the policy never proposes fewer than the current count, so it
+# doesn't record (and start cooling down after) a change nobody applied.
+import abc
+import logging
+import math
+from collections import deque, namedtuple
+
+# depth: messages ready in the broker, consumers: current consumer count,
+# completed: messages finished during the last interval, service_time: mean
+# handler time over the interval (None when nothing completed)
+QueueSnapshot = namedtuple('QueueSnapshot', 'queue_name depth consumers completed service_time interval')
+
+ScalingDecision = namedtuple('ScalingDecision',
+                             'time queue_name current target arrival_rate service_time depth reason')
+
+
+class ScalingPolicy(abc.ABC):
+    def __init__(self, history=1000, allow_scale_down=True):
+        self.decisions = deque(maxlen=history)
+        self.allow_scale_down = allow_scale_down
+
+    @abc.abstractmethod
+    def decide(self, snapshot, now):
+        pass
+
+    # Every tick decides for every queue, so only changes are logged at INFO; holds go to DEBUG
+    def record(self, decision):
+        self.decisions.append(decision)
+        level = logging.INFO if decision.target != decision.current else logging.DEBUG
+        logging.log(level, f"Scaling {decision.queue_name}: {decision.current} -> {decision.target} consumers "
+                           f"({decision.reason}; depth={decision.depth}, arrival={decision.arrival_rate:.2f}/s, "
+                           f"service={decision.service_time:.3f}s)")
+        return decision
+
+
+# The original rule: add one consumer above a backlog threshold, drop one when the queue is empty
+class ThresholdPolicy(ScalingPolicy):
+    def __init__(self, scale_up_depth=10, max_consumers=3, min_consumers=1, history=1000, allow_scale_down=True):
+        super().__init__(history, allow_scale_down)
+        self.scale_up_depth = scale_up_depth
+        self.max_consumers = max_consumers
+        self.min_consumers = min_consumers
+
+    def decide(self, snapshot, now):
+        current = snapshot.consumers
+        target, reason = current, 'hold'
+        if snapshot.depth > self.scale_up_depth and current < self.max_consumers:
+            target, reason = current + 1, f"depth above {self.scale_up_depth}"
+        elif snapshot.depth == 0 and current > self.min_consumers and self.allow_scale_down:
+            target, reason = current - 1, 'queue empty'
+        arrival_rate = snapshot.completed / snapshot.interval if snapshot.interval else 0.0
+        return self.record(ScalingDecision(now, snapshot.queue_name, current, target, arrival_rate,
+                                           snapshot.service_time or 0.0, snapshot.depth, reason))
+
+
+# Probability that an arrival has to wait in an M/M/c queue with offered load a = lambda / mu
+def erlang_c(consumers, offered_load):
+    if offered_load <= 0:
+        return 0.0
+    if offered_load >= consumers:
+        return 1.0
+    erlang_b = 1.0
+    for k in range(1, consumers + 1):
+        erlang_b = offered_load * erlang_b / (k + offered_load * erlang_b)
+    return consumers * erlang_b / (consumers - offered_load * (1 - erlang_b))
+
+
+# Expected time in system (queueing + service) for an M/M/c queue, inf if unstable
+def expected_latency(consumers, arrival_rate, service_time):
+    if consumers <= 0:
+        return math.inf
+    service_rate = 1.0 / service_time
+    if arrival_rate >= consumers * service_rate:
+        return math.inf
+    wait = erlang_c(consumers, arrival_rate * service_time) / (consumers * service_rate - arrival_rate)
+    return wait + service_time
+
+
+class ModelScalingPolicy(ScalingPolicy):
+    # target_latency: seconds, either one value or a dict keyed by queue name
+    def __init__(self, target_latency=2.0, min_consumers=1, max_consumers=50, max_step=10,
+                 scale_up_cooldown=5.0, scale_down_cooldown=30.0, hysteresis=1, smoothing=0.5,
+                 default_service_time=1.0, history=1000, allow_scale_down=True):
+        super().__init__(history, allow_scale_down)
+        self.target_latency = target_latency
+        self.min_consumers = min_consumers
+        self.max_consumers = max_consumers
+        self.max_step = max_step
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing  # EWMA weight of the newest observation
+        self.default_service_time = default_service_time
+        self.arrival_rate = {}
+        self.service_time = {}
+        self.previous_depth = {}
+        self.last_change = {}
+
+    def target_for(self, queue_name):
+        if isinstance(self.target_latency, dict):
+            return self.target_latency[queue_name]
+        return self.target_latency
+
+    def _smooth(self, estimates, queue_name, value):
+        previous = estimates.get(queue_name)
+        estimates[queue_name] = value if previous is None else (
+            self.smoothing * value + (1 - self.smoothing) * previous)
+        return estimates[queue_name]
+
+    # Update the per-queue arrival rate and service time estimates from one snapshot
+    def observe(self, snapshot):
+        queue_name = snapshot.queue_name
+        # Arrivals = what was served + how much the backlog grew
+        growth = snapshot.depth - self.previous_depth.get(queue_name, snapshot.depth)
+        self.previous_depth[queue_name] = snapshot.depth
+        if snapshot.interval > 0:
+            observed_rate = max(0.0, (snapshot.completed + growth) / snapshot.interval)
+            self._smooth(self.arrival_rate, queue_name, observed_rate)
+        if snapshot.service_time:
+            self._smooth(self.service_time, queue_name, snapshot.service_time)
+        return (self.arrival_rate.get(queue_name, 0.0),
+                self.service_time.get(queue_name, self.default_service_time))
+
+    # Smallest consumer count meeting the latency target and draining the backlog within it
+    def required_consumers(self, arrival_rate, service_time, depth, target):
+        drain = math.ceil((arrival_rate + depth / target) * service_time) if target > 0 else self.max_consumers
+        if service_time >= target:
+            # No pool size can beat the service time itself; settle for a stable queue that drains
+            return max(drain, math.floor(arrival_rate * service_time) + 1), 'target below service time'
+        consumers = max(1, math.floor(arrival_rate * service_time) + 1)
+        while consumers < self.max_consumers and expected_latency(consumers, arrival_rate, service_time) > target:
+            consumers += 1
+        if drain > consumers:
+            return drain, f"drain backlog within {target:.1f}s"
+        return consumers, f"M/M/c latency within {target:.1f}s"
+
+    def decide(self, snapshot, now):
+        queue_name = snapshot.queue_name
+        current = snapshot.consumers
+        arrival_rate, service_time = self.observe(snapshot)
+        wanted, reason = self.required_consumers(arrival_rate, service_time, snapshot.depth,
+                                                 self.target_for(queue_name))
+        wanted = min(self.max_consumers, max(self.min_consumers, wanted))
+
+        since_change = now - self.last_change.get(queue_name, -math.inf)
+        target = current
+        if wanted > current:
+            if since_change < self.scale_up_cooldown:
+                reason = f"scale-up cooling down ({reason})"
+            else:
+                target = current + min(wanted - current, self.max_step)
+        elif wanted <= current - self.hysteresis and current > self.min_consumers:
+            if not self.allow_scale_down:
+                reason = f"scale-down disabled ({reason})"
+            elif since_change < self.scale_down_cooldown:
+                reason = f"scale-down cooling down ({reason})"
+            else:
+                target = current - min(current - wanted, self.max_step)
+        elif wanted < current:
+            reason = f"within hysteresis ({reason})"
+
+        if target != current:
+            self.last_change[queue_name] = now
+        return self.record(ScalingDecision(now, queue_name, current, target, arrival_rate, service_time,
+                                           snapshot.depth, reason))
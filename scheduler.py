@@ -3,21 +3,30 @@
 
 
 
-import pika
 import time
-import json
 import threading
 import logging
 from datetime import datetime
 from collections import defaultdict
 import random
 
+from codec import decode_order, encode_order, latency_seconds
+from log_writer import BatchedLogHandler
+from publisher_pool import get_publisher_pool
+from metrics_http import ConsumerGauges, serve_metrics
+from metrics_registry import MetricsRegistry
+from queue_sampler import QueueDepthSampler
+from scaling_policy import ModelScalingPolicy, QueueSnapshot
+from stage_timing import StageTimer, log_stages
+from transport import pika
+from worker_pool import WorkerPoolDispatcher
+
 # Set up logging to save to a file
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler("order_processing.log"),  # Log to file
+        BatchedLogHandler("order_processing.log"),  # Log to file
         logging.StreamHandler()  # Optional: Log to console
     ]
 )
@@ -29,19 +38,57 @@ QUEUE_NAMES = {
     'express': 'express_orders',
     'priority': 'priority_orders'
 }
+PREFETCH_COUNTS = {'priority_orders': 1, 'express_orders': 5, 'standard_orders': 10}
+# Latency each queue's consumer pool is sized for, in seconds
+TARGET_LATENCY = {'priority_orders': 2.0, 'express_orders': 5.0, 'standard_orders': 15.0}
+MESSAGE_CODEC = 'json'  # 'json' or the compact 'binary' codec; consumers pick it from content_type
+# Prometheus text endpoint on localhost (counters, latency histograms, queue and consumer gauges); None disables it
+METRICS_PORT = 9102
 
 # Store consumer threads and status
 consumer_threads = defaultdict(list)
 queue_status = {
-    'standard_orders': {'length': 0, 'processing_time': []},
-    'express_orders': {'length': 0, 'processing_time': []},
-    'priority_orders': {'length': 0, 'processing_time': []}
+    'standard_orders': {'length': 0, 'consumers': 0},
+    'express_orders': {'length': 0, 'consumers': 0},
+    'priority_orders': {'length': 0, 'consumers': 0}
 }
+# Processing times, recorded per consumer thread without taking the scheduler lock
+metrics = MetricsRegistry()
+
+# Handle one order and return its processing time; top-level so a process pool can run it
+def handle_order(queue_name, body, properties):
+    start_time = datetime.now()
+    message = decode_order(body, properties)
+    logging.info(f"Processing message from {queue_name}: {message}")
+    
+    time.sleep(1)  # Simulate processing time
+    
+    end_time = datetime.now()
+    return (end_time - start_time).total_seconds()
 
 # Centralized scheduler to monitor and adjust consumers
 class CentralizedScheduler:
-    def __init__(self):
+    # execution_mode 'inline' handles messages on the consumer's connection thread,
+    # 'thread' or 'process' offloads them to a shared worker pool.
+    # policy sizes each queue's consumer pool every monitor_interval seconds;
+    # queue depths are sampled every sample_interval seconds (sub-second is fine);
+    # metrics_port serves the metrics and the queue gauges over HTTP (None: not served).
+    def __init__(self, execution_mode='inline', worker_pool_size=4, policy=None, monitor_interval=5,
+                 sample_interval=1.0, metrics_port=METRICS_PORT):
         self.lock = threading.Lock()
+        self.sampler = QueueDepthSampler(QUEUE_NAMES.values(), host=RABBITMQ_HOST, interval=sample_interval)
+        self.policy = policy or ModelScalingPolicy(target_latency=TARGET_LATENCY)
+        # These consumers cannot be stopped, so the policy must not plan (and cool down after) scale-downs
+        self.policy.allow_scale_down = False
+        self.monitor_interval = monitor_interval
+        self.dispatcher = None
+        if execution_mode != 'inline':
+            self.dispatcher = WorkerPoolDispatcher(handle_order, on_complete=self.record_processing,
+                                                   mode=execution_mode, max_workers=worker_pool_size,
+                                                   stage_metrics=metrics)
+        self.gauges = ConsumerGauges(metrics, self.sampler, self.dispatcher)
+        self.metrics_port = metrics_port
+        self.metrics_server = None  # Started with the monitoring loop, not here
     
     def connect(self, queue_name, prefetch_count):
         connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
@@ -51,64 +98,69 @@ class CentralizedScheduler:
         return channel, connection
 
     def process_message(self, ch, method, properties, body, queue_name):
-        start_time = datetime.now()
-        message = json.loads(body)
-        logging.info(f"Processing message from {queue_name}: {message}")
-        
-        time.sleep(1)  # Simulate processing time
-        
+        timer = StageTimer(properties)
+        timer.start()
+        processing_time = handle_order(queue_name, body, properties)
+        timer.finish()
         ch.basic_ack(delivery_tag=method.delivery_tag)
-        end_time = datetime.now()
-        processing_time = (end_time - start_time).total_seconds()
-        
+        timer.ack()
+        timer.record(metrics, queue_name)
+        self.record_processing(queue_name, method, properties, processing_time)
+
+    def record_processing(self, queue_name, method, properties, processing_time):
         # Log processing time
-        with self.lock:
-            queue_status[queue_name]['processing_time'].append(processing_time)
+        metrics.observe('processing_time', queue_name, processing_time)
+        metrics.increment('throughput', queue_name)
+        # End-to-end latency from the x-created-ns header
+        latency = latency_seconds(properties)
+        if latency is not None:
+            metrics.observe('latency', queue_name, latency)
         
         logging.info(f"Processed message from {queue_name} in {processing_time:.2f} seconds")
         
     def start_consumer(self, queue_name, prefetch_count=10):
         channel, connection = self.connect(queue_name, prefetch_count)
-        channel.basic_consume(
-            queue=queue_name, 
-            on_message_callback=lambda ch, method, properties, body: self.process_message(ch, method, properties, body, queue_name)
-        )
+        self.gauges.add(queue_name, channel, prefetch_count)
+        if self.dispatcher is not None:
+            # Acks come back through add_callback_threadsafe; prefetch bounds the pool backlog
+            self.dispatcher.consume(channel, queue_name, prefetch_count)
+        else:
+            channel.basic_consume(
+                queue=queue_name, 
+                on_message_callback=lambda ch, method, properties, body: self.process_message(ch, method, properties, body, queue_name)
+            )
         logging.info(f"Starting consumer for {queue_name} with prefetch_count={prefetch_count}")
         channel.start_consuming()
     
     def monitor_and_adjust(self):
+        self.metrics_server = serve_metrics(metrics, self.metrics_port)
+        self.sampler.start()
+        last_collect = time.monotonic()
         while True:
-            with self.lock:
+            counters, histograms = metrics.collect()
+            now = time.monotonic()
+            interval, last_collect = now - last_collect, now
+            # Current message counts come from the sampler's latest round, read without the lock
+            sample = self.sampler.latest
+            if sample is not None:
                 for queue_name in QUEUE_NAMES.values():
-                    # Get current message count in the queue
-                    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-                    channel = connection.channel()
-                    queue = channel.queue_declare(queue=queue_name, passive=True)
-                    queue_length = queue.method.message_count
-                    queue_status[queue_name]['length'] = queue_length
-                    connection.close()
-                
-                # Decision-making: Adjust consumers based on queue lengths and processing times
-                priority_length = queue_status['priority_orders']['length']
-                express_length = queue_status['express_orders']['length']
-                standard_length = queue_status['standard_orders']['length']
-                
-                # Redistribute consumers to prioritize high-priority queues
-                if priority_length > 0:
-                    # Increase consumers for priority_orders if backlog exists
-                    if len(consumer_threads['priority_orders']) < 3:
-                        self.add_consumer('priority_orders', prefetch_count=1)
-                
-                elif express_length > 0 and len(consumer_threads['express_orders']) < 2:
-                    # Allocate more consumers to express_orders if needed
-                    self.add_consumer('express_orders', prefetch_count=5)
-                
-                elif standard_length > 5 and len(consumer_threads['standard_orders']) < 1:
-                    # Allocate a consumer to standard_orders if backlog builds up
-                    self.add_consumer('standard_orders', prefetch_count=10)
+                    queue_status[queue_name]['length'] = sample.depths.get(queue_name, 0)
+                    queue_status[queue_name]['consumers'] = sample.consumers.get(queue_name, 0)
+
+            with self.lock:
+                # Decision-making: size each queue from its backlog, arrival rate and processing times
+                for queue_name, stats in queue_status.items():
+                    processing_time = histograms.get(('processing_time', queue_name))
+                    completed = processing_time.count if processing_time is not None else 0
+                    snapshot = QueueSnapshot(queue_name, stats['length'], len(consumer_threads[queue_name]), completed,
+                                             processing_time.mean() if completed else None, interval)
+                    decision = self.policy.decide(snapshot, now)
+                    while len(consumer_threads[queue_name]) < decision.target:
+                        self.add_consumer(queue_name, prefetch_count=PREFETCH_COUNTS[queue_name])
                 
-                # Sleep before re-evaluating the queue status
-                time.sleep(5)
+            self.log_queue_status(histograms)
+            # Sleep before re-evaluating the queue status
+            time.sleep(self.monitor_interval)
     
     def add_consumer(self, queue_name, prefetch_count):
         thread = threading.Thread(target=self.start_consumer, args=(queue_name, prefetch_count))
@@ -116,25 +168,26 @@ class CentralizedScheduler:
         thread.start()
         logging.info(f"Added consumer to {queue_name} with prefetch_count={prefetch_count}")
         
-    def log_queue_status(self):
+    def log_queue_status(self, histograms):
         # Log queue processing times and lengths
         for queue_name, stats in queue_status.items():
-            avg_time = sum(stats['processing_time']) / len(stats['processing_time']) if stats['processing_time'] else 0
-            logging.info(f"{queue_name} - Length: {stats['length']}, Avg Processing Time: {avg_time:.2f} seconds")
+            processing_time = histograms.get(('processing_time', queue_name), metrics.histogram_factory())
+            logging.info(f"{queue_name} - Length: {stats['length']}, Consumers: {stats['consumers']}, Avg Processing Time: {processing_time.mean():.2f} seconds, "
+                         f"{processing_time.describe()}")
+            log_stages(histograms, queue_name)
 
 # Producer function to simulate order creation
 def publish_order(order_type, order_data):
-    channel, connection = scheduler.connect(QUEUE_NAMES[order_type], prefetch_count=1)
     routing_key = f"order.{order_type}"
     message = {
         'order_id': order_data['order_id'],
         'customer_id': order_data['customer_id'],
-        'items': order_data['items'],
-        'timestamp': datetime.now().isoformat()
+        'items': order_data['items']
     }
-    channel.basic_publish(exchange='order_exchange', routing_key=routing_key, body=json.dumps(message))
+    # The creation time travels as epoch nanoseconds in the message headers
+    body, properties = encode_order(message, MESSAGE_CODEC)
+    get_publisher_pool(RABBITMQ_HOST, 'order_exchange').publish(routing_key, body, properties)
     logging.info(f"Sent {order_type} order: {message}")
-    connection.close()
 
 # Generate test orders and publish to queues
 def generate_random_order(order_type):
@@ -147,12 +200,21 @@ def generate_random_order(order_type):
         'items': items
     }
 
-if __name__ == '__main__':
+# Declare the queues and start the scheduler's monitoring thread; benchmark.py calls this too
+def start_consumers():
+    # Declare and bind the queues up front; publish_order no longer opens a queue-specific connection
+    with get_publisher_pool(RABBITMQ_HOST, 'order_exchange').channel() as channel:
+        for order_type, queue_name in QUEUE_NAMES.items():
+            channel.queue_declare(queue=queue_name, durable=True)
+            channel.queue_bind(exchange='order_exchange', queue=queue_name, routing_key=f"order.{order_type}")
+
     scheduler = CentralizedScheduler()
-    
-    # Start the scheduler's monitoring thread
     monitoring_thread = threading.Thread(target=scheduler.monitor_and_adjust)
     monitoring_thread.start()
+    return scheduler
+
+if __name__ == '__main__':
+    scheduler = start_consumers()
     
     # Simulate publishing orders to the queues
     try:
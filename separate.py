@@ -1,15 +1,14 @@
+from split_logs import print_summary, split_logs
+
 # Input log file name
 input_file_name = "consumer_logs.txt"
 
-# Output log file name for Consumer-1 logs
-output_file_name = "consumer_10_logs.txt"
+# Output log file names, one per consumer: consumer_1_logs.txt, consumer_2_logs.txt, ...
+output_file_pattern = "consumer_{}_logs.txt"
 
-# Filter logs for Consumer-1
+# Split the logs for every consumer in one pass over the input
 try:
-    with open(input_file_name, "r") as input_file, open(output_file_name, "w") as output_file:
-        for line in input_file:
-            if "[Consumer-10]" in line:
-                output_file.write(line)
-    print(f"Filtered logs for Consumer-10 saved to {output_file_name}")
+    summaries, untagged, malformed = split_logs(input_file_name, output_file_pattern)
+    print_summary(summaries, untagged, output_file_pattern, malformed)
 except FileNotFoundError:
     print(f"Error: The file {input_file_name} was not found.")
@@ -0,0 +1,318 @@
+# Discrete-event simulation of the scheduler's queues and consumer pools.
+# Arrivals from a trace go into modelled broker queues (FIFO, prefetch 1:
+# a consumer holds one message at a time), consumers serve them with a
+# configurable service-time distribution, and every monitor_interval the
+# real ScalingPolicy.decide() sees the same QueueSnapshot that
+# nscheduler's monitor_and_adjust builds (depth, consumer count, messages
+# completed and mean service time over the interval) and its target is
+# applied. A removed consumer finishes its in-flight message first, like
+# CancellableConsumer.stop. Everything runs on a virtual clock, so an hour
+# of traffic takes as long as its events take to process.
+#
+# A trace is a load_generator profile (constant, ramp, poisson, spike,
+# replay of a consumer log, ...) plus a mix that spreads its arrivals over
+# the queues by weight. The report per queue has the latency percentiles
+# (arrival to completion), backlog and consumer-seconds used.
+import argparse
+import functools
+import heapq
+import itertools
+import json
+import random
+import time
+from collections import deque, namedtuple
+
+from latency_histogram import LatencyHistogram
+from load_generator import schedule
+from scaling_policy import ModelScalingPolicy, QueueSnapshot, ThresholdPolicy
+
+NSCHEDULER_MIX = {'priority_orders': 3, 'express_orders': 1, 'standard_orders': 1}
+
+TRACES = {
+    # spiked_producers.py: about one order a second with a 10/s spike for 5 s every 30 s
+    'spiked': {'profile': {'type': 'spike', 'base_rate': 0.8, 'spike_rate': 10, 'period': 30, 'spike_duration': 5,
+                           'arrivals': 'poisson'}, 'mix': NSCHEDULER_MIX},
+    # The stress tests' producers: 100 orders a second
+    'stress': {'profile': {'type': 'poisson', 'rate': 100}, 'mix': NSCHEDULER_MIX},
+    'ramp': {'profile': {'type': 'ramp', 'start_rate': 1, 'end_rate': 50, 'duration': 3600}, 'mix': NSCHEDULER_MIX},
+}
+
+POLICIES = {'model': ModelScalingPolicy, 'threshold': ThresholdPolicy}
+
+# series: (time, depth, consumers) at every monitor tick; end_time: simulated seconds until the run
+# stopped, past the traffic duration while the backlog drained
+QueueReport = namedtuple('QueueReport', 'queue_name arrivals completed latency max_depth final_depth '
+                                        'consumer_seconds max_consumers scale_changes series end_time')
+
+DONE, STARTED, TICK = range(3)
+
+
+class _SimQueue:
+    def __init__(self, name, service, rng):
+        self.name = name
+        self.service = service
+        self.rng = rng
+        self.ready = deque()  # arrival times of messages waiting in the broker
+        self.consumers = 0    # what the scheduler counts: started or starting, not yet removed
+        self.idle = 0
+        self.busy = 0
+        self.starting = 0
+        self.cancelled_starts = 0
+        self.retiring = 0
+        self.alive = 0        # consumers that exist and cost consumer-seconds
+        self.alive_since = 0.0
+        self.consumer_seconds = 0.0
+        self.arrivals = 0
+        self.completed = 0
+        self.window_completed = 0
+        self.window_service = 0.0
+        self.latency = LatencyHistogram()
+        self.max_depth = 0
+        self.max_consumers = 0
+        self.scale_changes = 0
+        self.series = []
+
+    def service_time(self):
+        mean = self.service['mean']
+        distribution = self.service.get('distribution', 'constant')
+        if distribution == 'exponential':
+            return self.rng.expovariate(1.0 / mean)
+        if distribution == 'uniform':
+            spread = self.service.get('spread', 0.5)
+            return self.rng.uniform(mean * (1 - spread), mean * (1 + spread))
+        return mean
+
+    def change_alive(self, now, delta):
+        self.consumer_seconds += self.alive * (now - self.alive_since)
+        self.alive_since = now
+        self.alive += delta
+
+
+class Simulator:
+    # arrivals: iterable of (time, queue_name) in time order; queues not in service_times use default_service.
+    # service_times: {queue_name: {'mean': seconds, 'distribution': 'constant' | 'exponential' | 'uniform'}}.
+    # initial_consumers: nscheduler starts with none and lets the policy size every pool.
+    def __init__(self, policy, arrivals, service_times=None, default_service=None, monitor_interval=5.0,
+                 initial_consumers=0, consumer_start_delay=0.0, seed=None):
+        self.policy = policy
+        self.arrivals = iter(arrivals)
+        self.service_times = service_times or {}
+        self.default_service = default_service or {'mean': 1.0}  # handle_order sleeps one second
+        self.monitor_interval = monitor_interval
+        self.initial_consumers = initial_consumers
+        self.consumer_start_delay = consumer_start_delay
+        self.rng = random.Random(seed)
+        self.queues = {}
+        self.events = []
+        self.sequence = itertools.count()
+        self.now = 0.0
+
+    def _queue(self, name):
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = _SimQueue(name, self.service_times.get(name, self.default_service),
+                                                  random.Random(self.rng.random()))
+            self._scale(queue, self.initial_consumers)
+        return queue
+
+    def _push(self, at, kind, queue, payload=None):
+        heapq.heappush(self.events, (at, next(self.sequence), kind, queue, payload))
+
+    def _dispatch(self, queue):
+        while queue.ready and queue.idle:
+            arrived = queue.ready.popleft()
+            queue.idle -= 1
+            queue.busy += 1
+            service = queue.service_time()
+            self._push(self.now + service, DONE, queue, (arrived, service))
+
+    def _scale(self, queue, target):
+        if target != queue.consumers:
+            queue.scale_changes += 1
+        while queue.consumers < target:
+            queue.consumers += 1
+            queue.change_alive(self.now, 1)
+            if self.consumer_start_delay:
+                queue.starting += 1
+                self._push(self.now + self.consumer_start_delay, STARTED, queue)
+            else:
+                queue.idle += 1
+        while queue.consumers > target:
+            queue.consumers -= 1
+            # Idle consumers go at once, starting ones never come up, busy ones finish their message first
+            if queue.idle:
+                queue.idle -= 1
+                queue.change_alive(self.now, -1)
+            elif queue.starting > queue.cancelled_starts:
+                queue.cancelled_starts += 1
+                queue.change_alive(self.now, -1)
+            else:
+                queue.retiring += 1
+        queue.max_consumers = max(queue.max_consumers, queue.consumers)
+        self._dispatch(queue)
+
+    def _on_done(self, queue, arrived, service):
+        queue.busy -= 1
+        queue.completed += 1
+        queue.window_completed += 1
+        queue.window_service += service
+        queue.latency.record(self.now - arrived)
+        if queue.retiring:
+            queue.retiring -= 1
+            queue.change_alive(self.now, -1)
+        else:
+            queue.idle += 1
+            self._dispatch(queue)
+
+    def _on_started(self, queue):
+        queue.starting -= 1
+        if queue.cancelled_starts:
+            queue.cancelled_starts -= 1
+            return
+        queue.idle += 1
+        self._dispatch(queue)
+
+    def _on_tick(self):
+        for queue in self.queues.values():
+            completed = queue.window_completed
+            snapshot = QueueSnapshot(queue.name, len(queue.ready), queue.consumers, completed,
+                                     queue.window_service / completed if completed else None, self.monitor_interval)
+            queue.window_completed = 0
+            queue.window_service = 0.0
+            decision = self.policy.decide(snapshot, self.now)
+            self._scale(queue, decision.target)
+            queue.series.append((self.now, snapshot.depth, queue.consumers))
+
+    def _idle(self):
+        return all(not queue.ready and not queue.busy for queue in self.queues.values())
+
+    # Simulate until `duration` seconds of arrivals have come in; with drain, keep going (ticks included)
+    # until every queue is empty or drain_limit more seconds have passed
+    def run(self, duration, drain=True, drain_limit=None):
+        for name in self.service_times:
+            self._queue(name)
+        end = duration + (duration if drain_limit is None else drain_limit) if drain else duration
+        self._push(self.monitor_interval, TICK, None)
+        next_arrival = next(self.arrivals, None)
+        while True:
+            arrival_due = next_arrival is not None and next_arrival[0] < duration
+            if arrival_due and (not self.events or next_arrival[0] <= self.events[0][0]):
+                self.now, queue_name = next_arrival
+                queue = self._queue(queue_name)
+                queue.arrivals += 1
+                queue.ready.append(self.now)
+                queue.max_depth = max(queue.max_depth, len(queue.ready))
+                self._dispatch(queue)
+                next_arrival = next(self.arrivals, None)
+                continue
+            if not self.events or self.events[0][0] > end:
+                break
+            if not arrival_due and self.now >= duration and (not drain or self._idle()):
+                break
+            self.now, _, kind, queue, payload = heapq.heappop(self.events)
+            if kind == DONE:
+                self._on_done(queue, *payload)
+            elif kind == STARTED:
+                self._on_started(queue)
+            else:
+                self._on_tick()
+                self._push(self.now + self.monitor_interval, TICK, None)
+        self.now = max(self.now, duration)
+        return self.report()
+
+    def report(self):
+        reports = {}
+        for name, queue in self.queues.items():
+            queue.change_alive(self.now, 0)
+            reports[name] = QueueReport(name, queue.arrivals, queue.completed, queue.latency, queue.max_depth,
+                                        len(queue.ready), queue.consumer_seconds, queue.max_consumers,
+                                        queue.scale_changes, queue.series, self.now)
+        return reports
+
+
+# (time, queue_name) arrivals of a trace over `duration` seconds, queues drawn from its mix by weight
+def trace_arrivals(trace, duration, seed=None):
+    profile = dict(trace['profile'])
+    profile['duration'] = min(profile.get('duration', duration), duration)
+    rng = random.Random(seed)
+    names = list(trace['mix'])
+    cumulative = list(itertools.accumulate(trace['mix'].values()))
+    profile.setdefault('seed', seed)
+    for offset in schedule(profile):
+        yield offset, rng.choices(names, cum_weights=cumulative)[0]
+
+
+def simulate(trace, policy, duration, seed=None, **options):
+    simulator = Simulator(policy, trace_arrivals(trace, duration, seed), seed=seed, **options)
+    return simulator.run(duration)
+
+
+# Run the same trace (same seed) once per policy; policies maps a label to a zero-argument factory
+def sweep(trace, policies, duration, seed=0, **options):
+    return {label: simulate(trace, factory(), duration, seed, **options) for label, factory in policies.items()}
+
+
+# The average consumer count is over the whole simulated run, drain included
+def print_report(label, reports):
+    print(f"== {label}")
+    for name in sorted(reports):
+        report = reports[name]
+        latency = report.latency
+        average = report.consumer_seconds / report.end_time if report.end_time else 0.0
+        print(f"  {name:<16} arrivals {report.arrivals:>8} done {report.completed:>8} "
+              f"p50 {latency.percentile(50):7.2f}s p95 {latency.percentile(95):7.2f}s "
+              f"p99 {latency.percentile(99):7.2f}s max {latency.max:7.2f}s | "
+              f"max backlog {report.max_depth:>6} left {report.final_depth:>6} | "
+              f"consumer-s {report.consumer_seconds:>10.0f} (avg {average:5.1f}, "
+              f"max {report.max_consumers}) changes {report.scale_changes}")
+
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate scaling policies against an arrival trace in virtual time.")
+    parser.add_argument('--trace', choices=sorted(TRACES), default='spiked')
+    parser.add_argument('--replay', help="Replay arrivals from a consumer log (text or .bin) instead of --trace")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed-up")
+    parser.add_argument('--duration', type=float, default=3600, help="Seconds of traffic to simulate")
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='model')
+    parser.add_argument('--params', default='{}', help="Policy keyword arguments as JSON")
+    parser.add_argument('--sweep', help="One policy parameter to sweep, e.g. scale_up_cooldown=0,5,15")
+    parser.add_argument('--service-time', type=float, default=1.0)
+    parser.add_argument('--distribution', choices=['constant', 'exponential', 'uniform'], default='constant')
+    parser.add_argument('--monitor-interval', type=float, default=5.0)
+    parser.add_argument('--start-delay', type=float, default=0.0, help="Seconds before a new consumer takes work")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    trace = TRACES[args.trace]
+    if args.replay:
+        trace = {'profile': {'type': 'replay', 'path': args.replay, 'speed': args.speed}, 'mix': NSCHEDULER_MIX}
+    params = json.loads(args.params)
+    policy_class = POLICIES[args.policy]
+    policies = {f"{args.policy} {params}": lambda: policy_class(**params)}
+    if args.sweep:
+        name, values = args.sweep.split('=', 1)
+        policies = {f"{args.policy} {name}={value}":
+                    functools.partial(policy_class, **dict(params, **{name: _parse_value(value)}))
+                    for value in values.split(',')}
+    options = {
+        'default_service': {'mean': args.service_time, 'distribution': args.distribution},
+        'monitor_interval': args.monitor_interval,
+        'consumer_start_delay': args.start_delay,
+    }
+    for label, factory in policies.items():
+        started = time.perf_counter()
+        reports = simulate(trace, factory(), args.duration, args.seed, **options)
+        print_report(label, reports)
+        end_time = max(report.end_time for report in reports.values())
+        print(f"  simulated {end_time:.0f}s ({args.duration:.0f}s of traffic) in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
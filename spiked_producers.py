@@ -1,9 +1,9 @@
-import pika
-import json
-import time
-from datetime import datetime
 import random
 
+from codec import encode_order
+from load_generator import describe, run_processes
+from publisher_pool import get_publisher_pool
+
 # RabbitMQ configuration
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'order_exchange'
@@ -12,27 +12,27 @@ ROUTING_KEYS = {
     'express': 'order.express',
     'priority': 'order.priority'
 }
+MESSAGE_CODEC = 'json'  # 'json' or the compact 'binary' codec; consumers pick it from content_type
+# About one order a second with Poisson gaps, and a 10 orders/s spike for 5 s every 30 s
+LOAD_PROFILE = {'type': 'spike', 'base_rate': 0.8, 'spike_rate': 10, 'period': 30, 'spike_duration': 5,
+                'arrivals': 'poisson'}
+PRODUCER_PROCESSES = 1  # Processes sharing the profile, each with its own publisher connections
 
-# Connect to RabbitMQ and declare the exchange
-def connect():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
-    return channel, connection
+# Long-lived connections shared by every publish_order call
+publisher = get_publisher_pool(RABBITMQ_HOST, EXCHANGE_NAME)
 
-# Publish a message to RabbitMQ
-def publish_order(order_type, order_data):
-    channel, connection = connect()
+# Publish a message to RabbitMQ; created_ns is the intended send time when driven by the load generator
+def publish_order(order_type, order_data, created_ns=None):
     routing_key = ROUTING_KEYS[order_type]
     message = {
         'order_id': order_data['order_id'],
         'customer_id': order_data['customer_id'],
-        'items': order_data['items'],
-        'timestamp': datetime.now().isoformat()
+        'items': order_data['items']
     }
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=json.dumps(message))
+    # The creation time travels as epoch nanoseconds in the message headers
+    body, properties = encode_order(message, MESSAGE_CODEC, created_ns=created_ns)
+    publisher.publish(routing_key, body, properties)
     print(f"Sent {order_type} order: {message}")
-    connection.close()
 
 # Generate random orders and send them to RabbitMQ
 def generate_random_order(order_type):
@@ -45,37 +45,19 @@ def generate_random_order(order_type):
         'items': items
     }
 
+# Send one random order at its intended time
+def send_random_order(index, intended_ns):
+    order_type = random.choice(['standard', 'express', 'priority'])
+    publish_order(order_type, generate_random_order(order_type), created_ns=intended_ns)
+
+# Runs in each producer process; forked processes would otherwise draw the same random orders
+def order_sender():
+    random.seed()
+    return send_random_order
+
 # Main function to continuously send test messages with occasional spikes
 if __name__ == '__main__':
     try:
-        spike_frequency = 30  # Seconds between spikes
-        spike_duration = 5    # Duration of each spike in seconds
-        last_spike_time = time.time() - spike_frequency
-
-        while True:
-            current_time = time.time()
-
-            # Check if it's time for a spike
-            if current_time - last_spike_time >= spike_frequency:
-                print("Spike started!")
-                end_spike_time = current_time + spike_duration
-
-                # Send orders rapidly for the duration of the spike
-                while time.time() < end_spike_time:
-                    order_type = random.choice(['standard', 'express', 'priority'])
-                    order_data = generate_random_order(order_type)
-                    publish_order(order_type, order_data)
-                    time.sleep(0.1)  # Higher order rate during spike
-
-                print("Spike ended.")
-                last_spike_time = current_time  # Reset the last spike time
-
-            # Normal order rate outside of spikes
-            else:
-                order_type = random.choice(['standard', 'express', 'priority'])
-                order_data = generate_random_order(order_type)
-                publish_order(order_type, order_data)
-                time.sleep(random.uniform(0.5, 2))  # Normal rate outside spike
-
+        print(describe(run_processes(LOAD_PROFILE, order_sender, PRODUCER_PROCESSES)))
     except KeyboardInterrupt:
         print("Stopped sending orders.")
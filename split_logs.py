@@ -0,0 +1,131 @@
+# Single-pass splitter for consumer_logs.txt.
+# Reads the input once in binary, routes every line to consumer_<id>_logs.txt
+# by its [Consumer-<id>] tag and counts per-consumer totals on the way.
+# Output files are opened lazily on a consumer's first line with large write
+# buffers, so the cost is one sequential read plus buffered appends no
+# matter how many consumers the run had.
+# A line whose tag is never closed, or whose "Total Messages Processed" has
+# no number (the torn last line of a killed consumer), is counted as
+# malformed: the former is skipped, the latter kept without its total.
+import argparse
+import time
+from collections import namedtuple
+
+INPUT_FILE = "consumer_logs.txt"
+OUTPUT_PATTERN = "consumer_{}_logs.txt"
+WRITE_BUFFER = 1024 * 1024
+
+TAG = b"[Consumer-"
+RECEIVED = b"] Received: "
+TOTAL = b"] Total Messages Processed: "
+
+# lines: every line for the consumer, received: "Received:" lines,
+# reported_total: last "Total Messages Processed" value, first_seen / last_seen: timestamps as logged
+ConsumerSummary = namedtuple('ConsumerSummary', 'consumer_id lines received reported_total first_seen last_seen')
+
+
+class _ConsumerOutput:
+    __slots__ = ('file', 'lines', 'received', 'reported_total', 'first_seen', 'last_seen')
+
+    def __init__(self, path):
+        self.file = open(path, 'wb', buffering=WRITE_BUFFER)
+        self.lines = 0
+        self.received = 0
+        self.reported_total = None
+        self.first_seen = None
+        self.last_seen = None
+
+
+# consumers: optional collection of consumer ids (strings) to keep; everything else is skipped.
+# Returns ({consumer_id: ConsumerSummary}, lines without a consumer tag, malformed lines)
+def split_logs(input_file=INPUT_FILE, output_pattern=OUTPUT_PATTERN, consumers=None):
+    wanted = None if consumers is None else {str(consumer_id).encode() for consumer_id in consumers}
+    outputs = {}
+    untagged = 0
+    malformed = 0
+    try:
+        with open(input_file, 'rb') as source:
+            for line in source:
+                start = line.find(TAG)
+                if start < 0:
+                    untagged += 1
+                    continue
+                start += len(TAG)
+                end = line.find(b"]", start)
+                consumer_id = line[start:end]
+                # The id becomes part of a file name, so an unterminated tag or a path in it is not trusted
+                if end < 0 or not consumer_id or b"/" in consumer_id or b"\\" in consumer_id:
+                    malformed += 1
+                    continue
+                if wanted is not None and consumer_id not in wanted:
+                    continue
+
+                output = outputs.get(consumer_id)
+                if output is None:
+                    output = outputs[consumer_id] = _ConsumerOutput(output_pattern.format(consumer_id.decode()))
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                output.file.write(line)
+                output.lines += 1
+
+                if line.startswith(RECEIVED, end):
+                    output.received += 1
+                elif line.startswith(TOTAL, end):
+                    try:
+                        output.reported_total = int(line[end + len(TOTAL):])
+                    except ValueError:
+                        malformed += 1
+                if line.startswith(b"["):
+                    timestamp = line[1:line.find(b"]")]
+                    if output.first_seen is None:
+                        output.first_seen = timestamp
+                    output.last_seen = timestamp
+    finally:
+        for output in outputs.values():
+            output.file.close()
+
+    summaries = {}
+    for consumer_id, output in outputs.items():
+        consumer_id = consumer_id.decode()
+        summaries[consumer_id] = ConsumerSummary(
+            consumer_id, output.lines, output.received, output.reported_total,
+            output.first_seen.decode() if output.first_seen is not None else None,
+            output.last_seen.decode() if output.last_seen is not None else None,
+        )
+    return summaries, untagged, malformed
+
+
+def _sort_key(consumer_id):
+    return (0, int(consumer_id)) if consumer_id.isdigit() else (1, consumer_id)
+
+
+def print_summary(summaries, untagged, output_pattern=OUTPUT_PATTERN, malformed=0):
+    print(f"{'Consumer':>10} {'Lines':>10} {'Received':>10} {'Reported':>10}  First seen -> Last seen")
+    for consumer_id in sorted(summaries, key=_sort_key):
+        summary = summaries[consumer_id]
+        reported = summary.reported_total if summary.reported_total is not None else '-'
+        print(f"{consumer_id:>10} {summary.lines:>10} {summary.received:>10} {reported:>10}  "
+              f"{summary.first_seen} -> {summary.last_seen}  ({output_pattern.format(consumer_id)})")
+    if untagged:
+        print(f"{untagged} lines had no consumer tag and were skipped")
+    if malformed:
+        print(f"{malformed} lines were malformed (unterminated consumer tag or unreadable total)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a consumer log into one file per consumer in a single pass.")
+    parser.add_argument('input_file', nargs='?', default=INPUT_FILE)
+    parser.add_argument('--output-pattern', default=OUTPUT_PATTERN,
+                        help="Output path with {} for the consumer id (default: %(default)s)")
+    parser.add_argument('--consumer', action='append', dest='consumers',
+                        help="Only keep this consumer id; repeat for several (default: all)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        summaries, untagged, malformed = split_logs(args.input_file, args.output_pattern, args.consumers)
+    except FileNotFoundError:
+        print(f"Error: The file {args.input_file} was not found.")
+    else:
+        print_summary(summaries, untagged, args.output_pattern, malformed)
+        print(f"Split {args.input_file} in {time.perf_counter() - started:.2f}s")
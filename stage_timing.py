@@ -0,0 +1,113 @@
+# Per-message stage timestamps for an end-to-end latency breakdown.
+# The end-to-end latency (now - x-created-ns) mixes producer delay, broker
+# queueing, prefetch buffering, handler time and settling. Every message
+# carries the producer's stamps in its headers (x-created-ns from
+# encode_order, x-published-ns set by stamp_published right before
+# basic_publish), and the consumer adds the rest on a StageTimer:
+# delivered when the callback gets the message, started / finished around
+# the handler and acked after basic_ack. record() turns the stamps into
+# one 'stage_<interval>' histogram per interval and label (queue name), so
+# the reporters can show whether a spike hurts through queueing or through
+# service time. All stamps are epoch nanoseconds; the producer stamps come
+# from the producer's clock, so produce/queue include any clock skew between
+# hosts (negative intervals are recorded as 0).
+import logging
+import time
+
+from codec import CREATED_HEADER
+
+PUBLISHED_HEADER = 'x-published-ns'
+
+STAGES = ('created', 'published', 'delivered', 'started', 'finished', 'acked')
+# (interval, from stage, to stage)
+INTERVALS = (
+    ('produce', 'created', 'published'),   # Load generator lag, encoding, waiting for a publisher channel
+    ('queue', 'published', 'delivered'),   # Broker queue plus the client's prefetch buffer
+    ('wait', 'delivered', 'started'),      # Waiting for a worker after delivery
+    ('service', 'started', 'finished'),    # The handler itself
+    ('ack', 'finished', 'acked'),          # Hand-off back to the connection thread and basic_ack
+    ('total', 'created', 'acked'),
+)
+
+
+# Stamp the publish time into the message headers; call right before basic_publish
+def stamp_published(properties, now_ns=None):
+    if properties is None:
+        return None
+    if properties.headers is None:
+        properties.headers = {}
+    properties.headers[PUBLISHED_HEADER] = time.time_ns() if now_ns is None else now_ns
+    return properties
+
+
+class StageTimer:
+    __slots__ = STAGES
+
+    # Created when the consumer callback gets the message, which stamps 'delivered'
+    def __init__(self, properties, delivered_ns=None):
+        headers = getattr(properties, 'headers', None) or {}
+        self.created = headers.get(CREATED_HEADER)
+        self.published = headers.get(PUBLISHED_HEADER)
+        self.delivered = time.time_ns() if delivered_ns is None else delivered_ns
+        self.started = None
+        self.finished = None
+        self.acked = None
+
+    def start(self):
+        self.started = time.time_ns()
+
+    def finish(self):
+        self.finished = time.time_ns()
+
+    def ack(self):
+        self.acked = time.time_ns()
+
+    # (interval, seconds) for every interval whose two stamps are known
+    def intervals(self):
+        for name, begin, end in INTERVALS:
+            begin_ns, end_ns = getattr(self, begin), getattr(self, end)
+            if begin_ns is not None and end_ns is not None:
+                yield name, max(0, end_ns - begin_ns) / 1e9
+
+    def record(self, metrics, label):
+        for name, seconds in self.intervals():
+            metrics.observe(f"stage_{name}", label, seconds)
+
+
+# Run handler(*args) and return (result, started_ns, finished_ns); top-level so a process pool can run it
+def timed_call(handler, *args):
+    started = time.time_ns()
+    result = handler(*args)
+    return result, started, time.time_ns()
+
+
+# interval -> histogram of one label from a MetricsRegistry totals() / collect() window
+def breakdown(histograms, label):
+    stages = {}
+    for name, _, _ in INTERVALS:
+        histogram = histograms.get((f"stage_{name}", label))
+        if histogram is not None and histogram.count:
+            stages[name] = histogram
+    return stages
+
+
+# Each interval's p50 / p99 and its share of the mean total
+def describe_stages(stages):
+    total = stages.get('total')
+    parts = []
+    for name, histogram in stages.items():
+        if name == 'total':
+            continue
+        share = f" ({histogram.mean() / total.mean():.0%})" if total is not None and total.mean() else ''
+        parts.append(f"{name} p50 {histogram.percentile(50) * 1000:.1f}ms "
+                     f"p99 {histogram.percentile(99) * 1000:.1f}ms{share}")
+    if total is not None:
+        parts.append(f"total p50 {total.percentile(50) * 1000:.1f}ms p99 {total.percentile(99) * 1000:.1f}ms")
+    return ', '.join(parts)
+
+
+# One log line per queue, for the scripts' log_metrics loops
+def log_stages(histograms, label):
+    stages = breakdown(histograms, label)
+    if stages:
+        logging.info(f"{label} - Stages: {describe_stages(stages)}")
@@ -1,17 +1,25 @@
-import pika
-import json
 import time
 import threading
 import logging
-from datetime import datetime
-from collections import defaultdict
 import random
 
+from batch_consumer import BatchingConsumer, per_message
+from codec import decode_order, encode_order, latency_seconds
+from confirming_publisher import ConfirmingPublisher
+from log_writer import BatchedLogHandler
+from metrics_http import ConsumerGauges, serve_metrics
+from metrics_registry import MetricsRegistry
+from prefetch_controller import PrefetchController, log_prefetch
+from queue_sampler import QueueDepthSampler
+from stage_timing import StageTimer, log_stages, stamp_published
+from transport import pika
+from worker_pool import WorkerPoolDispatcher
+
 # Configure logging to save to a file
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("order_processing.log"), logging.StreamHandler()]
+    handlers=[BatchedLogHandler("order_processing.log"), logging.StreamHandler()]
 )
 
 # RabbitMQ configuration
@@ -19,10 +27,37 @@ RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'order_exchange'
 ROUTING_KEYS = {'standard': 'order.standard', 'express': 'order.express', 'priority': 'order.priority'}
 QUEUE_NAMES = {'standard': 'standard_orders', 'express': 'express_orders', 'priority': 'priority_orders'}
-
-# Store metrics
-metrics = {'latency': defaultdict(list), 'throughput': defaultdict(int)}
-queue_status = {name: {'length': 0, 'processing_time': []} for name in QUEUE_NAMES.values()}
+EXECUTION_MODE = 'inline'  # 'inline' on the consumer thread, or offload to a 'thread' or 'process' pool
+WORKER_POOL_SIZE = 8
+ADAPTIVE_PREFETCH = True  # Tune each consumer's basic_qos at runtime, starting from PREFETCH_COUNT
+PREFETCH_COUNT = 10
+BATCH_SIZE = 0  # >0 consumes inline in micro-batches settled with one multiple=True ack
+BATCH_MAX_WAIT = 0.05  # Seconds a partial batch waits for more deliveries
+CONFIRM_WINDOW = 500  # Max unconfirmed publishes in flight; 0 publishes fire-and-forget
+MESSAGE_CODEC = 'json'  # 'json' or the compact 'binary' codec; consumers pick it from content_type
+# Prometheus text endpoint on localhost (counters, latency histograms, queue and consumer gauges); None disables it
+METRICS_PORT = 9104
+
+# Store metrics; every consumer thread records into its own shard without locking
+confirm_publisher = None
+dispatcher = None
+gauges = None
+metrics = MetricsRegistry()
+queue_status = {name: {'length': 0} for name in QUEUE_NAMES.values()}
+
+# Handle one order; top-level so a process pool can run it
+def handle_order(queue_name, body, properties):
+    order = decode_order(body, properties)
+    time.sleep(0.5)  # Simulate processing time reduced to 0.5 sec
+    return order['order_id']
+
+# Metrics hook shared by OrderConsumer and the worker pool
+def record_processed(queue_name, properties):
+    # Latency comes from the x-created-ns header; the body is never parsed for it
+    latency = latency_seconds(properties)
+    if latency is not None:
+        metrics.observe('latency', queue_name, latency)
+    metrics.increment('throughput', queue_name)
 
 class OrderConsumer(threading.Thread):
     def __init__(self, queue_name):
@@ -34,24 +69,36 @@ class OrderConsumer(threading.Thread):
         self.channel.queue_declare(queue=queue_name, durable=True)
         routing_key = ROUTING_KEYS[queue_name.split('_')[0]]
         self.channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
-        self.channel.basic_qos(prefetch_count=10)
-        self.channel.basic_consume(queue=queue_name, on_message_callback=self.process_message)
-        self.lock = threading.Lock()
+        self.controller = None
+        if ADAPTIVE_PREFETCH and (dispatcher is not None or not BATCH_SIZE):
+            # With the worker pool, the dispatcher sets the controller's share of the workers
+            self.controller = PrefetchController(self.channel, queue_name, initial=PREFETCH_COUNT, metrics=metrics)
+        if dispatcher is not None:
+            # Handlers run in the shared pool; prefetch bounds this consumer's outstanding work
+            dispatcher.consume(self.channel, queue_name, prefetch_count=PREFETCH_COUNT, controller=self.controller)
+        elif BATCH_SIZE:
+            BatchingConsumer(self.channel, queue_name, per_message(handle_order), batch_size=BATCH_SIZE,
+                             max_wait=BATCH_MAX_WAIT,
+                             on_complete=lambda queue_name, method, properties, order_id:
+                             record_processed(queue_name, properties)).consume(prefetch_count=PREFETCH_COUNT)
+        elif self.controller is not None:
+            self.controller.attach()
+            self.channel.basic_consume(queue=queue_name, on_message_callback=self.controller.wrap(self.process_message))
+        else:
+            self.channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+            self.channel.basic_consume(queue=queue_name, on_message_callback=self.process_message)
+        if gauges is not None:
+            gauges.add(queue_name, self.channel, PREFETCH_COUNT, self.controller)
 
     def process_message(self, ch, method, properties, body):
-        message = json.loads(body)
-        start_time = datetime.fromisoformat(message['timestamp'])
-        # Removed logging of processing message
-
-        time.sleep(0.5)  # Simulate processing time reduced to 0.5 sec
+        timer = StageTimer(properties)
+        timer.start()
+        handle_order(self.queue_name, body, properties)
+        timer.finish()
         ch.basic_ack(delivery_tag=method.delivery_tag)
-
-        latency = (datetime.now() - start_time).total_seconds()
-        with self.lock:
-            metrics['latency'][self.queue_name].append(latency)
-            metrics['throughput'][self.queue_name] += 1
-            queue_status[self.queue_name]['processing_time'].append(latency)
-        # Removed logging of processed message
+        timer.ack()
+        timer.record(metrics, self.queue_name)
+        record_processed(self.queue_name, properties)
 
     def run(self):
         # Removed logging of starting consumer
@@ -65,19 +112,27 @@ def generate_random_order(order_type):
     return {
         'order_id': f"{order_type}_{random.randint(1000, 9999)}",
         'customer_id': f"cust_{random.randint(100, 999)}",
-        'items': [f"item_{random.randint(1, 5)}" for _ in range(random.randint(1, 3))],
-        'timestamp': datetime.now().isoformat()
+        'items': [f"item_{random.randint(1, 5)}" for _ in range(random.randint(1, 3))]
     }
 
 def publish_order(order_type, order_data, connection, channel):
     routing_key = ROUTING_KEYS[order_type]
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=json.dumps(order_data))
+    body, properties = encode_order(order_data, MESSAGE_CODEC)  # Creation time goes in the headers
+    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=body,
+                          properties=stamp_published(properties))
     # Removed logging of sent order
 
 def start_producers():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
+    global confirm_publisher
+    if CONFIRM_WINDOW:
+        # Pipelined publisher confirms; publish_order only blocks when the window is full
+        confirm_publisher = ConfirmingPublisher(RABBITMQ_HOST, EXCHANGE_NAME, window=CONFIRM_WINDOW)
+        confirm_publisher.start()
+        connection = channel = confirm_publisher
+    else:
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+        channel = connection.channel()
+        channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
 
     try:
         while True:
@@ -96,21 +151,42 @@ def start_producers():
 def log_metrics():
     while True:
         time.sleep(5)
-        for queue_name, latencies in metrics['latency'].items():
-            avg_latency = sum(latencies[-100:]) / len(latencies[-100:]) if latencies else 0
-            throughput = metrics['throughput'][queue_name] / 5  # Throughput per second over last 5 seconds
-            metrics['throughput'][queue_name] = 0  # Reset throughput counter
-            logging.info(f"{queue_name} - Avg Latency: {avg_latency:.2f}s, Throughput: {throughput:.2f} orders/sec")
-            metrics['latency'][queue_name] = []  # Reset latency list to keep the metrics windowed
+        counters, histograms = metrics.collect()  # Merge all consumer shards for the last 5 seconds
+        for queue_name in QUEUE_NAMES.values():
+            log_prefetch(counters, histograms, queue_name)
+            log_stages(histograms, queue_name)
+            latencies = histograms.get(('latency', queue_name))
+            if latencies is None:
+                continue
+            throughput = counters.get(('throughput', queue_name), 0) / 5  # Throughput per second over last 5 seconds
+            logging.info(f"{queue_name} - Avg Latency: {latencies.mean():.2f}s, {latencies.describe()}, Throughput: {throughput:.2f} orders/sec")
+        if confirm_publisher is not None:
+            confirm_publisher.log_stats()
+
+# Create the worker pool (if any) and start one consumer per queue; benchmark.py calls this too
+def start_consumers():
+    global dispatcher, gauges
+    if EXECUTION_MODE != 'inline':
+        dispatcher = WorkerPoolDispatcher(handle_order, mode=EXECUTION_MODE, max_workers=WORKER_POOL_SIZE,
+                                          stage_metrics=metrics, on_complete=lambda queue_name, method, properties, order_id:
+                                          record_processed(queue_name, properties))
+    if METRICS_PORT is not None:
+        sampler = QueueDepthSampler(QUEUE_NAMES.values(), host=RABBITMQ_HOST)
+        sampler.start()
+        gauges = ConsumerGauges(metrics, sampler, dispatcher)
+        serve_metrics(metrics, METRICS_PORT)
 
-if __name__ == '__main__':
-    # Start consumers for each queue
     consumers = []
     for queue_name in QUEUE_NAMES.values():
         consumer = OrderConsumer(queue_name)
         consumer.daemon = True
         consumer.start()
         consumers.append(consumer)
+    return consumers
+
+if __name__ == '__main__':
+    # Start consumers for each queue
+    consumers = start_consumers()
 
     # Start a thread to log metrics
     metrics_thread = threading.Thread(target=log_metrics, daemon=True)
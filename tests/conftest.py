@@ -0,0 +1,7 @@
+# The scripts live at the repository root and are imported as top-level modules.
+# Tests run against memory_broker, never a real RabbitMQ.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['ORDER_TRANSPORT'] = 'memory'
@@ -0,0 +1,36 @@
+import time
+
+import memory_broker
+from async_consumer import EXCHANGE_NAME, AsyncConsumerEngine
+from transport import pika
+
+
+def test_engine_consumes_on_the_memory_transport_and_requeues_failures():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic')
+    channel.queue_declare(queue='express_orders')
+    channel.queue_bind(queue='express_orders', exchange=EXCHANGE_NAME, routing_key='order.express')
+    for index in range(20):
+        channel.basic_publish(exchange=EXCHANGE_NAME, routing_key='order.express', body=str(index).encode())
+    attempts = []
+    processed = []
+
+    async def handler(queue_name, body, properties):
+        attempts.append(body)
+        if body == b'7' and attempts.count(body) == 1:
+            raise RuntimeError('handler failed')
+        return body
+
+    engine = AsyncConsumerEngine({'express_orders': 'order.express'}, {'express_orders': 3}, handler,
+                                 on_processed=lambda queue_name, result: processed.append(result))
+    engine.start()
+    deadline = time.monotonic() + 5
+    while len(processed) < 20 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    engine.stop()
+    assert sorted(processed, key=int) == [str(index).encode() for index in range(20)]
+    assert attempts.count(b'7') == 2
+    assert channel.queue_declare(queue='express_orders', passive=True).method.message_count == 0
+    connection.close()
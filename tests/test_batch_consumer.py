@@ -0,0 +1,32 @@
+import memory_broker
+from batch_consumer import BatchingConsumer, per_message
+from transport import pika
+
+
+def test_failed_messages_are_requeued_not_dropped():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    channel.queue_declare(queue='bulk_orders')
+    for index in range(4):
+        channel.basic_publish(exchange='', routing_key='bulk_orders', body=str(index).encode())
+    failed = set()
+
+    def handler(queue_name, body, properties):
+        if body in (b'1', b'2') and body not in failed:
+            failed.add(body)
+            raise RuntimeError('handler failed')
+        return body
+
+    completed = []
+    consumer = BatchingConsumer(channel, 'bulk_orders', per_message(handler), batch_size=4, max_wait=0.01,
+                                on_complete=lambda queue_name, method, properties, result: completed.append(result))
+    consumer.consume()
+    for _ in range(100):
+        if len(completed) == 4:
+            break
+        connection.process_data_events(time_limit=0.01)
+    consumer.cancel()
+    assert sorted(completed) == [b'0', b'1', b'2', b'3']
+    assert channel.queue_declare(queue='bulk_orders', passive=True).method.message_count == 0
+    connection.close()
@@ -0,0 +1,36 @@
+from benchmark import baseline_key, load_baseline, regressions, save_baseline
+
+BASELINE = {'variant': 'consumer', 'profile': 'steady', 'drained': True, 'sent': 600, 'completed': 600,
+            'throughput': 10.0, 'latency_p50': 1.0, 'latency_p99': 2.0, 'cpu_seconds': 5.0, 'max_rss_mb': 100.0}
+
+
+def run(**changes):
+    return {**BASELINE, **changes}
+
+
+def test_changes_within_tolerance_are_not_regressions():
+    assert regressions(run(throughput=9.1, latency_p99=2.29, cpu_seconds=3.0), BASELINE) == []
+    assert regressions(run(throughput=1.0), None) == []
+
+
+def test_worse_metrics_and_an_undrained_run_are_regressions():
+    found = regressions(run(throughput=8.0, latency_p50=1.2, drained=False, completed=500), BASELINE)
+    assert found == ['drained 500/600 (baseline drained)',
+                     'throughput 10 -> 8 (-20.0%)',
+                     'latency_p50 1 -> 1.2 (+20.0%)']
+
+
+def test_metrics_missing_from_either_side_are_skipped():
+    assert regressions(run(latency_p99=None), {**BASELINE, 'cpu_seconds': 0}) == []
+
+
+def test_other_transports_keep_their_own_baseline(tmp_path):
+    assert baseline_key(run()) == 'consumer/steady'
+    assert baseline_key(run(transport='rabbitmq')) == 'consumer/steady'
+    assert baseline_key(run(transport='memory')) == 'consumer/steady@memory'
+    path = str(tmp_path / 'baseline.json')
+    save_baseline([run(), run(transport='memory', throughput=500.0)], path)
+    save_baseline([run(throughput=12.0)], path)
+    baseline = load_baseline(path)
+    assert baseline['consumer/steady']['throughput'] == 12.0
+    assert baseline['consumer/steady@memory']['throughput'] == 500.0
@@ -0,0 +1,36 @@
+import time
+
+import memory_broker
+from cancellable_consumer import CancellableConsumer
+from transport import pika
+
+HANDLER_SECONDS = 0.3
+
+
+def test_consumers_stop_together_against_one_deadline():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    channel.queue_declare(queue='slow_orders')
+    handled = []
+
+    def on_message(ch, method, properties, body):
+        time.sleep(HANDLER_SECONDS)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        handled.append(body)
+
+    consumers = [CancellableConsumer('slow_orders', on_message=on_message) for _ in range(4)]
+    for consumer in consumers:
+        consumer.start()
+    for index in range(4):
+        channel.basic_publish(exchange='', routing_key='slow_orders', body=str(index).encode())
+    time.sleep(0.1)  # Every consumer is now inside its handler
+
+    started = time.monotonic()
+    for consumer in consumers:
+        consumer.request_stop(timeout=5)
+    assert all(consumer.wait_stopped() for consumer in consumers)
+    # Signalled together, they finish in about one handler time rather than four
+    assert time.monotonic() - started < 3 * HANDLER_SECONDS
+    assert len(handled) == 4
+    connection.close()
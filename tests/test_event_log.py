@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from event_log import EVENT_PROCESSED, EVENT_RECEIVED, RECORD, EventLogWriter, read_events, to_consumer_logs
+
+SECOND = 1_000_000_000
+
+
+def write_run(path, block_records=4):
+    writer = EventLogWriter(str(path), block_records=block_records)
+    start = 1_700_000_000 * SECOND
+    for sequence in range(10):
+        consumer = 1 + sequence % 2
+        writer.record(EVENT_RECEIVED, consumer, consumer, sequence, start + sequence * SECOND // 2)
+    writer.record(EVENT_PROCESSED, 1, 1, 0, start + 5 * SECOND)
+    writer.close()
+    return start
+
+
+def test_round_trip_through_read_events_and_consumer_logs(tmp_path):
+    path = tmp_path / 'consumer_events.bin'
+    start = write_run(path)
+    events = read_events(str(path))
+    assert len(events) == 11
+    assert list(events['sequence'][:10]) == list(range(10))
+    assert events['timestamp_ns'][3] == start + 3 * SECOND // 2
+    assert events['event'][-1] == EVENT_PROCESSED
+
+    logs = to_consumer_logs(events)
+    assert sorted(logs) == ['1', '2']
+    first = logs['1']
+    assert list(first.message) == [0, 2, 4, 6, 8]
+    assert list(first.received_at - start // SECOND) == [0, 1, 2, 3, 4]
+    assert list(first.processed) == [1, 2, 3, 4, 5]
+    assert np.all(logs['2'].queue == 2)
+
+
+def test_torn_last_record_is_ignored(tmp_path):
+    path = tmp_path / 'consumer_events.bin'
+    write_run(path)
+    with open(path, 'ab') as log:
+        log.write(b'\x01' * (RECORD.size // 2))  # A writer killed in the middle of a record
+    events = read_events(str(path))
+    assert len(events) == 11
+    assert sum(len(log.received_at) for log in to_consumer_logs(events).values()) == 10
+
+
+def test_appending_keeps_one_header_and_empty_logs_read_empty(tmp_path):
+    path = tmp_path / 'consumer_events.bin'
+    EventLogWriter(str(path)).close()
+    assert len(read_events(str(path))) == 0
+    write_run(path)
+    assert len(read_events(str(path))) == 11
+    (tmp_path / 'not_a_log.bin').write_bytes(b'plain text, not an event log')
+    with pytest.raises(ValueError):
+        read_events(str(tmp_path / 'not_a_log.bin'))
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import memory_broker
+from fair_dispatcher import FairDispatcher
+from transport import pika
+
+
+def declare(channel, queue_name):
+    channel.queue_declare(queue=queue_name)
+
+
+def ready(channel):
+    return sum(channel.queue_declare(queue=queue_name, passive=True).method.message_count
+               for queue_name in ('express_orders', 'standard_orders'))
+
+
+def test_default_prefetch_follows_weight_share():
+    dispatcher = FairDispatcher(None, {'express_orders': 3, 'standard_orders': 1}, strict=['priority_orders'],
+                                workers=14)
+    # Shares of 14 workers at weights 3 (strict), 3 and 1, times 1.5
+    assert dispatcher.prefetch == {'priority_orders': 9, 'express_orders': 9, 'standard_orders': 3}
+    assert FairDispatcher(None, {'a': 1}, workers=4, prefetch=7).prefetch == {'a': 7}
+
+
+def test_stop_requeues_buffered_messages():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    for queue_name in ('express_orders', 'standard_orders'):
+        declare(channel, queue_name)
+        for index in range(20):
+            channel.basic_publish(exchange='', routing_key=queue_name, body=str(index).encode())
+
+    handled = []
+    release = threading.Event()
+
+    def handler(queue_name, body, properties):
+        release.wait()
+        handled.append(queue_name)
+
+    dispatcher = FairDispatcher(handler, {'express_orders': 3, 'standard_orders': 1}, workers=2, prefetch=5,
+                                setup=declare)
+    dispatcher.start()
+    time.sleep(0.2)  # Both workers are busy and the rest of each prefetch window is buffered
+    assert sum(len(buffer) for buffer in dispatcher.buffers.values()) == 8
+    stopper = threading.Thread(target=dispatcher.stop, args=(5,))
+    stopper.start()
+    time.sleep(0.1)
+    # Requeued while the two handlers are still running, not only when the connection closes
+    assert ready(channel) == 38
+    release.set()
+    stopper.join()
+    assert len(handled) == 2
+    assert ready(channel) == 38
+    connection.close()
+
+
+def test_failing_handler_requeues_the_message():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    declare(channel, 'express_orders')
+    declare(channel, 'standard_orders')
+    channel.basic_publish(exchange='', routing_key='express_orders', body=b'order')
+    attempts = []
+    done = threading.Event()
+
+    def handler(queue_name, body, properties):
+        attempts.append(body)
+        if len(attempts) == 1:
+            raise RuntimeError('handler failed')
+        done.set()
+
+    dispatcher = FairDispatcher(handler, {'express_orders': 3, 'standard_orders': 1}, workers=1, setup=declare)
+    dispatcher.start()
+    assert done.wait(5)
+    dispatcher.stop(5)
+    assert attempts == [b'order', b'order']
+    assert ready(channel) == 0
+    connection.close()
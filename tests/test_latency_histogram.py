@@ -0,0 +1,95 @@
+import metrics_http
+from latency_histogram import LatencyHistogram
+from metrics_registry import MetricsRegistry
+
+
+def test_cumulative_counts_values_on_a_bound():
+    histogram = LatencyHistogram()
+    for value in (0.001, 0.0025, 0.004, 1.0):
+        histogram.record(value)
+    assert histogram.cumulative((0.0005, 0.001, 0.0025, 0.005, 1.0, 10.0)) == [0, 1, 2, 3, 4, 4]
+
+
+def test_cumulative_clamps_bounds_outside_the_range():
+    histogram = LatencyHistogram(max_value=10.0)
+    histogram.record(0.0)
+    histogram.record(50.0)
+    # 50s is past max_value: it only counts towards bounds at or above the recorded max
+    assert histogram.cumulative((0.0, 10.0, 100.0)) == [1, 1, 2]
+
+
+def test_rendered_le_buckets_include_the_bound():
+    metrics = MetricsRegistry()
+    for wanted in (1, 1, 2, 10, 64):
+        metrics.observe('prefetch_count', 'orders', wanted)
+    text = metrics_http.render(metrics)
+    assert 'orders_prefetch_count_bucket{queue="orders",le="1"} 2' in text
+    assert 'orders_prefetch_count_bucket{queue="orders",le="2"} 3' in text
+    assert 'orders_prefetch_count_bucket{queue="orders",le="5"} 3' in text
+    assert 'orders_prefetch_count_bucket{queue="orders",le="10"} 4' in text
+    assert 'orders_prefetch_count_bucket{queue="orders",le="100"} 5' in text
+
+
+def exact_percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(1, int(round(len(ordered) * q / 100.0))) - 1]
+
+
+def test_percentiles_are_within_the_stated_relative_error():
+    histogram = LatencyHistogram()
+    values = [0.0001 * 1.013 ** step for step in range(900)]  # 100us up to about 11s
+    for value in values:
+        histogram.record(value)
+    error = 1 / 2 ** (histogram.sub_bucket_bits - 1)
+    for q in (1, 25, 50, 90, 95, 99, 99.9, 100):
+        exact = exact_percentile(values, q)
+        assert exact <= histogram.percentile(q) + histogram.unit
+        assert histogram.percentile(q) <= exact * (1 + error) + histogram.unit
+    assert histogram.percentile(100) == max(values)
+
+
+def test_merge_matches_recording_into_one_histogram():
+    combined, first, second = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for index in range(1000):
+        value = (index * 37 % 1000) / 1000.0
+        combined.record(value)
+        (first if index % 3 else second).record(value)
+    first.merge(second)
+    assert first.counts == combined.counts
+    assert (first.count, first.min, first.max) == (combined.count, combined.min, combined.max)
+    assert abs(first.total - combined.total) < 1e-9
+    assert first.summary() == combined.summary()
+
+
+def test_copy_and_difference_give_the_window_since_the_copy():
+    histogram = LatencyHistogram()
+    for value in (0.010, 0.020, 0.030):
+        histogram.record(value)
+    previous = histogram.copy()
+    for value in (1.0, 2.0):
+        histogram.record(value)
+    assert previous.count == 3 and previous.max == 0.030
+    window = histogram.difference(previous)
+    assert window.count == 2
+    assert abs(window.total - 3.0) < 1e-9
+    assert abs(window.percentile(50) - 1.0) / 1.0 < 1 / 64
+    assert window.max == 2.0
+
+
+def test_values_above_max_value_report_the_recorded_max():
+    histogram = LatencyHistogram()
+    histogram.record(5000.0)
+    assert histogram.percentile(99) == 5000.0
+    assert histogram.cumulative((300.0, 3600.0, 5000.0)) == [0, 0, 1]
+    for value in (0.5, 0.6, 0.7):
+        histogram.record(value)
+    assert histogram.percentile(50) < 1.0
+    assert histogram.percentile(99) == 5000.0
+    previous = histogram.copy()
+    histogram.record(4000.0)
+    window = histogram.difference(previous)
+    assert (window.count, window.percentile(50)) == (1, 5000.0)
+    other = LatencyHistogram()
+    other.record(9000.0)
+    histogram.merge(other)
+    assert (histogram.count, histogram.overflow, histogram.percentile(100)) == (6, 3, 9000.0)
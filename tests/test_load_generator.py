@@ -0,0 +1,63 @@
+import pytest
+
+from load_generator import _bounded, schedule
+
+
+def expand(offsets):
+    values = []
+    while True:
+        try:
+            values.append(next(offsets))
+        except StopIteration as stop:
+            return values, stop.value
+
+
+def test_constant_rate_for_a_duration():
+    offsets, end = expand(schedule({'type': 'constant', 'rate': 10, 'duration': 2}))
+    assert len(offsets) == 20
+    assert offsets[:3] == pytest.approx([0.0, 0.1, 0.2])
+    assert end == 2
+
+
+def test_count_ends_where_the_next_message_would_go():
+    offsets, end = expand(schedule({'type': 'constant', 'rate': 5, 'count': 7}))
+    assert len(offsets) == 7
+    assert end == pytest.approx(1.4)
+
+
+def test_bounded_stops_at_the_first_limit():
+    assert expand(_bounded(iter([0.0, 1.0, 2.0, 3.0]), count=10, duration=2.5)) == ([0.0, 1.0, 2.0], 2.5)
+    assert expand(_bounded(iter([0.0, 1.0]), count=5)) == ([0.0, 1.0], 1.0)
+
+
+def test_ramp_sends_the_integral_of_its_rate():
+    offsets, end = expand(schedule({'type': 'ramp', 'start_rate': 10, 'end_rate': 30, 'duration': 10}))
+    # (10 + 30) / 2 messages per second over 10 seconds
+    assert len(offsets) == 200
+    assert end == 10
+    assert offsets[1] - offsets[0] > offsets[-1] - offsets[-2]
+    assert offsets[-1] < 10
+
+
+def test_sequence_steps_run_back_to_back():
+    offsets, end = expand(schedule({'type': 'sequence', 'steps': [
+        {'type': 'constant', 'rate': 10, 'count': 5},
+        {'type': 'constant', 'rate': 2, 'duration': 1},
+    ]}))
+    assert offsets == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 1.0])
+    assert end == pytest.approx(1.5)
+
+
+def test_spike_adds_its_burst_to_the_base_rate():
+    profile = {'type': 'spike', 'base_rate': 1, 'spike_rate': 10, 'period': 10, 'spike_duration': 1, 'duration': 20}
+    offsets, _ = expand(schedule(profile))
+    assert len(offsets) == 2 * (10 + 9)
+    assert sum(1 for offset in offsets if 10 <= offset < 11) == 10
+
+
+def test_poisson_is_reproducible_from_its_seed():
+    profile = {'type': 'poisson', 'rate': 200, 'duration': 50, 'seed': 3}
+    first, _ = expand(schedule(profile))
+    second, _ = expand(schedule(profile))
+    assert first == second
+    assert len(first) == pytest.approx(10000, rel=0.05)
@@ -0,0 +1,46 @@
+import os
+import runpy
+
+import numpy as np
+
+from event_log import EVENT_CREATED, EVENT_RECEIVED, EventLogWriter, read_events
+from log_analytics import latency_summary
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECOND = 1_000_000_000
+
+
+def test_latency_pairs_received_events_with_their_creation_time(tmp_path):
+    path = str(tmp_path / 'consumer_events.bin')
+    writer = EventLogWriter(path)
+    start = 1_700_000_000 * SECOND
+    for sequence, latency in enumerate((0.1, 0.2, 0.3, 0.4), start=1):
+        writer.record(EVENT_CREATED, 1, 1, sequence, start)
+        writer.record(EVENT_RECEIVED, 1, 1, sequence, start + int(latency * SECOND))
+    writer.record(EVENT_CREATED, 2, 2, 1, start)
+    writer.record(EVENT_RECEIVED, 2, 2, 1, start + 2 * SECOND)
+    writer.record(EVENT_RECEIVED, 2, 2, 2, start)  # Published without a creation time
+    writer.close()
+
+    by_consumer = latency_summary(read_events(path))
+    assert list(by_consumer['consumer']) == ['1', '2']
+    assert list(by_consumer['messages']) == [4, 1]
+    assert np.allclose(by_consumer['latency_p50'], [0.25, 2.0])
+    by_queue = latency_summary(read_events(path), by='queue')
+    assert list(by_queue['queue']) == ['1', '2']
+    assert np.allclose(by_queue['latency_p99'], [0.397, 2.0])
+
+
+def test_latency_script_reports_the_consumers_totals(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'consumer_4_logs.txt').write_text(
+        "[2024-11-30 01:25:04] [Consumer-4] Received: Message 1 to Queue 1\n"
+        "[2024-11-30 01:25:04] [Consumer-4] Total Messages Processed: 100\n"
+        "[2024-11-30 01:25:05] [Consumer-4] Received: Message 2 to Queue 1\n"
+        "[2024-11-30 01:26:04] [Consumer-4] Total Messages Processed: 700\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    runpy.run_path(os.path.join(REPO, 'latency.py'), run_name='__main__')
+    output = capsys.readouterr().out
+    assert "Total Messages Processed: 700" in output
+    assert "Elapsed Time (seconds): 60.0" in output
+    assert "Throughput (messages/second): 10.00" in output
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from log_writer import BatchedLogHandler
+
+
+def test_warnings_are_never_dropped_and_drops_are_reported(tmp_path):
+    path = tmp_path / 'orders.log'
+    handler = BatchedLogHandler(str(path), max_queue=2, batch_size=1, report_interval=0)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    write_batch = handler.writer._write_batch
+
+    def slow_write_batch(data):
+        time.sleep(0.002)
+        write_batch(data)
+
+    handler.writer._write_batch = slow_write_batch
+    logger = logging.getLogger('test_log_writer')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for index in range(500):
+            if index % 100 == 0:
+                logger.warning(f"order {index} failed")
+            else:
+                logger.info(f"order {index} processed")
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    text = path.read_text()
+    assert handler.writer.dropped > 0
+    assert all(f"WARNING order {index} failed" in text for index in range(0, 500, 100))
+    assert 'Log writer dropped' in text
@@ -0,0 +1,249 @@
+import asyncio
+
+import pytest
+
+import memory_broker
+from transport import pika
+
+
+def connect():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    return connection, connection.channel()
+
+
+def drain(connection, channel, queue_name, on_message=None):
+    received = []
+
+    def callback(ch, method, properties, body):
+        received.append((body, method))
+        if on_message is not None:
+            on_message(ch, method, properties, body)
+
+    tag = channel.basic_consume(queue=queue_name, on_message_callback=callback)
+    connection.process_data_events(time_limit=0)
+    channel.basic_cancel(tag)
+    return received
+
+
+def test_messages_requeued_one_by_one_keep_their_order():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    for index in range(5):
+        channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+    received = drain(connection, channel, 'orders')
+    # Reject in delivery order, one at a time, as basic_cancel does for undispatched deliveries
+    for _, method in received:
+        channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    redelivered = drain(connection, channel, 'orders', lambda ch, method, properties, body:
+                        ch.basic_ack(delivery_tag=method.delivery_tag))
+    assert [body for body, _ in redelivered] == [b'0', b'1', b'2', b'3', b'4']
+    assert all(method.redelivered for _, method in redelivered)
+    connection.close()
+
+
+def test_requeued_message_goes_back_ahead_of_later_ones():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    for index in range(4):
+        channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+    channel.basic_qos(prefetch_count=2)
+    received = drain(connection, channel, 'orders')
+    assert [body for body, _ in received] == [b'0', b'1']
+    # Requeue the second delivery before the first
+    channel.basic_nack(delivery_tag=received[1][1].delivery_tag, requeue=True)
+    channel.basic_nack(delivery_tag=received[0][1].delivery_tag, requeue=True)
+    channel.basic_qos(prefetch_count=0)
+    redelivered = drain(connection, channel, 'orders', lambda ch, method, properties, body:
+                        ch.basic_ack(delivery_tag=method.delivery_tag))
+    assert [body for body, _ in redelivered] == [b'0', b'1', b'2', b'3']
+    connection.close()
+
+
+def bodies(received):
+    return [body for body, _ in received]
+
+
+def ack(ch, method, properties, body):
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def test_topic_direct_fanout_and_default_routing():
+    connection, channel = connect()
+    for queue_name in ('priority', 'everything', 'direct', 'fanout'):
+        channel.queue_declare(queue=queue_name)
+    channel.exchange_declare(exchange='orders', exchange_type='topic')
+    channel.queue_bind(queue='priority', exchange='orders', routing_key='order.priority')
+    channel.queue_bind(queue='everything', exchange='orders', routing_key='order.#')
+    channel.exchange_declare(exchange='by_key', exchange_type='direct')
+    channel.queue_bind(queue='direct', exchange='by_key', routing_key='standard')
+    channel.exchange_declare(exchange='all', exchange_type='fanout')
+    channel.queue_bind(queue='fanout', exchange='all', routing_key='')
+
+    channel.basic_publish(exchange='orders', routing_key='order.priority', body=b'p')
+    channel.basic_publish(exchange='orders', routing_key='order.express.eu', body=b'e')
+    channel.basic_publish(exchange='orders', routing_key='refund.priority', body=b'unroutable')
+    channel.basic_publish(exchange='by_key', routing_key='standard', body=b's')
+    channel.basic_publish(exchange='by_key', routing_key='express', body=b'unroutable')
+    channel.basic_publish(exchange='all', routing_key='anything', body=b'f')
+    channel.basic_publish(exchange='', routing_key='direct', body=b'default')
+
+    assert bodies(drain(connection, channel, 'priority', ack)) == [b'p']
+    assert bodies(drain(connection, channel, 'everything', ack)) == [b'p', b'e']
+    assert bodies(drain(connection, channel, 'direct', ack)) == [b's', b'default']
+    assert bodies(drain(connection, channel, 'fanout', ack)) == [b'f']
+    connection.close()
+
+
+def test_topic_wildcards():
+    assert memory_broker.topic_matches('order.*', 'order.priority')
+    assert not memory_broker.topic_matches('order.*', 'order.priority.eu')
+    assert memory_broker.topic_matches('order.#', 'order')
+    assert memory_broker.topic_matches('#.eu', 'order.priority.eu')
+    assert not memory_broker.topic_matches('*.priority', 'priority')
+
+
+def test_per_consumer_prefetch_limits_unacked_deliveries():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    for index in range(10):
+        channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+    channel.basic_qos(prefetch_count=3)
+    held = drain(connection, channel, 'orders')
+    assert bodies(held) == [b'0', b'1', b'2']
+    assert channel.queue_declare(queue='orders', passive=True).method.message_count == 7
+    connection.close()
+
+
+def test_global_prefetch_is_shared_by_the_channels_consumers():
+    connection, channel = connect()
+    for queue_name in ('a', 'b'):
+        channel.queue_declare(queue=queue_name)
+        for index in range(5):
+            channel.basic_publish(exchange='', routing_key=queue_name, body=f"{queue_name}{index}".encode())
+    channel.basic_qos(prefetch_count=4, global_qos=True)
+    received = []
+    for queue_name in ('a', 'b'):
+        channel.basic_consume(queue=queue_name, on_message_callback=lambda ch, method, properties, body:
+                              received.append(method))
+    connection.process_data_events(time_limit=0)
+    assert len(received) == 4
+    channel.basic_ack(delivery_tag=received[0].delivery_tag)
+    connection.process_data_events(time_limit=0)
+    assert len(received) == 5
+    connection.close()
+
+
+def test_nack_without_requeue_drops_and_multiple_ack_settles_everything_before():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    for index in range(4):
+        channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+    received = drain(connection, channel, 'orders')
+    channel.basic_nack(delivery_tag=received[0][1].delivery_tag, requeue=False)
+    channel.basic_ack(delivery_tag=received[2][1].delivery_tag, multiple=True)
+    channel.basic_reject(delivery_tag=received[3][1].delivery_tag, requeue=True)
+    assert channel.queue_declare(queue='orders', passive=True).method.message_count == 1
+    assert bodies(drain(connection, channel, 'orders', ack)) == [b'3']
+    connection.close()
+
+
+def test_closing_a_channel_requeues_its_unacked_messages():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    for index in range(3):
+        channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+    consumer_channel = connection.channel()
+    assert len(drain(connection, consumer_channel, 'orders')) == 3
+    consumer_channel.close()
+    assert channel.queue_declare(queue='orders', passive=True).method.message_count == 3
+    connection.close()
+
+
+def test_unknown_delivery_tag_closes_the_channel():
+    connection, channel = connect()
+    with pytest.raises(pika.exceptions.ChannelClosedByBroker) as error:
+        channel.basic_ack(delivery_tag=42)
+    assert error.value.reply_code == memory_broker.PRECONDITION_FAILED
+    assert channel.is_closed
+    connection.close()
+
+
+def test_passive_declares_report_counts_and_missing_queues():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    channel.basic_publish(exchange='', routing_key='orders', body=b'order')
+    channel.basic_consume(queue='orders', on_message_callback=lambda *args: None)
+    channel.basic_publish(exchange='', routing_key='orders', body=b'order')
+    ok = channel.queue_declare(queue='orders', passive=True).method
+    assert (ok.queue, ok.consumer_count) == ('orders', 1)
+    with pytest.raises(pika.exceptions.ChannelClosedByBroker) as error:
+        channel.queue_declare(queue='missing', passive=True)
+    assert error.value.reply_code == memory_broker.NOT_FOUND
+    assert channel.is_closed
+    with pytest.raises(pika.exceptions.ChannelClosedByBroker):
+        connection.channel().exchange_declare(exchange='missing', passive=True)
+    connection.close()
+
+
+def test_cancel_requeues_deliveries_not_yet_dispatched():
+    connection, channel = connect()
+    channel.queue_declare(queue='orders')
+    for index in range(5):
+        channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+    channel.basic_qos(prefetch_count=5)
+    received = []
+
+    def callback(ch, method, properties, body):
+        received.append(body)
+        ch.basic_cancel(method.consumer_tag)
+        # The four deliveries behind this one are back in the queue before the callback returns
+        received.append(ch.queue_declare(queue='orders', passive=True).method.message_count)
+
+    channel.basic_consume(queue='orders', on_message_callback=callback)
+    connection.process_data_events(time_limit=0)
+    assert received == [b'0', 4]
+    connection.close()
+
+
+def test_asyncio_connection_consumes_and_settles():
+    memory_broker.BROKER.reset()
+
+    async def consume():
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+        connection = pika.adapters.asyncio_connection.AsyncioConnection(
+            on_open_callback=opened.set_result, custom_ioloop=loop)
+        await opened
+        channel_open = loop.create_future()
+        connection.channel(on_open_callback=channel_open.set_result)
+        channel = await channel_open
+        declared = loop.create_future()
+        channel.queue_declare(queue='orders', callback=declared.set_result)
+        await declared
+        channel.basic_qos(prefetch_count=2)
+        for index in range(4):
+            channel.basic_publish(exchange='', routing_key='orders', body=str(index).encode())
+        received = []
+        done = loop.create_future()
+
+        def on_message(ch, method, properties, body):
+            received.append((body, method.redelivered))
+            if body == b'1' and not method.redelivered:
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                return
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            if len(received) == 5:
+                done.set_result(None)
+
+        channel.basic_consume(queue='orders', on_message_callback=on_message)
+        await asyncio.wait_for(done, 5)
+        counted = loop.create_future()
+        channel.queue_declare(queue='orders', passive=True, callback=counted.set_result)
+        remaining = (await counted).method.message_count
+        connection.close()
+        return received, remaining
+
+    received, remaining = asyncio.run(consume())
+    assert sorted(received) == [(b'0', False), (b'1', False), (b'1', True), (b'2', False), (b'3', False)]
+    assert remaining == 0
@@ -0,0 +1,38 @@
+import gc
+import threading
+
+from metrics_registry import MetricsRegistry
+
+
+def record(metrics, count):
+    for _ in range(count):
+        metrics.increment('processed', 'orders')
+        metrics.observe('latency', 'orders', 0.01)
+
+
+def test_exited_threads_are_folded_into_retired_shard():
+    metrics = MetricsRegistry()
+    for _ in range(20):
+        threads = [threading.Thread(target=record, args=(metrics, 10)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    gc.collect()
+    counters, histograms = metrics.totals()
+    assert metrics.shards == []
+    assert counters[('processed', 'orders')] == 1000
+    assert histograms[('latency', 'orders')].count == 1000
+
+
+def test_collect_windows_span_retirement():
+    metrics = MetricsRegistry()
+    thread = threading.Thread(target=record, args=(metrics, 5))
+    thread.start()
+    thread.join()
+    assert metrics.collect()[0][('processed', 'orders')] == 5
+    gc.collect()
+    record(metrics, 2)
+    counters, histograms = metrics.collect()
+    assert counters[('processed', 'orders')] == 2
+    assert histograms[('latency', 'orders')].count == 2
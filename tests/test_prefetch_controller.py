@@ -0,0 +1,77 @@
+from prefetch_controller import PrefetchController
+from worker_pool import WorkerPoolDispatcher
+
+
+class FakeChannel:
+    is_open = True
+
+    def __init__(self):
+        self.qos = []
+
+    def basic_qos(self, prefetch_count=0, global_qos=False):
+        self.qos.append((prefetch_count, global_qos))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def handle(controller, clock, service, gap, on_arrival=False):
+    clock.now += gap
+    started = controller.on_delivery(on_arrival=on_arrival)
+    clock.now += service
+    controller.on_done(started)
+
+
+def test_inline_gaps_with_a_buffer_are_not_round_trips():
+    clock = Clock()
+    controller = PrefetchController(FakeChannel(), 'orders', initial=10, adjust_every=1e9, clock=clock)
+    for _ in range(20):
+        handle(controller, clock, service=0.01, gap=0.00001)
+    assert controller.round_trip is None
+
+
+def test_inline_window_of_one_measures_round_trip():
+    clock = Clock()
+    controller = PrefetchController(FakeChannel(), 'orders', initial=1, adjust_every=1e9, clock=clock)
+    for _ in range(20):
+        handle(controller, clock, service=0.01, gap=0.005)
+    assert abs(controller.round_trip - 0.005) < 1e-9
+    assert controller.target()[0] == 2
+
+
+def test_pool_samples_only_when_below_its_share():
+    clock = Clock()
+    controller = PrefetchController(FakeChannel(), 'orders', initial=8, concurrency=2, adjust_every=1e9, clock=clock)
+    first = controller.on_delivery(on_arrival=True)
+    second = controller.on_delivery(on_arrival=True)
+    third = controller.on_delivery(on_arrival=True)
+    clock.now = 0.01
+    controller.on_done(first)  # Two still in flight: the buffer has not run dry
+    clock.now = 0.011
+    fourth = controller.on_delivery(on_arrival=True)
+    assert controller.round_trip is None
+    for started in (second, third, fourth):
+        controller.on_done(started)
+    clock.now = 0.014
+    controller.on_delivery(on_arrival=True)
+    assert abs(controller.round_trip - 0.003) < 1e-9
+
+
+def test_dispatcher_shares_workers_between_channels():
+    dispatcher = WorkerPoolDispatcher(lambda *args: None, max_workers=8)
+    channels = [FakeChannel() for _ in range(4)]
+    controllers = [PrefetchController(channel, 'orders') for channel in channels]
+    try:
+        for channel, controller in zip(channels, controllers):
+            channel.basic_consume = lambda queue, on_message_callback: 'ctag'
+            dispatcher.consume(channel, 'orders', controller=controller)
+        assert [controller.concurrency for controller in controllers] == [2, 2, 2, 2]
+        dispatcher.release(channels[0])
+        assert controllers[1].concurrency == 8 / 3
+    finally:
+        dispatcher.shutdown()
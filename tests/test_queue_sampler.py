@@ -0,0 +1,36 @@
+import time
+
+import memory_broker
+from queue_sampler import QueueDepthSampler
+from transport import pika
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_missing_queue_does_not_hide_later_queues():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    for queue_name, depth in (('first', 1), ('last', 3)):
+        channel.queue_declare(queue=queue_name)
+        for _ in range(depth):
+            channel.basic_publish(exchange='', routing_key=queue_name, body=b'order')
+
+    sampler = QueueDepthSampler(['first', 'missing', 'last'], interval=0.02)
+    sampler.start()
+    try:
+        wait_for(lambda: len(sampler.series) >= 3)
+        assert sampler.latest.depths == {'first': 1, 'last': 3}
+        # Once the queue exists it is sampled like the others
+        channel.queue_declare(queue='missing')
+        channel.basic_publish(exchange='', routing_key='missing', body=b'order')
+        wait_for(lambda: 'missing' in sampler.latest.depths)
+        assert sampler.latest.depths == {'first': 1, 'missing': 1, 'last': 3}
+    finally:
+        sampler.stop()
+        connection.close()
@@ -0,0 +1,91 @@
+import random
+from collections import defaultdict
+
+import memory_broker
+from queue_sharding import ShardedQueue
+from transport import pika
+
+CUSTOMERS = [f"cust_{index}" for index in range(40)]
+
+
+def run_interleaving(seed, steps=400):
+    memory_broker.BROKER.reset()
+    rng = random.Random(seed)
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    received = defaultdict(list)
+
+    def on_message(shard, slot, ch, method, properties, body):
+        customer, sequence = body.decode().split(':')
+        received[customer].append(int(sequence))
+
+    sharded = ShardedQueue(channel, 'orders', on_message, shards=1, max_shards=4, prefetch_count=rng.choice([1, 5, 20]),
+                           check_interval=1e9)
+    sharded.start(connection)
+    sent = defaultdict(int)
+    changes = []
+    for _ in range(steps):
+        action = rng.random()
+        if action < 0.6:
+            customer = rng.choice(CUSTOMERS)
+            sharded.publish(customer, f"{customer}:{sent[customer]}".encode())
+            sent[customer] += 1
+        elif action < 0.9:
+            connection.process_data_events(time_limit=0)
+        elif not sharded.barriers:
+            # Reshard only once the previous change has settled, as check() does
+            if len(sharded.shards) < sharded.max_shards and (rng.random() < 0.5 or len(sharded.shards) == 1):
+                sharded.split('test')
+                changes.append('split')
+            elif len(sharded.shards) > 1:
+                sharded.merge('test')
+                changes.append('merge')
+    for _ in range(1000):
+        if sum(len(sequences) for sequences in received.values()) == sum(sent.values()) and not sharded.barriers:
+            break
+        connection.process_data_events(time_limit=0)
+    connection.close()
+    return sent, received, changes
+
+
+def covers(changes, pattern):
+    remaining = iter(changes)
+    return all(step in remaining for step in pattern)
+
+
+def test_resharding_keeps_per_customer_order():
+    covered = False
+    for seed in range(25):
+        sent, received, changes = run_interleaving(seed)
+        covered = covered or covers(changes, ('split', 'merge', 'split'))
+        for customer, count in sent.items():
+            assert received[customer] == list(range(count)), f"seed {seed}, {customer}"
+    # At least one run went split -> merge -> split
+    assert covered
+
+
+def test_failed_message_is_requeued_ahead_of_later_messages_of_its_key():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    handled = []
+    failed = []
+
+    def on_message(shard, slot, ch, method, properties, body):
+        sequence = int(body)
+        if sequence == 2 and not failed:
+            failed.append(sequence)
+            raise RuntimeError('handler failed')
+        handled.append(sequence)
+
+    sharded = ShardedQueue(channel, 'orders', on_message, prefetch_count=5, check_interval=1e9)
+    sharded.start(connection)
+    for sequence in range(10):
+        sharded.publish('cust_1', str(sequence).encode())
+    for _ in range(100):
+        if len(handled) == 10:
+            break
+        connection.process_data_events(time_limit=0)
+    assert failed == [2]
+    assert handled == list(range(10))
+    connection.close()
@@ -0,0 +1,48 @@
+import logging
+
+import pytest
+
+from scaling_policy import ModelScalingPolicy, QueueSnapshot, ScalingPolicy, ThresholdPolicy
+
+
+def idle(consumers):
+    return QueueSnapshot('orders', 0, consumers, 0, None, 5.0)
+
+
+def busy(consumers):
+    return QueueSnapshot('orders', 500, consumers, 50, 0.5, 5.0)
+
+
+def test_scaling_policy_is_abstract():
+    with pytest.raises(TypeError):
+        ScalingPolicy()
+
+
+def test_no_scale_down_keeps_scale_up_available():
+    policy = ModelScalingPolicy(target_latency=2.0, scale_up_cooldown=5.0, allow_scale_down=False)
+    decision = policy.decide(idle(10), now=100.0)
+    assert decision.target == 10
+    assert decision.reason.startswith('scale-down disabled')
+    # No change was recorded, so the next tick's scale-up is not held back by a cooldown
+    assert policy.decide(busy(10), now=101.0).target > 10
+
+
+def test_model_policy_scales_down_by_default():
+    policy = ModelScalingPolicy(target_latency=2.0, scale_down_cooldown=0.0)
+    assert policy.decide(idle(10), now=100.0).target < 10
+
+
+def test_threshold_policy_without_scale_down():
+    policy = ThresholdPolicy(allow_scale_down=False)
+    assert policy.decide(idle(3), now=0.0).target == 3
+    assert ThresholdPolicy().decide(idle(3), now=0.0).target == 2
+
+
+def test_only_changes_are_logged_at_info(caplog):
+    policy = ThresholdPolicy(scale_up_depth=10, max_consumers=3)
+    with caplog.at_level(logging.DEBUG):
+        policy.decide(QueueSnapshot('orders', 5, 2, 10, 0.5, 5.0), now=1.0)   # hold
+        policy.decide(QueueSnapshot('orders', 50, 2, 10, 0.5, 5.0), now=2.0)  # scale up
+    levels = [(record.levelno, record.getMessage().split(':')[1].strip()) for record in caplog.records]
+    assert levels == [(logging.DEBUG, '2 -> 2 consumers (hold; depth=5, arrival=2.00/s, service=0.500s)'),
+                      (logging.INFO, '2 -> 3 consumers (depth above 10; depth=50, arrival=2.00/s, service=0.500s)')]
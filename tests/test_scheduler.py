@@ -0,0 +1,17 @@
+import importlib
+
+import memory_broker
+
+
+def test_schedulers_do_not_bind_the_metrics_port_when_created(tmp_path, monkeypatch):
+    # Both modules configure a log file in the working directory when imported
+    monkeypatch.chdir(tmp_path)
+    memory_broker.BROKER.reset()
+    for module_name in ('scheduler', 'nscheduler'):
+        module = importlib.import_module(module_name)
+        first = module.CentralizedScheduler(metrics_port=module.METRICS_PORT)
+        second = module.CentralizedScheduler(metrics_port=module.METRICS_PORT)
+        assert first.metrics_server is None and second.metrics_server is None
+        for instance in (first, second):
+            if hasattr(instance, 'connection'):
+                instance.connection.close()
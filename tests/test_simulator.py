@@ -0,0 +1,14 @@
+from scaling_policy import ThresholdPolicy
+from simulator import Simulator
+
+
+def test_report_covers_the_drain_after_the_traffic():
+    # 40 orders in the first 4 seconds, one consumer at 1s each: draining takes until about t=40
+    arrivals = [(index * 0.1, 'orders') for index in range(40)]
+    simulator = Simulator(ThresholdPolicy(max_consumers=1), arrivals, monitor_interval=5.0, initial_consumers=1)
+    reports = simulator.run(4.0, drain_limit=100.0)
+    report = reports['orders']
+    assert report.completed == 40
+    assert report.end_time >= 40.0
+    # One consumer the whole time: the average over the real run length is one, not ten
+    assert abs(report.consumer_seconds / report.end_time - 1.0) < 0.01
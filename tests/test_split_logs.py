@@ -0,0 +1,31 @@
+from split_logs import split_logs
+
+
+def split(tmp_path, text):
+    source = tmp_path / 'consumer_logs.txt'
+    source.write_bytes(text)
+    return split_logs(str(source), str(tmp_path / 'consumer_{}_logs.txt'))
+
+
+def test_torn_total_line_counts_as_malformed(tmp_path):
+    summaries, untagged, malformed = split(tmp_path, (
+        b"[2024-01-01 10:00:00] [Consumer-1] Received: order 1\n"
+        b"[2024-01-01 10:00:01] [Consumer-1] Total Messages Processed: 1\n"
+        b"[2024-01-01 10:00:02] [Consumer-1] Received: order 2\n"
+        b"[2024-01-01 10:00:03] [Consumer-1] Total Messages Processed: \n"
+    ))
+    summary = summaries['1']
+    assert (summary.lines, summary.received, summary.reported_total) == (4, 2, 1)
+    assert (untagged, malformed) == (0, 1)
+    assert summary.last_seen == '2024-01-01 10:00:03'
+
+
+def test_unterminated_tag_is_skipped(tmp_path):
+    summaries, untagged, malformed = split(tmp_path, (
+        b"[2024-01-01 10:00:00] [Consumer-2] Received: order 1\n"
+        b"[2024-01-01 10:00:01] [Consumer-../../etc/passwd Received: order 2\n"
+        b"no tag at all\n"
+    ))
+    assert list(summaries) == ['2']
+    assert (untagged, malformed) == (1, 1)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['consumer_2_logs.txt', 'consumer_logs.txt']
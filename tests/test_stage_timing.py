@@ -0,0 +1,36 @@
+from codec import CREATED_HEADER
+from metrics_registry import MetricsRegistry
+from stage_timing import PUBLISHED_HEADER, StageTimer, breakdown, stamp_published
+from transport import pika
+
+MS = 1_000_000
+
+
+def test_stage_intervals_from_the_stamps():
+    properties = stamp_published(pika.BasicProperties(headers={CREATED_HEADER: 1000 * MS}), now_ns=1002 * MS)
+    assert properties.headers[PUBLISHED_HEADER] == 1002 * MS
+    timer = StageTimer(properties, delivered_ns=1010 * MS)
+    timer.started, timer.finished, timer.acked = 1011 * MS, 1031 * MS, 1032 * MS
+    assert dict(timer.intervals()) == {'produce': 0.002, 'queue': 0.008, 'wait': 0.001, 'service': 0.02,
+                                       'ack': 0.001, 'total': 0.032}
+
+
+def test_missing_stamps_skip_their_intervals_and_skew_is_clamped():
+    timer = StageTimer(pika.BasicProperties(headers={CREATED_HEADER: 2000 * MS}), delivered_ns=1990 * MS)
+    assert dict(timer.intervals()) == {}
+    timer.started = 1995 * MS
+    assert dict(timer.intervals()) == {'wait': 0.005}
+    timer.finished = timer.acked = 1996 * MS
+    # The producer's clock is ahead of the consumer's: the negative total is recorded as 0
+    assert dict(timer.intervals())['total'] == 0.0
+
+
+def test_record_feeds_one_histogram_per_interval():
+    metrics = MetricsRegistry()
+    timer = StageTimer(pika.BasicProperties(), delivered_ns=0)
+    timer.started, timer.finished, timer.acked = 1 * MS, 4 * MS, 5 * MS
+    timer.record(metrics, 'orders')
+    _, histograms = metrics.totals()
+    stages = breakdown(histograms, 'orders')
+    assert sorted(stages) == ['ack', 'service', 'wait']
+    assert stages['service'].count == 1
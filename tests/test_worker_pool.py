@@ -0,0 +1,32 @@
+import memory_broker
+from transport import pika
+from worker_pool import WorkerPoolDispatcher
+
+
+def test_failing_handler_requeues_the_message():
+    memory_broker.BROKER.reset()
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+    channel = connection.channel()
+    channel.queue_declare(queue='orders')
+    channel.basic_publish(exchange='', routing_key='orders', body=b'order')
+    attempts = []
+    completed = []
+
+    def handler(queue_name, body, properties):
+        attempts.append(body)
+        if len(attempts) == 1:
+            raise RuntimeError('handler failed')
+        return body
+
+    dispatcher = WorkerPoolDispatcher(handler, on_complete=lambda queue_name, method, properties, result:
+                                      completed.append((result, method.redelivered)), max_workers=1)
+    dispatcher.consume(channel, 'orders', prefetch_count=1)
+    for _ in range(100):
+        if completed:
+            break
+        connection.process_data_events(time_limit=0.01)
+    dispatcher.shutdown()
+    assert attempts == [b'order', b'order']
+    assert completed == [(b'order', True)]
+    assert channel.queue_declare(queue='orders', passive=True).method.message_count == 0
+    connection.close()
@@ -0,0 +1,32 @@
+# Broker transport selection.
+# Scripts take pika from here ("from transport import pika") instead of
+# importing it directly. By default that is the real pika talking to
+# RabbitMQ; with ORDER_TRANSPORT=memory in the environment, or use('memory')
+# called before the scripts are imported, it is memory_broker's in-process
+# stand-in, so consumers, schedulers and producers run unchanged without a
+# broker (producers and consumers then have to share one process).
+import os
+
+import pika as rabbitmq_pika
+
+TRANSPORTS = ('rabbitmq', 'memory')
+
+name = None
+pika = None
+
+
+# Select the transport for modules imported from now on; returns its pika namespace
+def use(transport):
+    global name, pika
+    if transport == 'memory':
+        import memory_broker
+        pika = memory_broker.pika
+    elif transport == 'rabbitmq':
+        pika = rabbitmq_pika
+    else:
+        raise ValueError(f"Unknown transport {transport!r}, expected one of {TRANSPORTS}")
+    name = transport
+    return pika
+
+
+use(os.environ.get('ORDER_TRANSPORT', 'rabbitmq'))
@@ -0,0 +1,132 @@
+# Offload message handling from the pika I/O thread to a worker pool.
+# The thread driving a BlockingConnection only receives deliveries and
+# settles them; the handler runs in a thread or process pool and the ack
+# is marshalled back with add_callback_threadsafe, so heartbeats and
+# further deliveries keep flowing while orders are being processed.
+# Outstanding work per channel is bounded by its prefetch count.
+# A message whose handler raises is nacked with requeue=True, so the broker
+# redelivers it instead of discarding it (no dead-letter exchange is declared).
+# The pool's workers are one budget shared by every channel consuming
+# through it: each channel's PrefetchController is told its share
+# (max_workers / channels) and rebalanced as channels start and stop.
+import functools
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from stage_timing import StageTimer, timed_call
+
+EXECUTION_MODES = ('inline', 'thread', 'process')
+
+
+def make_executor(mode, max_workers):
+    if mode == 'thread':
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='order-worker')
+    if mode == 'process':
+        return ProcessPoolExecutor(max_workers=max_workers)
+    raise ValueError(f"Unknown execution mode {mode!r}, expected 'thread' or 'process'")
+
+
+class WorkerPoolDispatcher:
+    # handler(queue_name, body, properties) -> result runs in the pool; in process mode it must be a top-level function.
+    # on_complete(queue_name, method, properties, result) runs on the connection thread after the ack.
+    # With stage_metrics (a MetricsRegistry) every message's stage timings are recorded under its queue name.
+    def __init__(self, handler, on_complete=None, mode='thread', max_workers=4, stage_metrics=None):
+        self.handler = handler
+        self.on_complete = on_complete
+        self.stage_metrics = stage_metrics
+        self.mode = mode
+        self.max_workers = max_workers
+        self.executor = make_executor(mode, max_workers)
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.outstanding_by_channel = defaultdict(int)
+        self.consumers = {}  # channel -> PrefetchController or None, for sharing out the workers
+
+    # Start consuming queue_name on channel through the pool.
+    # The broker never delivers more than prefetch_count unacked messages,
+    # which caps the work this channel can have queued in the pool.
+    # With a PrefetchController the limit is tuned at runtime instead.
+    def consume(self, channel, queue_name, prefetch_count=None, controller=None):
+        with self.lock:
+            self.consumers[channel] = controller
+            self._rebalance()
+        if controller is not None:
+            controller.attach()
+        else:
+            channel.basic_qos(prefetch_count=prefetch_count or self.max_workers)
+        return channel.basic_consume(queue=queue_name,
+                                     on_message_callback=functools.partial(self.on_message, queue_name,
+                                                                           controller=controller))
+
+    def on_message(self, queue_name, ch, method, properties, body, controller=None):
+        self._track(ch, 1)
+        started = controller.on_delivery(on_arrival=True) if controller is not None else None
+        if self.stage_metrics is None:
+            timer = None
+            future = self.executor.submit(self.handler, queue_name, body, properties)
+        else:
+            # The handler's start and end are stamped in the pool, where it actually runs
+            timer = StageTimer(properties)
+            future = self.executor.submit(timed_call, self.handler, queue_name, body, properties)
+        complete = functools.partial(self._complete, queue_name, ch, method, properties, future, controller, started,
+                                     timer)
+        future.add_done_callback(lambda _: self._marshal(ch, complete))
+
+    # Runs on a pool thread; hand the settlement back to the connection's own thread
+    def _marshal(self, ch, complete):
+        try:
+            ch.connection.add_callback_threadsafe(complete)
+        except Exception:
+            logging.exception("Connection closed before a processed message could be acked")
+            self._track(ch, -1)
+
+    def _complete(self, queue_name, ch, method, properties, future, controller=None, started=None, timer=None):
+        if not ch.is_open:
+            # The consumer was closed in the meantime; the broker has already requeued the message
+            self._track(ch, -1)
+            return
+        try:
+            result = future.result()
+        except Exception:
+            logging.exception(f"Worker failed to process message from {queue_name}; requeueing it")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        else:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            if timer is not None:
+                result, timer.started, timer.finished = result
+                timer.ack()
+                timer.record(self.stage_metrics, queue_name)
+            if self.on_complete is not None:
+                self.on_complete(queue_name, method, properties, result)
+        finally:
+            self._track(ch, -1)
+            if controller is not None:
+                controller.on_done(started)
+
+    def _track(self, ch, delta):
+        with self.lock:
+            self.outstanding += delta
+            self.outstanding_by_channel[ch] += delta
+            if not self.outstanding_by_channel[ch]:
+                del self.outstanding_by_channel[ch]
+
+    # The channel no longer consumes; its share of the workers goes to the others
+    def release(self, channel):
+        with self.lock:
+            self.consumers.pop(channel, None)
+            self._rebalance()
+
+    def _rebalance(self):
+        share = self.max_workers / max(1, len(self.consumers))
+        for controller in self.consumers.values():
+            if controller is not None:
+                controller.concurrency = share
+
+    # Messages from this channel that are still in the pool or waiting to be acked
+    def pending(self, ch):
+        return self.outstanding_by_channel.get(ch, 0)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)